@@ -0,0 +1,295 @@
+import sys
+import json
+import time
+import platform
+import argparse
+from contextlib import contextmanager
+import numpy as np
+
+import car
+import neural
+import geometry
+import track
+import trackgen
+import population
+from population import PopulationState
+
+from cext import cmodule
+
+# Times the hot paths with the C extension and with the pure Python/NumPy
+# fallback used when it is not built, on tracks and populations of several
+# sizes. Every benchmark is a setup function taking a Bench and returning
+# the function to time, one call of which handles the whole population.
+# It does so either in one batched call or with a Python loop calling the
+# per-car function for every car, which is recorded as the mode of each
+# implementation: only entries of the same mode compare the code itself.
+BENCHMARKS = {}
+MODES = {}
+BATCHED = 'batched'
+PER_CAR = 'per-car'
+
+def benchmark(name, c=BATCHED, python=BATCHED):
+	def register(setup):
+		BENCHMARKS[name] = setup
+		MODES[name] = {'c': c, 'python': python}
+		return setup
+	return register
+
+@contextmanager
+def python_fallback():
+	# every module checks its cmodule global before calling into C
+	modules = (geometry, car, track, neural, population)
+	saved = [module.cmodule for module in modules]
+	for module in modules:
+		module.cmodule = None
+	try:
+		yield
+	finally:
+		for module, saved_cmodule in zip(modules, saved):
+			module.cmodule = saved_cmodule
+
+class Bench(object):
+	# Population spread over the track, the same for both implementations
+	def __init__(self, track, cars, seed=0, sensors=0):
+		self.track = track
+		self.cars = cars
+		rng = np.random.default_rng(seed)
+		self.population = PopulationState(cars, sensors)
+		self.population.put_on_track(track, 25)
+		sections = track.section_array()
+		self.population.section_idx[:] = rng.integers(0, track.length, cars)
+		lines = sections[self.population.section_idx, 16:20]
+		along = rng.uniform(0.2, 0.8, cars)
+		self.population.x[:] = lines[:, 0] + along * (lines[:, 2] - lines[:, 0])
+		self.population.y[:] = lines[:, 1] + along * (lines[:, 3] - lines[:, 1])
+		self.population.rot[:] = sections[self.population.section_idx, 20] + rng.normal(0, 0.1, cars)
+		self.population.steering[:] = rng.uniform(-car.MAX_STEERING, car.MAX_STEERING, cars)
+		self.population.positions[:] = np.stack((self.population.x, self.population.y), axis=-1)
+		self.state = {name: getattr(self.population, name).copy() for name in
+			('x', 'y', 'rot', 'speed', 'steering', 'section_idx', 'collided')}
+
+	def reset(self):
+		for name, values in self.state.items():
+			getattr(self.population, name)[:] = values
+		self.population.active = np.flatnonzero(~self.population.collided).astype(np.int32)
+
+@benchmark('intersection', PER_CAR, PER_CAR)
+def bench_intersection(bench, c):
+	pop = bench.population
+	sides = car.population_sides(pop.x, pop.y, pop.rot).reshape(-1, 4)
+	walls = bench.track.borders[pop.section_idx, 2].repeat(2, axis=0)
+	pairs = [(tuple(side), tuple(wall)) for side, wall in zip(sides, walls)]
+	def run():
+		for side, wall in pairs:
+			geometry.intersection(side, wall)
+	return run
+
+@benchmark('find_population_distances')
+def bench_find_population_distances(bench, c):
+	pop = bench.population
+	def run():
+		car.find_population_distances(bench.track, pop.rig, pop.positions, pop.rot, pop.section_idx, pop.distances)
+	return run
+
+@benchmark('find_rig_distances', PER_CAR, PER_CAR)
+def bench_find_rig_distances(bench, c):
+	pop = bench.population
+	tr = bench.track
+	cars = list(zip(pop.x.tolist(), pop.y.tolist(), pop.rot.tolist(), pop.section_idx.tolist()))
+	if c:
+		def run():
+			for x, y, rot, idx in cars:
+				cmodule.find_rig_distances(tr.ctrack, pop.rig.crig, x, y, rot, idx)
+		return run
+	driver = car.Car()
+	driver.track = tr
+	rig = car.SensorRig(driver, pop.rig.angles, pop.rig.max_distances)
+	def run():
+		for x, y, rot, idx in cars:
+			rig.get_distances((x, y), rot, idx)
+	return run
+
+@benchmark('check_car_collision', c=PER_CAR)
+def bench_check_car_collision(bench, c):
+	pop = bench.population
+	tr = bench.track
+	if c:
+		cars = list(zip(pop.x.tolist(), pop.y.tolist(), pop.rot.tolist(), pop.section_idx.tolist()))
+		def run():
+			for x, y, rot, idx in cars:
+				cmodule.check_car_collision(tr.ctrack, x, y, rot, idx)
+		return run
+	sides = car.population_linecoords(pop.x, pop.y, pop.rot).reshape(-1, 4)
+	def run():
+		tr.geometry.collisions(sides).reshape(-1, 4).any(axis=1)
+	return run
+
+@benchmark('changed_section', c=PER_CAR)
+def bench_changed_section(bench, c):
+	pop = bench.population
+	tr = bench.track
+	if c:
+		cars = list(zip(pop.x.tolist(), pop.y.tolist(), pop.section_idx.tolist()))
+		def run():
+			for x, y, idx in cars:
+				cmodule.changed_section(tr.ctrack, x, y, idx)
+		return run
+	def run():
+		tr.changed_sections(pop.positions, pop.section_idx)
+	return run
+
+@benchmark('move', c=PER_CAR)
+def bench_move(bench, c):
+	pop = bench.population
+	dt = 1/60
+	if c:
+		cars = list(zip(pop.x.tolist(), pop.y.tolist(), pop.rot.tolist(), pop.speed.tolist(), pop.steering.tolist()))
+		def run():
+			for x, y, rot, speed, steering in cars:
+				cmodule.move(x, y, rot, speed, steering, dt)
+		return run
+	x, y, rot = pop.x.copy(), pop.y.copy(), pop.rot.copy()
+	def run():
+		car.move_population(x, y, rot, pop.speed, pop.steering, dt)
+	return run
+
+@benchmark('activate_network', c=PER_CAR)
+def bench_activate_network(bench, c):
+	pop = bench.population
+	inputs = np.concatenate((pop.speed[:, None], np.full((pop.size, pop.rig.size), 50.0)), axis=1)
+	if c:
+		drivers = [neural.CDriver(pop.rig.size + 1) for i in range(pop.size)]
+		pop.network.write_drivers(drivers)
+		rows = [tuple(row) for row in inputs.tolist()]
+		def run():
+			for driver, row in zip(drivers, rows):
+				cmodule.activate_network(driver.network, row)
+		return run
+	def run():
+		pop.network.activate(inputs)
+	return run
+
+@benchmark('car_lines')
+def bench_car_lines(bench, c):
+	pop = bench.population
+	out = np.empty((pop.size, 16), dtype=np.float32)
+	def run():
+		pop.lines(out)
+	return run
+
+@benchmark('frame')
+def bench_frame(bench, c):
+	pop = bench.population
+	def run():
+		if not len(pop.active):
+			bench.reset()
+		pop.step(1/60)
+	return run
+
+def measure(run, min_time=0.2, max_calls=10000):
+	# per call times in ns of at least one call and as many as fit in min_time
+	times = []
+	total = 0
+	while total < min_time * 1e9 and len(times) < max_calls:
+		t1 = time.perf_counter_ns()
+		run()
+		t2 = time.perf_counter_ns()
+		times.append(t2 - t1)
+		total += t2 - t1
+	times = np.array(times)
+	return {
+		'calls': len(times),
+		'mean_ns': float(times.mean()),
+		'median_ns': float(np.median(times)),
+		'min_ns': int(times.min()),
+		'max_ns': int(times.max()),
+	}
+
+def make_track(sections, seed=0):
+	return track.Track() if not sections else trackgen.generate_track(sections, seed=seed)
+
+def run_benchmarks(names, implementations, track_sizes, car_counts, min_time=0.2, seed=0, log=None, sensors=0):
+	results = []
+	for sections in track_sizes:
+		tr = make_track(sections, seed)
+		for cars in car_counts:
+			bench = Bench(tr, cars, seed, sensors)
+			for impl in implementations:
+				c = impl == 'c'
+				if c and not cmodule:
+					continue
+				for name in names:
+					bench.reset()
+					if c:
+						result = measure(BENCHMARKS[name](bench, True), min_time)
+					else:
+						with python_fallback():
+							result = measure(BENCHMARKS[name](bench, False), min_time)
+					result.update(name=name, impl=impl, mode=MODES[name][impl], sections=tr.length, cars=cars,
+						sensors=bench.population.rig.size)
+					results.append(result)
+					if log:
+						log(result)
+	return results
+
+def environment():
+	return {
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'python': sys.version.split()[0],
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'machine': platform.machine(),
+		'processor': platform.processor(),
+		'cmodule': getattr(cmodule, '__file__', None),
+		'threads': PopulationState.threads,
+	}
+
+def compare(results, baseline):
+	# median time ratios of baseline / results for matching entries
+	# (files without modes time a benchmark that has since been renamed)
+	key = lambda r: (r['name'], r['impl'], r.get('mode'), r['sections'], r['cars'])
+	base = {key(r): r for r in baseline['results']}
+	for result in results:
+		other = base.get(key(result))
+		if other:
+			print("%-25s %-6s %-7s %7d sections %6d cars: %6.2fx" % (key(result) + (other['median_ns'] / result['median_ns'],)))
+
+def print_result(result):
+	print("%-25s %-6s %-7s %7d sections %6d cars: %12.1fus median (%d calls)" % (
+		result['name'], result['impl'], result['mode'], result['sections'], result['cars'], result['median_ns'] / 1000, result['calls']))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+		description="Benchmark the C and pure Python hot paths")
+	parser.add_argument('names', nargs='*', metavar='BENCHMARK',
+		help="Benchmarks to run, all of them by default: %s" % ", ".join(BENCHMARKS))
+	parser.add_argument('-i', '--impl', action="store", nargs='+', choices=['c', 'python'], default=['c', 'python'],
+		help="Implementations to time")
+	parser.add_argument('-n', '--cars', action="store", nargs='+', type=int, default=[10, 100, 1000],
+		help="Population sizes")
+	parser.add_argument('-s', '--sections', action="store", nargs='+', type=int, default=[0, 1000, 10000],
+		help="Track sizes, generated tracks except for 0, the built-in one")
+	parser.add_argument('--min-time', action="store", type=float, default=0.2,
+		help="Seconds to spend on every measurement")
+	parser.add_argument('--seed', action="store", type=int, default=0)
+	parser.add_argument('--sensors', action="store", type=int, default=0,
+		help="Sensors of the rig like the --sensors of main.py, 0 for the default rig")
+	parser.add_argument('-t', '--threads', action="store", type=int, default=1,
+		help="Threads of the C population step in the frame benchmark, 0 for one per core")
+	parser.add_argument('-o', '--output', action="store", default=None,
+		help="Write the results as JSON to this file")
+	parser.add_argument('--compare', action="store", default=None, metavar='JSON',
+		help="Print speedups over the results in this file")
+	args = parser.parse_args()
+	for name in args.names:
+		if name not in BENCHMARKS:
+			parser.error("Unknown benchmark %s" % name)
+	PopulationState.threads = args.threads
+
+	results = run_benchmarks(args.names or list(BENCHMARKS), args.impl, args.sections, args.cars, args.min_time, args.seed, print_result, args.sensors)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({'environment': environment(), 'results': results}, f, indent='\t')
+	if args.compare:
+		with open(args.compare) as f:
+			compare(results, json.load(f))
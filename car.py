@@ -4,8 +4,10 @@ import pyglet
 import numpy as np
 from collections import defaultdict
 
+import rng
 import neural
 import drawables
+from timing import timings, now
 import geometry
 from drawables import Entity, Vec
 from geometry import Point, Line, Box, Quad, PI, TAU, DEG_TO_RAD, RAD_TO_DEG
@@ -13,6 +15,153 @@ from pyglet.gl import *
 
 from cext import cmodule
 
+CAR_LENGTH = 30
+CAR_WIDTH = 10
+CORNER_ANGLE = math.atan(CAR_WIDTH / CAR_LENGTH)
+CORNER_DISTANCE = math.hypot(CAR_WIDTH / 2, CAR_LENGTH / 2)
+MAX_STEERING = PI / 4
+LINE_COLOURS = drawables.gradient_line_colours('red', 'green', 'green', 'red')
+
+def rig_config(sensors=0):
+	# (angles, distances) of the sensor rig for the --sensors setting
+	if not sensors:
+		return ((-PI/2, -3 * CORNER_ANGLE, -CORNER_ANGLE,
+			0,
+			CORNER_ANGLE, 3 * CORNER_ANGLE, PI/2),
+			(30, 50, 100, 175, 100, 50, 30))
+	elif sensors == 1:
+		return (0,), (175,)
+	n = sensors // 2 * 2 + 1
+	angles = tuple(-PI/2 + i*PI/(n-1) for i in range(n))
+	distances = (100,) * n
+	return angles, distances
+
+def move_population(x, y, rot, speed, steering, dt, active=None):
+	# Turns the cars around their centre of rotation, where the line through
+	# the front axle along the steered wheels meets the rear axle line, like
+	# the C move_car and Car.move_cor. Arrays are updated in place.
+	hwbase = CAR_LENGTH / 2
+	htrack = CAR_WIDTH / 2
+	moving = speed != 0
+	if active is not None:
+		moving &= active
+	d = speed * dt
+	sdir = np.sin(rot)
+	cdir = np.cos(rot)
+	# the two lines, intersected the same way as the C intersection()
+	x1, y1 = hwbase * sdir, hwbase * cdir
+	x2, y2 = x1 + np.sin(rot + steering + PI/2), y1 + np.cos(rot + steering + PI/2)
+	x3, y3 = htrack * cdir - hwbase * sdir, -htrack * sdir - hwbase * cdir
+	x4, y4 = x3 + np.sin(rot + PI/2), y3 + np.cos(rot + PI/2)
+	dx1, dx2, dy1, dy2 = x1 - x2, x3 - x4, y1 - y2, y3 - y4
+	denom = dx1*dy2 - dy1*dx2
+	turning = (steering != 0) & (denom != 0)
+	a = x3*y4 - y3*x4
+	b = x1*y2 - y1*x2
+	with np.errstate(divide='ignore', invalid='ignore'):
+		corx = (b * dx2 - dx1 * a) / denom
+		cory = (b * dy2 - dy1 * a) / denom
+		angle = d / np.sqrt(cory * cory + corx * corx)
+		angle = np.where(steering < 0, -angle, angle)
+		cos, sin = np.cos(angle), np.sin(angle)
+		dx = np.where(turning, corx - corx * cos - cory * sin, d * sdir)
+		dy = np.where(turning, cory + corx * sin - cory * cos, d * cdir)
+	np.add(x, dx, out=x, where=moving)
+	np.add(y, dy, out=y, where=moving)
+	np.add(rot, angle, out=rot, where=moving & turning)
+
+def population_corners(x, y, rot):
+	# (ncars, 4, 2) array of top left, top right, bottom right and bottom left corners
+	sdism = CORNER_DISTANCE * np.sin(rot - CORNER_ANGLE)
+	cdism = CORNER_DISTANCE * np.cos(rot - CORNER_ANGLE)
+	sdisp = CORNER_DISTANCE * np.sin(rot + CORNER_ANGLE)
+	cdisp = CORNER_DISTANCE * np.cos(rot + CORNER_ANGLE)
+	return np.stack((
+		np.stack((x + sdism, y + cdism), axis=-1),
+		np.stack((x + sdisp, y + cdisp), axis=-1),
+		np.stack((x - sdism, y - cdism), axis=-1),
+		np.stack((x - sdisp, y - cdisp), axis=-1),
+	), axis=1)
+
+def population_sides(x, y, rot):
+	# (ncars, 2, 4) array of the right and left sides of every car, same as Car.lines[1:4:2]
+	corners = population_corners(x, y, rot)
+	return corners[:, [1, 2, 3, 0]].reshape(-1, 2, 4)
+
+def population_linecoords(x, y, rot):
+	# (ncars, 16) array of all four sides of every car, same as Car.linecoords
+	corners = population_corners(x, y, rot)
+	return corners[:, [0, 1, 1, 2, 2, 3, 3, 0]].reshape(-1, 16)
+
+def population_lines(x, y, rot, out, active=None):
+	# Writes population_linecoords into out, an (ncars, 16) float32 array or
+	# another writable buffer of that size, for the active cars (int32 indices)
+	# when given. The C version computes the vertices in place.
+	if cmodule:
+		cmodule.car_lines(x, y, rot, out, active)
+		return out
+	lines = np.asarray(out).reshape(-1, 16)
+	if active is None:
+		lines[:] = population_linecoords(x, y, rot)
+	else:
+		lines[active] = population_linecoords(x[active], y[active], rot[active])
+	return out
+
+def update_population(track, x, y, rot, speed, steering, section_idx, collided, changes, dt, active=None):
+	# Moves all cars that have not collided, checks them for collisions and
+	# section changes. Everything is updated in place: collided cars get
+	# speed 0 and the flag set, changes gets the section step of every car.
+	# active (int32 indices) limits all of it to those cars.
+	# The C version does it all in one call, timed as physics.
+	start = now()
+	if cmodule:
+		cmodule.move_population(track.ctrack, x, y, rot, speed, steering, section_idx, collided, changes, dt, active)
+		timings.add('physics', start)
+	else:
+		idx = np.flatnonzero(~collided) if active is None else active[~collided[active]]
+		xs, ys, rots = x[idx], y[idx], rot[idx]
+		move_population(xs, ys, rots, speed[idx], steering[idx], dt)
+		x[idx], y[idx], rot[idx] = xs, ys, rots
+		start = timings.add('physics', start)
+		changes[idx if active is None else active] = 0
+		hit = track.geometry.collisions(population_linecoords(xs, ys, rots).reshape(-1, 4)).reshape(-1, 4).any(axis=1)
+		speed[idx[hit]] = 0
+		collided[idx[hit]] = True
+		idx = idx[~hit]
+		change = track.geometry.section_changes(np.stack((x[idx], y[idx]), axis=-1), section_idx[idx])
+		changes[idx] = change
+		section_idx[idx] = (section_idx[idx] + change) % track.length
+		timings.add('collision', start)
+	if not track.circular:
+		finish_open_track(track, section_idx, collided, changes, active)
+
+def finish_open_track(track, section_idx, collided, changes, active=None):
+	# driving off either end of an open track finishes the run
+	idx = slice(None) if active is None else active
+	changed, sections = changes[idx], section_idx[idx]
+	collided[idx] |= ((changed > 0) & (sections == 0)) | ((changed < 0) & (sections == track.length - 1))
+
+def find_population_distances(track, rig, positions, rots, section_idxs, out, active=None):
+	# Sensor readings of every car written into out, an (ncars, rig.size) float array.
+	# positions is (ncars, 2), rots and section_idxs (int32) are (ncars,),
+	# active (int32 indices) limits it to those cars.
+	if cmodule:
+		cmodule.find_population_distances(track.ctrack, rig.crig, positions, rots, section_idxs, out, active)
+		return out
+	if active is not None:
+		out[active] = find_population_distances(track, rig, positions[active], rots[active], section_idxs[active],
+			np.empty((len(active), rig.size)))
+		return out
+	angles = rots[:, None] + rig.angles
+	max_distances = np.broadcast_to(rig.max_distances, angles.shape)
+	starts = np.broadcast_to(positions[:, None, :], angles.shape + (2,))
+	ends = starts + np.stack((np.sin(angles), np.cos(angles)), axis=-1) * max_distances[..., None]
+	lines = np.concatenate((starts, ends), axis=-1).reshape(-1, 4)
+	points = track.find_intersections(lines, np.repeat(section_idxs, rig.size))
+	distances = np.hypot(*(points - lines[:, :2]).T).reshape(angles.shape)
+	np.copyto(out, np.where(np.isnan(distances), max_distances, distances))
+	return out
+
 class SensorRig(object):
 	def __init__(self, car, angles, distances):
 		if len(angles) != len(distances):
@@ -23,11 +172,7 @@ class SensorRig(object):
 		self.max_distances = distances
 		self.distances = self.max_distances[:] # copy just in case
 		if cmodule:
-			self.caddr = cmodule.store_sensors(self.angles, self.max_distances)
-
-	def __del__(self):
-		if cmodule:
-			cmodule.delete_sensors(self.caddr)
+			self.crig = cmodule.SensorRig(self.angles, self.max_distances)
 
 	def sensor_distance(self, idx, position, rotation, section_idx):
 		x = position[0] + math.sin(self.angles[idx] + rotation) * self.max_distances[idx]
@@ -41,7 +186,7 @@ class SensorRig(object):
 
 	def get_distances(self, position, rotation, section_idx):
 		if cmodule:
-			self.distances = cmodule.find_rig_distances(self.caddr, *position, rotation, section_idx)
+			self.distances = cmodule.find_rig_distances(self.car.track.ctrack, self.crig, *position, rotation, section_idx)
 		else:
 			self.distances = tuple(self.sensor_distance(i, position, rotation, section_idx) for i in range(self.size))
 
@@ -67,14 +212,14 @@ class Car(Entity):
 		self.human = human
 
 			# physical car parameters
-		self.width = 10
-		self.length = 30
+		self.width = CAR_WIDTH
+		self.length = CAR_LENGTH
 		self.hwbase = self.length / 2
 		self.htrack = self.width / 2
 		self.max_speed = 150
 		self.rot = 0
 		self.speed = 0
-		self.max_steering = PI / 4
+		self.max_steering = MAX_STEERING
 		self.steering = 0
 
 			# for collision detection and box drawings
@@ -90,19 +235,7 @@ class Car(Entity):
 		self.collided = False
 		self.laps = 0
 
-		if not sensors:
-			self.sensors = SensorRig(self,
-				(-PI/2, -3 * self.corner_angle, -self.corner_angle, 
-				0,
-				self.corner_angle, 3 * self.corner_angle, PI/2),
-				(30, 50, 100, 175, 100, 50, 30))
-		elif sensors == 1:
-			self.sensors = SensorRig(self, (0,), (175,))
-		else:
-			n = sensors // 2 * 2 + 1
-			angles = tuple(-PI/2 + i*PI/(n-1) for i in range(n))
-			distances = (100,) * n
-			self.sensors = SensorRig(self, angles, distances)
+		self.sensors = SensorRig(self, *rig_config(sensors))
 			# neural network
 		if cmodule:
 			self.driver = neural.CDriver(1+self.sensors.size)
@@ -115,7 +248,7 @@ class Car(Entity):
 		self.section_batch_idx = -1
 
 	def construct(self):
-		self.line_colours = drawables.gradient_line_colours('red', 'green', 'green', 'red')
+		self.line_colours = LINE_COLOURS
 		self.corner_colours = drawables.vertex_colours('red', 'red', 'green', 'green')
 
 		self.batch.add(4, pyglet.gl.GL_LINE_LOOP, None,
@@ -243,17 +376,17 @@ class Car(Entity):
 	def update_track_c(self, dt):
 		#self.time += dt
 		self.x, self.y, self.rot = cmodule.move(self.x, self.y, self.rot, self.speed, self.steering, dt)
-		side = cmodule.check_car_collision(self.x, self.y, self.rot, self.section_idx)
+		side = cmodule.check_car_collision(self.track.ctrack, self.x, self.y, self.rot, self.section_idx)
 		if side:
 			self.speed = 0
 			self.collided = True
 			self.update = lambda dt: None
 			return
-		change = cmodule.changed_section(self.x, self.y, self.section_idx)
+		change = cmodule.changed_section(self.track.ctrack, self.x, self.y, self.section_idx)
 		if change:
 			self.change_section(self.section_idx + change)
-		self.sensors.distances = cmodule.find_rig_distances(self.sensors.caddr, self.x, self.y, self.rot, self.section_idx)
-		self.steering = self.max_steering * cmodule.activate_network(self.driver.cnetaddr, (self.speed,) + self.sensors.distances)[0]
+		self.sensors.distances = cmodule.find_rig_distances(self.track.ctrack, self.sensors.crig, self.x, self.y, self.rot, self.section_idx)
+		self.steering = self.max_steering * cmodule.activate_network(self.driver.network, (self.speed,) + self.sensors.distances)[0]
 		#self.make_action() # function calls are too expensive
 
 	def make_action(self):
@@ -308,7 +441,10 @@ class Car(Entity):
 		self.y += npos[1] - centre[1]
 		self.rot += angle
 
-	def put_on_track(self, track):
+	def put_on_track(self, track, seed=None, generation=0, idx=0):
+		# the start offset is keyed like the car idx of PopulationState.put_on_track,
+		# a new seed is drawn when none is given
+		seed = rng.new_seed() if seed is None else seed
 		self.winner = False
 		self.collided = False
 		self.track = track
@@ -316,7 +452,7 @@ class Car(Entity):
 		self.time = 0
 		self.position = self.section.quad.line.centre
 		self.rot = self.section.quad.line.angle
-		self.x += np.random.random() * 30 - 15
+		self.x += rng.uniform(seed, generation, idx, 1, 1, rng.STREAM_START)[0, 0] * 30 - 15
 		self.speed = 0
 		self.steering = 0
 		self.last_action = 0
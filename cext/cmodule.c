@@ -2,6 +2,9 @@
 #include "track.h"
 #include "sensors.h"
 #include "neural.h"
+#include "objects.h"
+#include "threads.h"
+#include "rng.h"
 
 static double CAR_LENGTH = 30;
 static double CAR_WIDTH = 10;
@@ -11,8 +14,6 @@ static double H_TRACK;
 static double CORNER[2];
 static double CORNER_ANGLE;
 static double CORNER_DISTANCE;
-// pointer to the array of vertices of all car boxes to be drawn, passed to the VBO
-static float *lines = NULL;
 
 static void set_car_size(double length, double width) {
 	CAR_LENGTH = length;
@@ -62,61 +63,111 @@ static PyObject* py_intersection(PyObject *self, PyObject *args) {
 	}
 }
 
+static inline void rig_distances(const struct Track *track, struct SensorRig *rig, const double *pos, double rot, int section_idx, double *distances) {
+	// every sensor of the rig cast at once, see rays_intersections
+	int i, size = rig->size ? rig->size : 1;
+	coord dx[size], dy[size], t[size];
+	double s = sin(rot);
+	double c = cos(rot);
+
+	for (i=0; i<rig->size; i++) {
+		// the rig's ends turned by rot
+		dx[i] = rig->ends[2*i] * c + rig->ends[2*i+1] * s;
+		dy[i] = rig->ends[2*i+1] * c - rig->ends[2*i] * s;
+		t[i] = 1;
+	}
+	rays_intersections(track, pos, rig->size, dx, dy, t);
+	for (i=0; i<rig->size; i++) {
+		distances[i] = t[i] * rig->sensors[i].distance;
+	}
+}
+
 PyObject* find_rig_distances(PyObject *self, PyObject *args) {
+	struct Track *track;
 	struct SensorRig *rig;
 	double pos[2];
 	double rot;
 	int section_idx;
-	// struct Track *track
 	
-	PARSE(args, "kdddI", &rig, &pos[0], &pos[1], &rot, &section_idx);
+	PARSE(args, "O&O&dddI", as_track, &track, as_rig, &rig, &pos[0], &pos[1], &rot, &section_idx);
+
+	double distances[rig->size];
+	rig_distances(track, rig, pos, rot, section_idx, distances);
 
 	PyObject *intersections = PyTuple_New(rig->size);
 	int i;
-	double point[2];
-	double distance = 0;
-
 	for (i=0; i<rig->size; i++) {
-		get_endpoint(&(rig->sensors[i]), pos, rot, point);
-		double line[4] = {pos[0], pos[1], point[0], point[1]};
-		if (find_section_intersection(line, section_idx, point)) {
-			distance = point_point_distance(pos, point);
-		} else {
-			distance = rig->sensors[i].distance;
-		}
-		PyTuple_SET_ITEM(intersections, i, Py_BuildValue("d", distance));
+		PyTuple_SET_ITEM(intersections, i, PyFloat_FromDouble(distances[i]));
 	}
 	
 	return intersections;
 }
 
-PyObject *py_store_track(PyObject *self, PyObject *args) {
-	PyObject *sections;
-	if (!PyArg_ParseTuple(args, "O", &sections)) {
-		return NULL;
-	}
-
-	struct Track *track = store_track(sections);
-
-	return Py_BuildValue("k", track);
-}
-
-PyObject* py_delete_track(PyObject *self, PyObject *args) {
+PyObject* find_population_distances(PyObject *self, PyObject *args) {
+	/*
+	Fills `out` (ncars x rig size doubles) with the sensor readings of
+	every car given its position (ncars x 2 doubles), rotation (doubles)
+	and section index (ints). With an array of car indices (ints) only
+	those cars are measured.
+	 */
 	struct Track *track;
+	struct SensorRig *rig;
+	PyObject *objs[4];
+	PyObject *active_obj = NULL;
 
-	PARSE(args, "k", &track);
-
-	delete_track(track);
+	PARSE(args, "O&O&OOOO|O", as_track, &track, as_rig, &rig, &objs[0], &objs[1], &objs[2], &objs[3], &active_obj);
+	Py_ssize_t n = PyObject_Length(objs[1]);
+	if (n < 0) {
+		return NULL;
+	}
+	Py_buffer active_view;
+	int *active;
+	Py_ssize_t count, k;
+	if (!get_indices(active_obj, &active_view, n, &active, &count)) {
+		return NULL;
+	}
+	const char types[4] = {'d', 'd', 'i', 'd'};
+	const Py_ssize_t lengths[4] = {2 * n, n, n, rig->size * n};
+	const bool writable[4] = {false, false, false, true};
+	Py_buffer views[4];
+	int i, a;
+	for (a=0; a<4; a++) {
+		if (!get_array(objs[a], &views[a], types[a], lengths[a], writable[a])) {
+			for (i=0; i<a; i++) {
+				PyBuffer_Release(&views[i]);
+			}
+			if (active) {
+				PyBuffer_Release(&active_view);
+			}
+			return NULL;
+		}
+	}
+	double *positions = views[0].buf;
+	double *rots = views[1].buf;
+	int *section_idxs = views[2].buf;
+	double *out = views[3].buf;
+
+	for (k=0; k<count; k++) {
+		i = active ? active[k] : k;
+		rig_distances(track, rig, &positions[2*i], rots[i], section_idxs[i], &out[rig->size*i]);
+	}
 
+	for (a=0; a<4; a++) {
+		PyBuffer_Release(&views[a]);
+	}
+	if (active) {
+		PyBuffer_Release(&active_view);
+	}
 	Py_RETURN_NONE;
 }
 
 PyObject* check_box_collision(PyObject *self, PyObject *args) {
+	struct Track *track;
 	double corners[8];
 	int section_idx;
 	PyObject *c;
 	
-	PARSE(args, "OI", &c, &section_idx);
+	PARSE(args, "O&OI", as_track, &track, &c, &section_idx);
 
 	int i;
 	for (i=0; i<8; i++) {
@@ -131,7 +182,7 @@ PyObject* check_box_collision(PyObject *self, PyObject *args) {
 	};
 
 	for (i=0; i<4; i++) {
-		if (find_section_intersection(box[i], section_idx, 0)) {
+		if (find_track_intersection(track, box[i], NULL)) {
 			return Py_BuildValue("I", i+1);
 		}
 	}
@@ -139,13 +190,7 @@ PyObject* check_box_collision(PyObject *self, PyObject *args) {
 	return Py_BuildValue("I", 0);
 }
 
-PyObject* check_car_collision(PyObject *self, PyObject *args) {
-	double pos[2];
-	double rot;
-	int section_idx;
-	
-	PARSE(args, "dddI", &pos[0], &pos[1], &rot, &section_idx);
-
+static int car_collision(const struct Track *track, const double *pos, double rot, int section_idx) {
 	double sin_m = CORNER_DISTANCE * sin(rot - CORNER_ANGLE);
 	double sin_p = CORNER_DISTANCE * sin(rot + CORNER_ANGLE);
 	double cos_m = CORNER_DISTANCE * cos(rot - CORNER_ANGLE);
@@ -160,42 +205,82 @@ PyObject* check_car_collision(PyObject *self, PyObject *args) {
 
 	int i;
 	for (i=0; i<4; i++) {
-		if (find_section_intersection(box[i], section_idx, 0)) {
-			return Py_BuildValue("I", i+1);
+		if (find_track_intersection(track, box[i], NULL)) {
+			return i+1;
 		}
 	}
 
-	return Py_BuildValue("I", 0);
+	return 0;
+}
+
+PyObject* check_car_collision(PyObject *self, PyObject *args) {
+	struct Track *track;
+	double pos[2];
+	double rot;
+	int section_idx;
+	
+	PARSE(args, "O&dddI", as_track, &track, &pos[0], &pos[1], &rot, &section_idx);
+
+	return Py_BuildValue("I", car_collision(track, pos, rot, section_idx));
 }
 
 PyObject* changed_section(PyObject* self, PyObject *args) {
+	struct Track *track;
 	double pos[2];
 	int section_idx;
 	
-	PARSE(args, "ddI", &pos[0], &pos[1], &section_idx);
+	PARSE(args, "O&ddI", as_track, &track, &pos[0], &pos[1], &section_idx);
 
-	int change = out_of_section(pos, section_idx);
+	int change = out_of_section(track, pos, section_idx);
 
 	return Py_BuildValue("i", change);
 }
 
 PyObject *car_lines(PyObject *self, PyObject *args) {
-	PyObject *cars;
-	int carnum;
-
-	PARSE(args, "OI", &cars, &carnum);
-
-	if (!lines) {
-		lines = malloc(sizeof(float) * carnum * 16);
+	/*
+	Writes the four sides of every car given its x, y and rot (doubles)
+	into `out` (ncars x 16 floats, a numpy array or any writable buffer
+	such as a mapped VBO) as GL_LINES vertices. With an array of car
+	indices (ints) only those cars are written, the rest is left as is.
+	 */
+	PyObject *objs[4];
+	PyObject *active_obj = NULL;
+
+	PARSE(args, "OOOO|O", &objs[0], &objs[1], &objs[2], &objs[3], &active_obj);
+	Py_ssize_t n = PyObject_Length(objs[0]);
+	if (n < 0) {
+		return NULL;
 	}
+	Py_buffer active_view;
+	int *active;
+	Py_ssize_t count, k;
+	if (!get_indices(active_obj, &active_view, n, &active, &count)) {
+		return NULL;
+	}
+	static const char types[4] = {'d', 'd', 'd', 'f'};
+	const Py_ssize_t lengths[4] = {n, n, n, 16 * n};
+	Py_buffer views[4];
+	int i, j, a;
+	for (a=0; a<4; a++) {
+		if (!get_array(objs[a], &views[a], types[a], lengths[a], a == 3)) {
+			for (i=0; i<a; i++) {
+				PyBuffer_Release(&views[i]);
+			}
+			if (active) {
+				PyBuffer_Release(&active_view);
+			}
+			return NULL;
+		}
+	}
+	double *xs = views[0].buf;
+	double *ys = views[1].buf;
+	double *rots = views[2].buf;
+	float *lines = views[3].buf;
 
-	int i = 0;
-	int j;
-	PyObject *car;
-	float sin_m, sin_p, cos_m, cos_p;
-	while ((car = PyIter_Next(cars))) {
-		double x, y, rot;
-		PyArg_ParseTuple(car, "ddd", &x, &y, &rot);
+	double sin_m, sin_p, cos_m, cos_p;
+	for (k=0; k<count; k++) {
+		i = active ? active[k] : k;
+		double x = xs[i], y = ys[i], rot = rots[i];
 
 		sin_m = CORNER_DISTANCE * sin(rot - CORNER_ANGLE);
 		sin_p = CORNER_DISTANCE * sin(rot + CORNER_ANGLE);
@@ -209,48 +294,49 @@ PyObject *car_lines(PyObject *self, PyObject *args) {
 			{x - sin_p, y - cos_p}	// bottom left
 		};
 
+		float *car = &lines[16*i];
 		for (j=0; j<16; j++) {
-			lines[i+j] = corners[((j+2)&0xf)>>2][j%2];
+			car[j] = corners[((j+2)&0xf)>>2][j%2];
 		}
-		i += 16;
-
-		Py_DECREF(car);
 	}
 
-	return Py_BuildValue("k", lines);
+	for (a=0; a<4; a++) {
+		PyBuffer_Release(&views[a]);
+	}
+	if (active) {
+		PyBuffer_Release(&active_view);
+	}
+	Py_RETURN_NONE;
 }
 
-PyObject* move(PyObject *self, PyObject *args) {
-	double pos[2];
-	double rot;
-	double steering;
-	double speed;
-	double dt;
-
-	PARSE(args, "dddddd", &pos[0], &pos[1], &rot, &speed, &steering, &dt);
-
+static void move_car(double *pos, double *rot, double speed, double steering, double dt) {
 	if (!speed) {
-		return Py_BuildValue("ddd", pos[0], pos[1], rot);
+		return;
 	}
 
 	double d = speed * dt;
+	double r = *rot;
 	if (!steering) {
-		return Py_BuildValue("ddd", pos[0] + d * sin(rot), pos[1] + d * cos(rot), rot);
+		pos[0] += d * sin(r);
+		pos[1] += d * cos(r);
+		return;
 	}
 
-	double steer_line[4] = {H_WHEELBASE * sin(rot), H_WHEELBASE * cos(rot),0,0};
-	steer_line[2] = steer_line[0] + sin(rot + steering + M_PI/2);
-	steer_line[3] = steer_line[1] + cos(rot + steering + M_PI/2);
+	double steer_line[4] = {H_WHEELBASE * sin(r), H_WHEELBASE * cos(r),0,0};
+	steer_line[2] = steer_line[0] + sin(r + steering + M_PI/2);
+	steer_line[3] = steer_line[1] + cos(r + steering + M_PI/2);
 	double back_line[4] = {
-		 H_TRACK * cos(rot) -H_WHEELBASE * sin(rot),
-		-H_TRACK * sin(rot) -H_WHEELBASE * cos(rot),
+		 H_TRACK * cos(r) -H_WHEELBASE * sin(r),
+		-H_TRACK * sin(r) -H_WHEELBASE * cos(r),
 		0,0
 	};
-	back_line[2] = back_line[0] + sin(rot + M_PI/2);
-	back_line[3] = back_line[1] + cos(rot + M_PI/2);
+	back_line[2] = back_line[0] + sin(r + M_PI/2);
+	back_line[3] = back_line[1] + cos(r + M_PI/2);
 	double cor[2];
 	if (!intersection(steer_line, back_line, cor, LINE_LINE)) {
-		return Py_BuildValue("ddd", pos[0] + d * sin(rot), pos[1] + d * cos(rot), rot);
+		pos[0] += d * sin(r);
+		pos[1] += d * cos(r);
+		return;
 	}
 
 	double radius = point_origin_distance(cor);
@@ -260,46 +346,441 @@ PyObject* move(PyObject *self, PyObject *args) {
 	}
 	pos[0] += cor[0] - cor[0] * cos(angle) - cor[1] * sin(angle);
 	pos[1] += cor[1] + cor[0] * sin(angle) - cor[1] * cos(angle);
-	rot += angle;
+	*rot = r + angle;
+}
+
+PyObject* move(PyObject *self, PyObject *args) {
+	double pos[2];
+	double rot;
+	double steering;
+	double speed;
+	double dt;
+
+	PARSE(args, "dddddd", &pos[0], &pos[1], &rot, &speed, &steering, &dt);
+
+	move_car(pos, &rot, speed, steering, dt);
 
 	return Py_BuildValue("ddd", pos[0], pos[1], rot);
 }
 
-PyObject* py_create_network(PyObject *self, PyObject *args) {
-	int inputs;
-	PyObject *layers; // a tuple with neurons at each layer after the input;
+struct Cars {
+	// columns of a PopulationState
+	double *x, *y, *rot, *speed, *steering;
+	int *section_idx;
+	unsigned char *collided;
+	int *changes;
+};
+
+static const char CARS_TYPES[8] = {'d', 'd', 'd', 'd', 'd', 'i', '?', 'i'};
+
+static void point_cars(struct Cars *cars, Py_buffer *views) {
+	cars->x = views[0].buf;
+	cars->y = views[1].buf;
+	cars->rot = views[2].buf;
+	cars->speed = views[3].buf;
+	cars->steering = views[4].buf;
+	cars->section_idx = views[5].buf;
+	cars->collided = views[6].buf;
+	cars->changes = views[7].buf;
+}
 
-	PARSE(args, "iO", &inputs, &layers);
-	int hidden = PySequence_Length(layers);
-	struct Network *net = create_network(inputs);
-	int i, neurons;
-	add_layer(net, inputs);
-	for (i=0; i < hidden; i++) {
-		neurons = PyLong_AsLong(PyTuple_GET_ITEM(layers, i));
-		add_layer(net, neurons);
+static inline bool physics_step(const struct Track *track, struct Cars *cars, int i, double dt) {
+	// moves car i, returns whether it is still driving afterwards
+	cars->changes[i] = 0;
+	if (cars->collided[i]) {
+		return false;
 	}
+	double pos[2] = {cars->x[i], cars->y[i]};
+	move_car(pos, &cars->rot[i], cars->speed[i], cars->steering[i], dt);
+	cars->x[i] = pos[0];
+	cars->y[i] = pos[1];
+	if (car_collision(track, pos, cars->rot[i], cars->section_idx[i])) {
+		cars->speed[i] = 0;
+		cars->collided[i] = 1;
+		return false;
+	}
+	int change = cars->changes[i] = out_of_section(track, pos, cars->section_idx[i]);
+	if (change) {
+		cars->section_idx[i] = (cars->section_idx[i] + change + track->length) % track->length;
+	}
+	return true;
+}
+
+PyObject* move_population(PyObject *self, PyObject *args) {
+	/*
+	Moves every car that has not collided yet, checks it against the track
+	and switches its section, all in place on the given arrays:
+	x, y, rot, speed, steering (double), section_idx (int), collided (bool),
+	changes (int, section change of this step written out). With an array
+	of car indices (ints) only those cars are looked at.
+	 */
+	struct Track *track;
+	PyObject *objs[8];
+	PyObject *active_obj = NULL;
+	double dt;
 
-	return Py_BuildValue("k", net);
+	PARSE(args, "O&OOOOOOOOd|O", as_track, &track, &objs[0], &objs[1], &objs[2], &objs[3], &objs[4],
+		&objs[5], &objs[6], &objs[7], &dt, &active_obj);
+	Py_ssize_t n = PyObject_Length(objs[0]);
+	if (n < 0) {
+		return NULL;
+	}
+	Py_buffer active_view;
+	int *active;
+	Py_ssize_t count, k;
+	if (!get_indices(active_obj, &active_view, n, &active, &count)) {
+		return NULL;
+	}
+	const Py_ssize_t lengths[8] = {n, n, n, n, n, n, n, n};
+	const bool writable[8] = {true, true, true, true, true, true, true, true};
+	Py_buffer views[8];
+	if (!get_arrays(objs, views, 8, CARS_TYPES, lengths, writable)) {
+		if (active) {
+			PyBuffer_Release(&active_view);
+		}
+		return NULL;
+	}
+	struct Cars cars;
+	point_cars(&cars, views);
+
+	for (k=0; k<count; k++) {
+		physics_step(track, &cars, active ? active[k] : k, dt);
+	}
+
+	release_arrays(views, 8);
+	if (active) {
+		PyBuffer_Release(&active_view);
+	}
+	Py_RETURN_NONE;
 }
 
-PyObject* py_delete_network(PyObject *self, PyObject *args) {
-	struct Network *net;
+// most layers of a network evaluated by step_population and rollout
+#define MAX_LAYERS 32
+
+struct Step {
+	// everything car_step needs, shared by all threads
+	const struct Track *track;
+	struct SensorRig *rig;
+	struct Cars cars;
+	double *distances;
+	const int *active;
+	double dt;
+	const double *genomes;	// NULL to leave the steering alone
+	Py_ssize_t ngenes;
+	int layers[MAX_LAYERS];
+	int layernum;
+	double bias;
+	double max_steering;
+};
+
+static bool parse_layers(struct Step *step, PyObject *layers_obj, bool inference) {
+	// neurons of every layer and the genes of one network into step
+	PyObject *layers = PySequence_Fast(layers_obj, "layers must be a sequence");
+	if (!layers) {
+		return false;
+	}
+	step->layernum = PySequence_Fast_GET_SIZE(layers);
+	if (step->layernum > MAX_LAYERS) {
+		PyErr_Format(PyExc_ValueError, "Networks can have at most %d layers", MAX_LAYERS);
+		Py_DECREF(layers);
+		return false;
+	}
+	int l, inputs = step->rig->size + 1;
+	step->ngenes = 0;
+	for (l=0; l<step->layernum; l++) {
+		step->layers[l] = PyLong_AsLong(PySequence_Fast_GET_ITEM(layers, l));
+		if (step->layers[l] <= 0) {
+			if (!PyErr_Occurred()) {
+				PyErr_SetString(PyExc_ValueError, "Layers must have at least one neuron");
+			}
+			Py_DECREF(layers);
+			return false;
+		}
+		step->ngenes += step->layers[l] * (inputs + 1);
+		inputs = step->layers[l];
+	}
+	Py_DECREF(layers);
+	if (inference && !step->layernum) {
+		PyErr_SetString(PyExc_ValueError, "A network needs at least one layer");
+		return false;
+	}
+	return true;
+}
+
+static inline bool car_step(struct Step *s, int i, double *input, double *output) {
+	// physics_step, sensors and steering of car i, input and output are
+	// scratch space for the network
+	struct Cars *cars = &s->cars;
+	if (!physics_step(s->track, cars, i, s->dt)) {
+		return false;
+	}
+	double pos[2] = {cars->x[i], cars->y[i]};
+	double *distances = &s->distances[s->rig->size * i];
+	rig_distances(s->track, s->rig, pos, cars->rot[i], cars->section_idx[i], distances);
+	if (s->genomes) {
+		input[0] = cars->speed[i];
+		memcpy(&input[1], distances, s->rig->size * sizeof(double));
+		activate_genome(&s->genomes[s->ngenes * i], s->rig->size + 1, s->layers, s->layernum, s->bias, input, output);
+		cars->steering[i] = s->max_steering * output[0];
+	}
+	return true;
+}
+
+static void step_cars(void *arg, Py_ssize_t begin, Py_ssize_t end) {
+	struct Step *s = arg;
+	double input[s->rig->size + 1];
+	double output[s->layernum ? s->layers[s->layernum-1] : 1];
+	Py_ssize_t k;
+	for (k=begin; k<end; k++) {
+		car_step(s, s->active ? s->active[k] : k, input, output);
+	}
+}
+
+PyObject* step_population(PyObject *self, PyObject *args) {
+	/*
+	One whole timestep of a population: move_population, then the sensor
+	readings (ncars x rig size doubles) of the cars still driving and,
+	unless genomes is None, their new steering from their networks. The
+	genomes are (ncars x genes) doubles of tanh networks laid out like
+	export_network with the given neurons in every layer after the input
+	(speed and the readings). Cars are split over `threads` threads
+	(0 for one per core) and the GIL is released while they run.
+	 */
+	struct Step step;
+	PyObject *objs[10];
+	PyObject *genomes_obj, *layers_obj;
+	PyObject *active_obj = NULL;
+	int threads = 1;
+
+	PARSE(args, "O&O&OOOOOOOOOdOOdd|Oi", as_track, &step.track, as_rig, &step.rig, &objs[0], &objs[1], &objs[2],
+		&objs[3], &objs[4], &objs[5], &objs[6], &objs[7], &objs[8], &step.dt, &genomes_obj, &layers_obj, &step.bias,
+		&step.max_steering, &active_obj, &threads);
+	Py_ssize_t n = PyObject_Length(objs[0]);
+	if (n < 0) {
+		return NULL;
+	}
+	bool inference = genomes_obj != Py_None;
+	if (!parse_layers(&step, layers_obj, inference)) {
+		return NULL;
+	}
 
-	PARSE(args, "k", &net);
+	Py_buffer active_view;
+	int *active;
+	Py_ssize_t count;
+	if (!get_indices(active_obj, &active_view, n, &active, &count)) {
+		return NULL;
+	}
+	step.active = active;
+
+	objs[9] = genomes_obj;
+	char types[10];
+	memcpy(types, CARS_TYPES, 8);
+	types[8] = 'd';
+	types[9] = 'd';
+	const Py_ssize_t lengths[10] = {n, n, n, n, n, n, n, n, step.rig->size * n, step.ngenes * n};
+	const bool writable[10] = {true, true, true, true, true, true, true, true, true, false};
+	Py_buffer views[10];
+	int nviews = inference ? 10 : 9;
+	if (!get_arrays(objs, views, nviews, types, lengths, writable)) {
+		if (active) {
+			PyBuffer_Release(&active_view);
+		}
+		return NULL;
+	}
+	point_cars(&step.cars, views);
+	step.distances = views[8].buf;
+	step.genomes = inference ? views[9].buf : NULL;
 
-	delete_network(net);
+	Py_BEGIN_ALLOW_THREADS
+	parallel_for(threads, count, step_cars, &step);
+	Py_END_ALLOW_THREADS
 
+	release_arrays(views, nviews);
+	if (active) {
+		PyBuffer_Release(&active_view);
+	}
 	Py_RETURN_NONE;
 }
 
-PyObject* py_copy_network(PyObject *self, PyObject *args) {
-	struct Network *net;
+struct Rollout {
+	struct Step step;
+	bool circular;
+	Py_ssize_t max_steps;	// negative for no limit
+	double stall_time;		// 0 never retires stalled cars
+	double min_speed;
+	double *time, *fitness, *best, *progress_time, *distance;
+	int *laps;
+	unsigned char *stalled;
+	Py_ssize_t *steps;		// steps every car drove
+};
 
-	PARSE(args, "k", &net);
+static void rollout_cars(void *arg, Py_ssize_t begin, Py_ssize_t end) {
+	/*
+	Every car on its own until it is done, they don't interact so there is
+	no need to keep them in step. Each iteration is what PopulationState.step
+	does for a car.
+	 */
+	struct Rollout *r = arg;
+	struct Step *s = &r->step;
+	struct Cars *cars = &s->cars;
+	int length = s->track->length;
+	double input[s->rig->size + 1];
+	double output[s->layernum ? s->layers[s->layernum-1] : 1];
+	Py_ssize_t k, t;
+	for (k=begin; k<end; k++) {
+		int i = s->active ? s->active[k] : k;
+		for (t=0; !cars->collided[i] && t != r->max_steps; t++) {
+			r->time[i] += s->dt;
+			car_step(s, i, input, output);
+			int change = cars->changes[i];
+			int section = cars->section_idx[i];
+			bool lap = change > 0 && section == 0;
+			bool back = change < 0 && section == length - 1;
+			if (!r->circular && (lap || back)) {
+				// driving off either end of an open track finishes the run
+				cars->collided[i] = 1;
+			}
+			r->laps[i] += lap - back;
+			r->fitness[i] = r->laps[i] * length + section;
+			if (!r->stall_time) {
+				continue;
+			}
+			if (r->fitness[i] > r->best[i]) {
+				r->best[i] = r->fitness[i];
+				r->progress_time[i] = r->time[i];
+			}
+			bool stalled = r->time[i] - r->progress_time[i] > r->stall_time;
+			if (r->min_speed) {
+				r->distance[i] += fabs(cars->speed[i]) * s->dt;
+				stalled |= r->time[i] > r->stall_time && r->distance[i] < r->min_speed * r->time[i];
+			}
+			if (stalled && !cars->collided[i]) {
+				r->stalled[i] = 1;
+				cars->collided[i] = 1;
+				cars->speed[i] = 0;
+			}
+		}
+		r->steps[k] = t;
+	}
+}
 
-	struct Network *net_copy = copy_network(net);
+#define ROLLOUT_COLUMNS 16
+
+PyObject* rollout(PyObject *self, PyObject *args) {
+	/*
+	Runs a whole generation of a population: every car that has not
+	collided is stepped like step_population does until it collides,
+	drives off an open track, stalls or max_steps (negative for no limit)
+	went by. population is a PopulationState or anything else with its
+	columns: x, y, rot, speed, steering (double), section_idx (int),
+	collided (bool), changes (int), distances (ncars x rig size double),
+	laps (int), fitness, time, best, progress_time, distance (double) and
+	stalled (bool). They are all updated in place, so fitness, section_idx,
+	laps and time hold the results afterwards. Stalling works like
+	PopulationState.retire_stalled with the given stall_time and min_speed.
+	genomes, layers, bias, max_steering, active and threads are the same
+	as for step_population. Returns the number of steps the longest
+	running car drove, which is how long the generation took.
+	 */
+	static const char *names[ROLLOUT_COLUMNS] = {"x", "y", "rot", "speed", "steering", "section_idx", "collided",
+		"changes", "distances", "laps", "fitness", "time", "best", "progress_time", "distance", "stalled"};
+	static const char types[ROLLOUT_COLUMNS + 1] = {'d', 'd', 'd', 'd', 'd', 'i', '?', 'i', 'd', 'i', 'd', 'd', 'd',
+		'd', 'd', '?', 'd'};
+	struct Rollout r;
+	struct Step *step = &r.step;
+	PyObject *population, *genomes_obj, *layers_obj;
+	PyObject *active_obj = NULL;
+	int circular, threads = 1;
+
+	PARSE(args, "O&O&OdnOOddpdd|Oi", as_track, &step->track, as_rig, &step->rig, &population, &step->dt,
+		&r.max_steps, &genomes_obj, &layers_obj, &step->bias, &step->max_steering, &circular, &r.stall_time,
+		&r.min_speed, &active_obj, &threads);
+	r.circular = circular;
+	bool inference = genomes_obj != Py_None;
+	if (!parse_layers(step, layers_obj, inference)) {
+		return NULL;
+	}
+
+	PyObject *objs[ROLLOUT_COLUMNS + 1];
+	int a, nviews = inference ? ROLLOUT_COLUMNS + 1 : ROLLOUT_COLUMNS;
+	for (a=0; a<ROLLOUT_COLUMNS; a++) {
+		objs[a] = PyObject_GetAttrString(population, names[a]);
+		if (!objs[a]) {
+			for (a--; a>=0; a--) {
+				Py_DECREF(objs[a]);
+			}
+			return NULL;
+		}
+	}
+	Py_INCREF(genomes_obj);
+	objs[ROLLOUT_COLUMNS] = genomes_obj;
+
+	Py_ssize_t n = PyObject_Length(objs[0]);
+	Py_ssize_t lengths[ROLLOUT_COLUMNS + 1];
+	bool writable[ROLLOUT_COLUMNS + 1];
+	for (a=0; a<=ROLLOUT_COLUMNS; a++) {
+		lengths[a] = n;
+		writable[a] = true;
+	}
+	lengths[8] = step->rig->size * n;
+	lengths[ROLLOUT_COLUMNS] = step->ngenes * n;
+	writable[ROLLOUT_COLUMNS] = false;
+
+	Py_buffer views[ROLLOUT_COLUMNS + 1];
+	bool ok = n >= 0 && get_arrays(objs, views, nviews, types, lengths, writable);
+	// the buffers keep the arrays alive
+	for (a=0; a<=ROLLOUT_COLUMNS; a++) {
+		Py_DECREF(objs[a]);
+	}
+	if (!ok) {
+		return NULL;
+	}
 
-	return Py_BuildValue("k", net_copy);
+	Py_buffer active_view;
+	int *active;
+	Py_ssize_t count, k, steps = 0;
+	if (!get_indices(active_obj, &active_view, n, &active, &count)) {
+		release_arrays(views, nviews);
+		return NULL;
+	}
+	r.steps = PyMem_Malloc((count ? count : 1) * sizeof(Py_ssize_t));
+	if (!r.steps) {
+		release_arrays(views, nviews);
+		if (active) {
+			PyBuffer_Release(&active_view);
+		}
+		return PyErr_NoMemory();
+	}
+
+	step->active = active;
+	point_cars(&step->cars, views);
+	step->distances = views[8].buf;
+	r.laps = views[9].buf;
+	r.fitness = views[10].buf;
+	r.time = views[11].buf;
+	r.best = views[12].buf;
+	r.progress_time = views[13].buf;
+	r.distance = views[14].buf;
+	r.stalled = views[15].buf;
+	step->genomes = inference ? views[ROLLOUT_COLUMNS].buf : NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	parallel_for(threads, count, rollout_cars, &r);
+	Py_END_ALLOW_THREADS
+
+	for (k=0; k<count; k++) {
+		steps = r.steps[k] > steps ? r.steps[k] : steps;
+	}
+	PyMem_Free(r.steps);
+	release_arrays(views, nviews);
+	if (active) {
+		PyBuffer_Release(&active_view);
+	}
+	return PyLong_FromSsize_t(steps);
+}
+
+PyObject* py_cpu_count(PyObject *self, PyObject *args) {
+	return PyLong_FromLong(cpu_count());
 }
 
 PyObject* py_activate_network(PyObject *self, PyObject *args) {
@@ -307,7 +788,7 @@ PyObject* py_activate_network(PyObject *self, PyObject *args) {
 	PyObject *input;
 	int i;
 
-	PARSE(args, "kO", &net, &input);
+	PARSE(args, "O&O", as_network, &net, &input);
 	if (net->inputs != PySequence_Length(input)) {
 		PyErr_SetString(PyExc_ValueError, "Number of provided inputs does not match the network");
 		return NULL;
@@ -331,11 +812,40 @@ PyObject* py_activate_network(PyObject *self, PyObject *args) {
 
 PyObject* py_randomize_network(PyObject *self, PyObject *args) {
 	struct Network *net;
+	unsigned long long seed, generation = 0, idx = 0;
+
+	PARSE(args, "O&K|KK", as_network, &net, &seed, &generation, &idx);
 
-	PARSE(args, "k", &net);
+	randomize_network(net, seed, generation, idx);
 
-	randomize_network(net);
+	Py_RETURN_NONE;
+}
+
+PyObject* py_random_uniform(PyObject *self, PyObject *args) {
+	/*
+	Fills an (ncars, n) float array with uniform numbers in [0, 1), row i
+	from the given stream of the key (seed, generation, first + i).
+	 */
+	unsigned long long seed, generation, first, stream;
+	Py_ssize_t rows, cols;
+	PyObject *out;
+	Py_buffer view;
+
+	PARSE(args, "KKKKnnO", &seed, &generation, &first, &stream, &rows, &cols, &out);
+	if (!get_array(out, &view, 'd', rows * cols, true)) {
+		return NULL;
+	}
 
+	double *values = view.buf;
+	Py_ssize_t i, j;
+	for (i=0; i<rows; i++) {
+		uint64_t key = random_key(seed, generation, first + i);
+		for (j=0; j<cols; j++) {
+			values[i*cols + j] = random_uniform(key, stream_counter(stream, j));
+		}
+	}
+
+	PyBuffer_Release(&view);
 	Py_RETURN_NONE;
 }
 
@@ -347,24 +857,23 @@ static PyMethodDef cmodule_funcs[] =
 	{"intersection", py_intersection, METH_VARARGS, "find intersection between two lines"},
 		/* One-time data transfers */
 	{"set_car_size", py_set_car_size, METH_VARARGS, "set car size and related parameters"},
-	{"store_track", py_store_track, METH_VARARGS, "store track section info"},
-	{"delete_track", py_delete_track, METH_VARARGS, "store track section info"},
-	{"store_sensors", store_sensors, METH_VARARGS, "store one car sensor info"},
-	{"delete_sensors", delete_sensors, METH_VARARGS, "delete sensor info from memory"},
 		/* for per-frame updates, physics and such */
 	{"find_rig_distances", find_rig_distances, METH_VARARGS, "get measurements for all sensors"},
+	{"find_population_distances", find_population_distances, METH_VARARGS, "get measurements for all sensors of all cars into an array"},
 	{"check_car_collision", check_car_collision, METH_VARARGS, "find car collisions with the track"},
 	{"check_box_collision", check_box_collision, METH_VARARGS, "find box collisions with the track"},
 	{"changed_section", changed_section, METH_VARARGS, "check if need to set next section"},
 	{"move", move, METH_VARARGS, "move the car based on the circle of rotation"},
+	{"move_population", move_population, METH_VARARGS, "move, collide and change sections of all cars in place"},
+	{"step_population", step_population, METH_VARARGS, "move, sense and steer all cars on several threads without the GIL"},
+	{"rollout", rollout, METH_VARARGS, "run a whole generation of a population on several threads without the GIL"},
+	{"cpu_count", py_cpu_count, METH_NOARGS, "number of threads used when asked for 0"},
 		/* neural network */
-	{"create_network", py_create_network, METH_VARARGS, "create a new neural network"},
-	{"delete_network", py_delete_network, METH_VARARGS, "delete the neural network"},
-	{"copy_network", py_copy_network, METH_VARARGS, "copy the neural network"},
-	{"randomize_network", py_randomize_network, METH_VARARGS, "randomize all weights"},
+	{"randomize_network", py_randomize_network, METH_VARARGS, "randomize all weights from a (seed, generation, index) key"},
+	{"random_uniform", py_random_uniform, METH_VARARGS, "fill an array with counter-based uniform numbers"},
 	{"activate_network", py_activate_network, METH_VARARGS, "activate the network"},
 		/* for graphics */
-	{"car_lines", car_lines, METH_VARARGS, "Get a tuple of all car lines to draw in one call"},
+	{"car_lines", car_lines, METH_VARARGS, "write the sides of all cars into a float array to draw in one call"},
 	{NULL, NULL, 0, NULL}
 };
 
@@ -383,11 +892,11 @@ static struct PyModuleDef cmodule =
 
 PyMODINIT_FUNC PyInit_cmodule(void)
 {
-	time_t t;
-	time(&t);
-	unsigned long seed = t;
-	//printf("seed = %lu\n", seed);
-	srand(seed);
 	set_car_size(CAR_LENGTH, CAR_WIDTH);
-	return PyModule_Create(&cmodule);
+	PyObject *module = PyModule_Create(&cmodule);
+	if (module && !add_types(module)) {
+		Py_DECREF(module);
+		return NULL;
+	}
+	return module;
 }
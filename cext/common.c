@@ -10,6 +10,92 @@ void print_array(double *array, int size) {
 	}
 }
 
+bool get_array(PyObject *obj, Py_buffer *view, char type, Py_ssize_t length, bool writable) {
+	/*
+	Gets a C-contiguous buffer of at least `length` items of the given
+	struct type ('d' double, 'f' float, 'i' int, '?' bool). The caller
+	must PyBuffer_Release it if true is returned.
+	 */
+	int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT;
+	if (writable) {
+		flags |= PyBUF_WRITABLE;
+	}
+	if (PyObject_GetBuffer(obj, view, flags) < 0) {
+		return false;
+	}
+
+	const char *format = view->format ? view->format : "B";
+	if (*format == '<' || *format == '=' || *format == '@') {
+		format++;
+	}
+	Py_ssize_t itemsize;
+	bool same_type;
+	switch (type) {
+		case 'd': itemsize = sizeof(double); same_type = *format == 'd'; break;
+		case 'f': itemsize = sizeof(float); same_type = *format == 'f'; break;
+		case 'i': itemsize = sizeof(int); same_type = *format == 'i' || *format == 'l'; break;
+		default: itemsize = 1; same_type = *format == '?' || *format == 'B' || *format == 'b'; break;
+	}
+
+	if (!same_type || format[1] || view->itemsize != itemsize || view->len < length * itemsize) {
+		PyErr_Format(PyExc_ValueError, "expected a contiguous array of at least %zd '%c' items", length, type);
+		PyBuffer_Release(view);
+		return false;
+	}
+	return true;
+}
+
+bool get_arrays(PyObject **objs, Py_buffer *views, int count, const char *types, const Py_ssize_t *lengths, const bool *writable) {
+	/*
+	get_array of every object, on failure the views already taken are
+	released again.
+	 */
+	int a, i;
+	for (a=0; a<count; a++) {
+		if (!get_array(objs[a], &views[a], types[a], lengths[a], writable[a])) {
+			for (i=0; i<a; i++) {
+				PyBuffer_Release(&views[i]);
+			}
+			return false;
+		}
+	}
+	return true;
+}
+
+void release_arrays(Py_buffer *views, int count) {
+	int a;
+	for (a=0; a<count; a++) {
+		PyBuffer_Release(&views[a]);
+	}
+}
+
+bool get_indices(PyObject *obj, Py_buffer *view, Py_ssize_t n, int **indices, Py_ssize_t *count) {
+	/*
+	Optional int array of indices into arrays of n items, every one of the
+	n items when obj is NULL or None. A buffer is only held (and must be
+	released) when *indices is set.
+	 */
+	*indices = NULL;
+	*count = n;
+	if (!obj || obj == Py_None) {
+		return true;
+	}
+	if (!get_array(obj, view, 'i', 0, false)) {
+		return false;
+	}
+	*indices = view->buf;
+	*count = view->len / sizeof(int);
+	Py_ssize_t k;
+	for (k=0; k<*count; k++) {
+		if ((*indices)[k] < 0 || (*indices)[k] >= n) {
+			PyErr_Format(PyExc_IndexError, "index %d out of range for %zd items", (*indices)[k], n);
+			PyBuffer_Release(view);
+			return false;
+		}
+	}
+	return true;
+}
+
 inline bool _intersection(const double *line1, const double *line2, double *point, char type) {
 	double x1, y1, x2, y2, x3, y3, x4, y4;	// input lines
 	double x, y;							// intersection point
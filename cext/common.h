@@ -26,6 +26,12 @@ static inline double point_origin_distance(const double *p) {
 
 void print_array(double *array, int size);
 
+// numpy/buffer-protocol arrays passed from python for batched calls
+bool get_array(PyObject *obj, Py_buffer *view, char type, Py_ssize_t length, bool writable);
+bool get_arrays(PyObject **objs, Py_buffer *views, int count, const char *types, const Py_ssize_t *lengths, const bool *writable);
+void release_arrays(Py_buffer *views, int count);
+bool get_indices(PyObject *obj, Py_buffer *view, Py_ssize_t n, int **indices, Py_ssize_t *count);
+
 static const char SEGMENT_SEGMENT = 0;
 static const char SEGMENT_LINE = 1;
 static const char LINE_LINE = 2;
@@ -1,15 +1,28 @@
 #include "common.h"
 #include "neural.h"
+#include "rng.h"
 
 static const size_t NETSIZE = sizeof(struct Network);
 static const size_t LAYERSIZE = sizeof(struct Layer);
 
+static void point_layers(struct Network *network) {
+	// (re)sets the weights of every layer to its part of the genome
+	int i;
+	double *weights = network->genome;
+	for (i=0; i<network->layernum; i++) {
+		network->layers[i].weights = weights;
+		weights += network->layers[i].neurons * (network->layers[i].inputs + 1);
+	}
+}
+
 struct Network* create_network(int inputs) {
 	struct Network *net = malloc(NETSIZE);
 	net->inputs = inputs;
 	net->outputs = inputs;
 	net->max_neurons = 0;
 	net->layernum = 0;
+	net->size = 0;
+	net->genome = NULL;
 	net->layers = NULL;
 
 	return net;
@@ -18,14 +31,10 @@ struct Network* create_network(int inputs) {
 void delete_network(struct Network *network) {
 	int i=0;
 	for (i=0; i<network->layernum; i++) {
-		if (network->layers[i].weights) {
-			free(network->layers[i].weights);
-			free(network->layers[i].biases);
-		}
-	}
-	if (network->layers) {
-		free(network->layers);
+		free(network->layers[i].biases);
 	}
+	free(network->layers);
+	free(network->genome);
 	free(network);
 }
 
@@ -35,7 +44,10 @@ struct Network* copy_network(struct Network *net) {
 	net_copy->outputs = net->outputs;
 	net_copy->max_neurons = net->max_neurons;
 	net_copy->layernum = net->layernum;
+	net_copy->size = net->size;
 	net_copy->layers = malloc(LAYERSIZE * net_copy->layernum);
+	net_copy->genome = malloc(sizeof(double) * net->size);
+	memcpy(net_copy->genome, net->genome, sizeof(double) * net->size);
 
 	int i;
 	for (i=0; i<net_copy->layernum; i++) {
@@ -43,12 +55,10 @@ struct Network* copy_network(struct Network *net) {
 		layer->inputs = net->layers[i].inputs;
 		layer->neurons = net->layers[i].neurons;
 		size_t biases_size = sizeof(double) * layer->neurons;
-		size_t weights_size = sizeof(double) * layer->neurons * (layer->inputs + 1);
-		layer->weights = malloc(weights_size);
 		layer->biases = malloc(biases_size);
-		memcpy(layer->weights, net->layers[i].weights, weights_size);
 		memcpy(layer->biases, net->layers[i].biases, biases_size);
 	}
+	point_layers(net_copy);
 
 	return net_copy;
 }
@@ -64,14 +74,11 @@ void add_layer(struct Network *network, int neurons) {
 	}
 	layer->neurons = neurons;
 	layer->biases = calloc(neurons, sizeof(double));
-	layer->weights = malloc(sizeof(double) * neurons * (layer->inputs + 1));
-	int i;
-	for (i=0; i<layer->neurons*(layer->inputs+1); i++) {
-		//layer->weights[i] = 1;
-		layer->weights[i] = (double)rand()/RAND_MAX*2.0-1.0;
-	}
-	for (i=0; i<layer->neurons; i++) {
-	}
+	int size = neurons * (layer->inputs + 1);
+	network->genome = realloc(network->genome, sizeof(double) * (network->size + size));
+	memset(&network->genome[network->size], 0, sizeof(double) * size);
+	network->size += size;
+	point_layers(network);
 	network->outputs = layer->neurons;
 	if (layer->neurons > network->max_neurons) {
 		network->max_neurons = layer->neurons;
@@ -90,7 +97,8 @@ void activate_network(struct Network *network, double *input, double *output) {
 		layer = &network->layers[l];
 		double sums[layer->neurons];
 		for (n=0; n<layer->neurons; n++) {
-			sums[n] = layer->biases[n] * layer->weights[n*(layer->inputs+1)];
+			// the last weight of every neuron is the bias weight
+			sums[n] = layer->biases[n] * layer->weights[n*(layer->inputs+1) + layer->inputs];
 			for (i=0; i<layer->inputs; i++) {
 				sums[n] += outputs[i] * layer->weights[n*(layer->inputs+1) + i];
 			}
@@ -105,12 +113,61 @@ void activate_network(struct Network *network, double *input, double *output) {
 	}
 }
 
-void randomize_network(struct Network *network) {
-	int i,j;
-	for (i=0; i<network->layernum; i++) {
-		struct Layer *layer = &network->layers[i];
-		for (j=0; j<layer->neurons*(layer->inputs+1); j++) {
-			layer->weights[j] = (double)rand()/RAND_MAX*2.0-1.0;
+void activate_genome(const double *genome, int inputs, const int *layers, int layernum, double bias,
+		const double *input, double *output) {
+	/*
+	activate_network on a bare genome laid out like export_network, for
+	a network with the given neurons in every layer after the input and
+	every bias input set to bias. output gets layers[layernum-1] values.
+	 */
+	int l, n, i, width = inputs;
+	for (l=0; l<layernum; l++) {
+		width = layers[l] > width ? layers[l] : width;
+	}
+	double outputs[width];
+	double sums[width];
+	memcpy(outputs, input, inputs * sizeof(double));
+	for (l=0; l<layernum; l++) {
+		for (n=0; n<layers[l]; n++) {
+			const double *weights = &genome[n*(inputs+1)];
+			sums[n] = bias * weights[inputs];
+			for (i=0; i<inputs; i++) {
+				sums[n] += outputs[i] * weights[i];
+			}
+		}
+		for (n=0; n<layers[l]; n++) {
+			outputs[n] = tanh(sums[n]);
 		}
+		genome += layers[l] * (inputs + 1);
+		inputs = layers[l];
+	}
+	memcpy(output, outputs, inputs * sizeof(double));
+}
+
+int network_size(struct Network *network) {
+	return network->size;
+}
+
+void export_network(struct Network *network, double *weights) {
+	/*
+	Copies all weights into a flat genome, layer after layer, each layer
+	being neurons x (inputs + 1) with the bias weight last.
+	 */
+	memcpy(weights, network->genome, network->size * sizeof(double));
+}
+
+void import_network(struct Network *network, const double *weights) {
+	memcpy(network->genome, weights, network->size * sizeof(double));
+}
+
+void randomize_network(struct Network *network, uint64_t seed, uint64_t generation, uint64_t idx) {
+	/*
+	Uniform weights in [-1, 1) from the weights stream of the key, the n-th
+	weight of the exported genome being the n-th number of the stream.
+	 */
+	uint64_t key = random_key(seed, generation, idx);
+	int n;
+	for (n=0; n<network->size; n++) {
+		network->genome[n] = random_uniform(key, stream_counter(STREAM_WEIGHTS, n)) * 2.0 - 1.0;
 	}
 }
@@ -1,10 +1,12 @@
 #ifndef NEURAL
 #define NEURAL
 
+#include <stdint.h>
+
 struct Layer {
 	int inputs;
 	int neurons;
-	double *weights;
+	double *weights;	// neurons x (inputs + 1), points into the network genome
 	double *biases;
 };
 
@@ -13,13 +15,21 @@ struct Network {
 	int outputs;
 	int layernum;
 	int max_neurons;
+	int size;			// weights of all layers
+	double *genome;		// the weights of every layer one after another
 	struct Layer *layers;
 };
 
 struct Network* create_network(int inputs);
 void add_layer(struct Network *network, int neurons);
 void activate_network(struct Network *net, double *inputs, double *outputs);
-void randomize_network(struct Network *network);
+void activate_genome(const double *genome, int inputs, const int *layers, int layernum, double bias,
+	const double *input, double *output);
+void randomize_network(struct Network *network, uint64_t seed, uint64_t generation, uint64_t idx);
+
+int network_size(struct Network *network);
+void export_network(struct Network *network, double *weights);
+void import_network(struct Network *network, const double *weights);
 
 struct Network* copy_network(struct Network *net);
 void delete_network(struct Network *network);
@@ -0,0 +1,370 @@
+#include "objects.h"
+
+static int fill_buffer(PyObject *obj, Py_buffer *view, int flags, void *buf,
+		int ndim, Py_ssize_t *shape, Py_ssize_t *strides, bool readonly) {
+	/*
+	Exports ndim C-contiguous doubles of the object, which is kept alive
+	by the view until it is released.
+	 */
+	if (readonly && (flags & PyBUF_WRITABLE) == PyBUF_WRITABLE) {
+		PyErr_Format(PyExc_BufferError, "%s objects are read-only", Py_TYPE(obj)->tp_name);
+		view->obj = NULL;
+		return -1;
+	}
+	int i;
+	Py_ssize_t length = 1;
+	for (i=ndim-1; i>=0; i--) {
+		strides[i] = length * sizeof(double);
+		length *= shape[i];
+	}
+	view->buf = buf;
+	view->obj = obj;
+	Py_INCREF(obj);
+	view->len = length * sizeof(double);
+	view->itemsize = sizeof(double);
+	view->readonly = readonly;
+	view->format = (flags & PyBUF_FORMAT) == PyBUF_FORMAT ? "d" : NULL;
+	view->ndim = ndim;
+	view->shape = (flags & PyBUF_ND) == PyBUF_ND ? shape : NULL;
+	view->strides = (flags & PyBUF_STRIDES) == PyBUF_STRIDES ? strides : NULL;
+	view->suboffsets = NULL;
+	view->internal = NULL;
+	return 0;
+}
+
+static bool check_type(PyObject *obj, PyTypeObject *type) {
+	if (!PyObject_TypeCheck(obj, type)) {
+		PyErr_Format(PyExc_TypeError, "expected a %s, not %s", type->tp_name, Py_TYPE(obj)->tp_name);
+		return false;
+	}
+	return true;
+}
+
+int as_track(PyObject *obj, struct Track **track) {
+	if (!check_type(obj, &TrackType)) {
+		return 0;
+	}
+	*track = ((TrackObject *)obj)->track;
+	return 1;
+}
+
+int as_rig(PyObject *obj, struct SensorRig **rig) {
+	if (!check_type(obj, &SensorRigType)) {
+		return 0;
+	}
+	*rig = ((SensorRigObject *)obj)->rig;
+	return 1;
+}
+
+int as_network(PyObject *obj, struct Network **network) {
+	if (!check_type(obj, &NetworkType)) {
+		return 0;
+	}
+	*network = ((NetworkObject *)obj)->network;
+	return 1;
+}
+
+/* Track */
+
+static PyObject* track_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+	/*
+	Track(sections) from a flat float array of SECTION_DOUBLES per section
+	(see Track.section_array()) or a sequence of Python sections.
+	 */
+	static char *kwlist[] = {"sections", NULL};
+	PyObject *sections;
+	struct Track *track;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O", kwlist, &sections)) {
+		return NULL;
+	}
+	if (PyObject_CheckBuffer(sections)) {
+		Py_buffer view;
+		if (!get_array(sections, &view, 'd', 0, false)) {
+			return NULL;
+		}
+		if (view.len % (SECTION_DOUBLES * sizeof(double))) {
+			PyErr_Format(PyExc_ValueError, "expected %d doubles per section", SECTION_DOUBLES);
+			PyBuffer_Release(&view);
+			return NULL;
+		}
+		track = store_track_array(view.buf, view.len / (SECTION_DOUBLES * sizeof(double)));
+		PyBuffer_Release(&view);
+	} else {
+		if (PySequence_Length(sections) < 0) {
+			return NULL;
+		}
+		track = store_track(sections);
+		if (PyErr_Occurred()) {
+			delete_track(track);
+			return NULL;
+		}
+	}
+
+	const double *values = (const double *)track->sections;
+	int i;
+	for (i=0; i<track->length * SECTION_DOUBLES && isfinite(values[i]); i++);
+	if (!track->length || i < track->length * SECTION_DOUBLES) {
+		PyErr_SetString(PyExc_ValueError, track->length ? "Track coordinates must be finite" : "A track needs at least one section");
+		delete_track(track);
+		return NULL;
+	}
+
+	TrackObject *self = (TrackObject *)type->tp_alloc(type, 0);
+	if (!self) {
+		delete_track(track);
+		return NULL;
+	}
+	self->track = track;
+	self->shape[0] = track->length;
+	self->shape[1] = SECTION_DOUBLES;
+	return (PyObject *)self;
+}
+
+static void track_dealloc(TrackObject *self) {
+	delete_track(self->track);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int track_getbuffer(TrackObject *self, Py_buffer *view, int flags) {
+	return fill_buffer((PyObject *)self, view, flags, self->track->sections, 2, self->shape, self->strides, true);
+}
+
+static PyObject* track_get_length(TrackObject *self, void *closure) {
+	return PyLong_FromLong(self->track->length);
+}
+
+static PyBufferProcs track_buffer = {
+	.bf_getbuffer = (getbufferproc)track_getbuffer,
+};
+
+static PyGetSetDef track_getset[] = {
+	{"length", (getter)track_get_length, NULL, "number of sections", NULL},
+	{NULL}
+};
+
+PyTypeObject TrackType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "cmodule.Track",
+	.tp_doc = "Track sections and the wall grid on the C heap",
+	.tp_basicsize = sizeof(TrackObject),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_new = track_new,
+	.tp_dealloc = (destructor)track_dealloc,
+	.tp_as_buffer = &track_buffer,
+	.tp_getset = track_getset,
+};
+
+/* SensorRig */
+
+static PyObject* rig_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+	/*
+	SensorRig(angles, distances), the angle of every sensor relative to
+	the car and how far it reaches.
+	 */
+	static char *kwlist[] = {"angles", "distances", NULL};
+	PyObject *angles_obj, *distances_obj;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO", kwlist, &angles_obj, &distances_obj)) {
+		return NULL;
+	}
+	PyObject *angles = PySequence_Fast(angles_obj, "angles must be a sequence");
+	if (!angles) {
+		return NULL;
+	}
+	PyObject *distances = PySequence_Fast(distances_obj, "distances must be a sequence");
+	if (!distances) {
+		Py_DECREF(angles);
+		return NULL;
+	}
+	Py_ssize_t size = PySequence_Fast_GET_SIZE(angles);
+	if (size != PySequence_Fast_GET_SIZE(distances)) {
+		PyErr_SetString(PyExc_ValueError, "Number of angles and distances provided must match");
+		Py_DECREF(angles);
+		Py_DECREF(distances);
+		return NULL;
+	}
+
+	struct SensorRig *rig = malloc(sizeof(struct SensorRig));
+	rig->size = size;
+	rig->sensors = malloc(sizeof(struct Sensor) * (size ? size : 1));
+	Py_ssize_t i;
+	for (i=0; i<size; i++) {
+		rig->sensors[i].angle = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(angles, i));
+		rig->sensors[i].distance = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(distances, i));
+	}
+	set_ends(rig);
+	Py_DECREF(angles);
+	Py_DECREF(distances);
+
+	SensorRigObject *self = PyErr_Occurred() ? NULL : (SensorRigObject *)type->tp_alloc(type, 0);
+	if (!self) {
+		delete_rig(rig);
+		return NULL;
+	}
+	self->rig = rig;
+	self->shape[0] = size;
+	self->shape[1] = 2;
+	return (PyObject *)self;
+}
+
+static void rig_dealloc(SensorRigObject *self) {
+	delete_rig(self->rig);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int rig_getbuffer(SensorRigObject *self, Py_buffer *view, int flags) {
+	return fill_buffer((PyObject *)self, view, flags, self->rig->sensors, 2, self->shape, self->strides, true);
+}
+
+static PyObject* rig_get_size(SensorRigObject *self, void *closure) {
+	return PyLong_FromLong(self->rig->size);
+}
+
+static PyBufferProcs rig_buffer = {
+	.bf_getbuffer = (getbufferproc)rig_getbuffer,
+};
+
+static PyGetSetDef rig_getset[] = {
+	{"size", (getter)rig_get_size, NULL, "number of sensors", NULL},
+	{NULL}
+};
+
+PyTypeObject SensorRigType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "cmodule.SensorRig",
+	.tp_doc = "(angle, distance) of every sensor of a car",
+	.tp_basicsize = sizeof(SensorRigObject),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_new = rig_new,
+	.tp_dealloc = (destructor)rig_dealloc,
+	.tp_as_buffer = &rig_buffer,
+	.tp_getset = rig_getset,
+};
+
+/* Network */
+
+static PyObject* wrap_network(PyTypeObject *type, struct Network *network) {
+	NetworkObject *self = (NetworkObject *)type->tp_alloc(type, 0);
+	if (!self) {
+		delete_network(network);
+		return NULL;
+	}
+	self->network = network;
+	self->shape[0] = network->size;
+	return (PyObject *)self;
+}
+
+static PyObject* network_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+	/*
+	Network(inputs, layers, seed=0, generation=0, idx=0) with the given
+	neurons in every layer after the input one and random weights from
+	the key (seed, generation, idx).
+	 */
+	static char *kwlist[] = {"inputs", "layers", "seed", "generation", "idx", NULL};
+	int inputs;
+	PyObject *layers_obj;
+	unsigned long long seed = 0, generation = 0, idx = 0;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "iO|KKK", kwlist, &inputs, &layers_obj, &seed, &generation, &idx)) {
+		return NULL;
+	}
+	if (inputs <= 0) {
+		PyErr_SetString(PyExc_ValueError, "A network needs at least one input");
+		return NULL;
+	}
+	PyObject *layers = PySequence_Fast(layers_obj, "layers must be a sequence");
+	if (!layers) {
+		return NULL;
+	}
+	struct Network *network = create_network(inputs);
+	add_layer(network, inputs);
+	Py_ssize_t i;
+	for (i=0; i<PySequence_Fast_GET_SIZE(layers); i++) {
+		long neurons = PyLong_AsLong(PySequence_Fast_GET_ITEM(layers, i));
+		if (neurons <= 0) {
+			if (!PyErr_Occurred()) {
+				PyErr_SetString(PyExc_ValueError, "Layers must have at least one neuron");
+			}
+			Py_DECREF(layers);
+			delete_network(network);
+			return NULL;
+		}
+		add_layer(network, neurons);
+	}
+	Py_DECREF(layers);
+	randomize_network(network, seed, generation, idx);
+
+	return wrap_network(type, network);
+}
+
+static void network_dealloc(NetworkObject *self) {
+	delete_network(self->network);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int network_getbuffer(NetworkObject *self, Py_buffer *view, int flags) {
+	return fill_buffer((PyObject *)self, view, flags, self->network->genome, 1, self->shape, self->strides, false);
+}
+
+static PyObject* network_copy(NetworkObject *self, PyObject *unused) {
+	return wrap_network(Py_TYPE(self), copy_network(self->network));
+}
+
+static PyObject* network_get_inputs(NetworkObject *self, void *closure) {
+	return PyLong_FromLong(self->network->inputs);
+}
+
+static PyObject* network_get_outputs(NetworkObject *self, void *closure) {
+	return PyLong_FromLong(self->network->outputs);
+}
+
+static PyObject* network_get_size(NetworkObject *self, void *closure) {
+	return PyLong_FromLong(self->network->size);
+}
+
+static PyBufferProcs network_buffer = {
+	.bf_getbuffer = (getbufferproc)network_getbuffer,
+};
+
+static PyMethodDef network_methods[] = {
+	{"copy", (PyCFunction)network_copy, METH_NOARGS, "independent network with the same weights"},
+	{NULL}
+};
+
+static PyGetSetDef network_getset[] = {
+	{"inputs", (getter)network_get_inputs, NULL, "number of inputs", NULL},
+	{"outputs", (getter)network_get_outputs, NULL, "number of outputs", NULL},
+	{"size", (getter)network_get_size, NULL, "number of weights", NULL},
+	{NULL}
+};
+
+PyTypeObject NetworkType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "cmodule.Network",
+	.tp_doc = "Feedforward tanh network, its buffer is the genome",
+	.tp_basicsize = sizeof(NetworkObject),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_new = network_new,
+	.tp_dealloc = (destructor)network_dealloc,
+	.tp_as_buffer = &network_buffer,
+	.tp_methods = network_methods,
+	.tp_getset = network_getset,
+};
+
+bool add_types(PyObject *module) {
+	PyTypeObject *types[3] = {&TrackType, &SensorRigType, &NetworkType};
+	const char *names[3] = {"Track", "SensorRig", "Network"};
+	int i;
+	for (i=0; i<3; i++) {
+		if (PyType_Ready(types[i]) < 0) {
+			return false;
+		}
+		Py_INCREF(types[i]);
+		if (PyModule_AddObject(module, names[i], (PyObject *)types[i]) < 0) {
+			Py_DECREF(types[i]);
+			return false;
+		}
+	}
+	return true;
+}
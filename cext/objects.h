@@ -0,0 +1,49 @@
+#ifndef OBJECTS
+#define OBJECTS
+
+#include "common.h"
+#include "track.h"
+#include "sensors.h"
+#include "neural.h"
+
+/*
+Python objects owning the C tracks, sensor rigs and networks. They are
+freed with the last reference and export their data with the buffer
+protocol, so numpy.asarray() of one is a view without a copy:
+Track as (length, SECTION_DOUBLES) and SensorRig as (size, 2) read-only
+doubles, Network as its writable genome of size doubles.
+ */
+
+typedef struct {
+	PyObject_HEAD
+	struct Track *track;
+	Py_ssize_t shape[2];
+	Py_ssize_t strides[2];
+} TrackObject;
+
+typedef struct {
+	PyObject_HEAD
+	struct SensorRig *rig;
+	Py_ssize_t shape[2];
+	Py_ssize_t strides[2];
+} SensorRigObject;
+
+typedef struct {
+	PyObject_HEAD
+	struct Network *network;
+	Py_ssize_t shape[1];
+	Py_ssize_t strides[1];
+} NetworkObject;
+
+extern PyTypeObject TrackType;
+extern PyTypeObject SensorRigType;
+extern PyTypeObject NetworkType;
+
+// "O&" converters for PyArg_ParseTuple giving the C struct of an object
+int as_track(PyObject *obj, struct Track **track);
+int as_rig(PyObject *obj, struct SensorRig **rig);
+int as_network(PyObject *obj, struct Network **network);
+
+bool add_types(PyObject *module);
+
+#endif
@@ -0,0 +1,46 @@
+#ifndef RNG
+#define RNG
+
+#include <stdint.h>
+
+/*
+Counter-based random numbers: every (seed, generation, car index) key is
+hashed into the state of its own splitmix64 stream and the n-th number of
+the stream is computed directly from n, so results don't depend on the
+order numbers are drawn in or on how cars are split between threads or
+processes. rng.py computes the same numbers with numpy.
+ */
+
+// streams keep different uses of the same key apart, they are the high
+// 32 bits of the counter
+#define STREAM_WEIGHTS 0
+#define STREAM_START 1
+
+static const uint64_t GOLDEN_GAMMA = 0x9e3779b97f4a7c15ULL;
+
+static inline uint64_t mix64(uint64_t z) {
+	z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+	z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+	return z ^ (z >> 31);
+}
+
+static inline uint64_t random_key(uint64_t seed, uint64_t generation, uint64_t idx) {
+	uint64_t z = mix64(seed + GOLDEN_GAMMA);
+	z = mix64(z + generation + GOLDEN_GAMMA);
+	return mix64(z + idx + GOLDEN_GAMMA);
+}
+
+static inline uint64_t random_bits(uint64_t key, uint64_t counter) {
+	return mix64(key + (counter + 1) * GOLDEN_GAMMA);
+}
+
+// uniform in [0, 1) with 53 random bits
+static inline double random_uniform(uint64_t key, uint64_t counter) {
+	return (random_bits(key, counter) >> 11) * 0x1.0p-53;
+}
+
+static inline uint64_t stream_counter(uint64_t stream, uint64_t n) {
+	return (stream << 32) | n;
+}
+
+#endif
@@ -11,10 +11,11 @@ struct Sensor {
 struct SensorRig {
 	int size;
 	struct Sensor *sensors;
+	double *ends;	// (size, 2) sensor ends of a car at the origin with rot 0
 };
 
-PyObject* store_sensors(PyObject *self, PyObject *args);
-PyObject* delete_sensors(PyObject *self, PyObject *args);
+void set_ends(struct SensorRig *rig);
+void delete_rig(struct SensorRig *rig);
 void print_rig(struct SensorRig *rig);
 
 static inline void get_endpoint(struct Sensor *sensor, const double *pos, double rot, double *point) {
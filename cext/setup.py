@@ -3,7 +3,10 @@ from distutils.core import setup, Extension
 import os
 
 # define the extension module
-cmodule = Extension('cmodule', include_dirs=["./"], sources=['common.c', 'track.c', 'sensors.c', 'neural.c', 'cmodule.c'])
+# TRACK_FLOAT32=1 python setup.py build casts the sensor rays in single precision
+macros = [('TRACK_FLOAT32', None)] if os.environ.get('TRACK_FLOAT32') else []
+cmodule = Extension('cmodule', include_dirs=["./"], define_macros=macros,
+	sources=['common.c', 'track.c', 'sensors.c', 'neural.c', 'objects.c', 'threads.c', 'cmodule.c'])
 
 cflags = sysconfig.get_config_var('CFLAGS')
 opt = sysconfig.get_config_var('OPT')
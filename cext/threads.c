@@ -0,0 +1,121 @@
+#include <pthread.h>
+#include <unistd.h>
+#include "threads.h"
+
+static struct {
+	pthread_mutex_t serial;	// held for a whole round, one parallel_for at a time
+	pthread_mutex_t lock;
+	pthread_cond_t start;	// a new round of work was posted
+	pthread_cond_t done;	// the last chunk of a round finished
+	int size;				// worker threads running, chunks 1..size
+	unsigned long round;
+	int chunks;
+	int pending;			// chunks of the round not finished yet
+	Py_ssize_t n;
+	chunk_fn fn;
+	void *arg;
+	unsigned long born[MAX_THREADS];	// round when each worker was started
+} pool = {PTHREAD_MUTEX_INITIALIZER, PTHREAD_MUTEX_INITIALIZER, PTHREAD_COND_INITIALIZER, PTHREAD_COND_INITIALIZER};
+
+int cpu_count(void) {
+	long count = sysconf(_SC_NPROCESSORS_ONLN);
+	return count > 0 ? (int)count : 1;
+}
+
+static void run_chunk(int chunk) {
+	Py_ssize_t begin = pool.n * chunk / pool.chunks;
+	Py_ssize_t end = pool.n * (chunk + 1) / pool.chunks;
+	if (begin < end) {
+		pool.fn(pool.arg, begin, end);
+	}
+}
+
+static void* worker(void *arg) {
+	int chunk = (int)(intptr_t)arg;
+	pthread_mutex_lock(&pool.lock);
+	// the round may have been posted before this thread got the lock
+	unsigned long seen = pool.born[chunk];
+	while (true) {
+		while (pool.round == seen) {
+			pthread_cond_wait(&pool.start, &pool.lock);
+		}
+		seen = pool.round;
+		if (chunk >= pool.chunks) {
+			continue;
+		}
+		pthread_mutex_unlock(&pool.lock);
+		run_chunk(chunk);
+		pthread_mutex_lock(&pool.lock);
+		if (--pool.pending == 0) {
+			pthread_cond_signal(&pool.done);
+		}
+	}
+	return NULL;
+}
+
+static void after_fork(void) {
+	// only the forking thread lives on in the child, start over without workers
+	pthread_mutex_init(&pool.serial, NULL);
+	pthread_mutex_init(&pool.lock, NULL);
+	pthread_cond_init(&pool.start, NULL);
+	pthread_cond_init(&pool.done, NULL);
+	pool.size = 0;
+	pool.pending = 0;
+}
+
+static void grow_pool(int size) {
+	// called with the lock held
+	static bool registered = false;
+	if (!registered) {
+		pthread_atfork(NULL, NULL, after_fork);
+		registered = true;
+	}
+	while (pool.size < size) {
+		pthread_t thread;
+		pool.born[pool.size + 1] = pool.round;
+		if (pthread_create(&thread, NULL, worker, (void *)(intptr_t)(pool.size + 1))) {
+			break;
+		}
+		pthread_detach(thread);
+		pool.size++;
+	}
+}
+
+void parallel_for(int threads, Py_ssize_t n, chunk_fn fn, void *arg) {
+	if (threads <= 0) {
+		threads = cpu_count();
+	}
+	if (threads > MAX_THREADS) {
+		threads = MAX_THREADS;
+	}
+	if (threads > n) {
+		threads = (int)n;
+	}
+	if (threads <= 1) {
+		if (n > 0) {
+			fn(arg, 0, n);
+		}
+		return;
+	}
+
+	pthread_mutex_lock(&pool.serial);
+	pthread_mutex_lock(&pool.lock);
+	grow_pool(threads - 1);
+	pool.chunks = pool.size + 1 < threads ? pool.size + 1 : threads;
+	pool.n = n;
+	pool.fn = fn;
+	pool.arg = arg;
+	pool.pending = pool.chunks - 1;
+	pool.round++;
+	pthread_cond_broadcast(&pool.start);
+	pthread_mutex_unlock(&pool.lock);
+
+	run_chunk(0);
+
+	pthread_mutex_lock(&pool.lock);
+	while (pool.pending) {
+		pthread_cond_wait(&pool.done, &pool.lock);
+	}
+	pthread_mutex_unlock(&pool.lock);
+	pthread_mutex_unlock(&pool.serial);
+}
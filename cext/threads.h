@@ -0,0 +1,21 @@
+#ifndef THREADS
+#define THREADS
+
+#include "common.h"
+
+// most threads a parallel_for uses
+#define MAX_THREADS 256
+
+// runs items [begin, end) of the work, called from several threads at once
+typedef void (*chunk_fn)(void *arg, Py_ssize_t begin, Py_ssize_t end);
+
+/*
+Splits n items into contiguous chunks, one per thread, and runs fn on
+them on a pool of threads kept between calls. The calling thread runs the
+first chunk and returns when all are done. threads <= 0 uses one per
+CPU core. Calls from several threads at once take turns.
+ */
+void parallel_for(int threads, Py_ssize_t n, chunk_fn fn, void *arg);
+int cpu_count(void);
+
+#endif
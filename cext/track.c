@@ -1,44 +1,333 @@
 #include "track.h"
 
 static const size_t SECTION_SIZE = sizeof(struct TrackSection);
+_Static_assert(sizeof(struct TrackSection) == SECTION_DOUBLES * sizeof(double), "sections must be flat arrays of doubles");
 
-static struct Track track = {0, 0};
+static inline int grid_coord(double value, double origin, double cell, int size) {
+	int c = (int)floor((value - origin) / cell);
+	return c < 0 ? 0 : (c >= size ? size - 1 : c);
+}
 
-bool find_section_intersection(double *line, int idx, double *point) {
-	int prev = 0;
-	while (true) {
-		if (idx < 0) {
-			idx += track.length;
+static bool clip_to_grid(const struct Grid *g, const double *line, double *t0, double *t1) {
+	// Liang-Barsky clipping of the line parameter range [0, 1] to the grid bounds
+	double lo[2] = {g->origin[0], g->origin[1]};
+	double hi[2] = {g->origin[0] + g->cols * g->cell, g->origin[1] + g->rows * g->cell};
+	int i;
+	*t0 = 0;
+	*t1 = 1;
+	for (i=0; i<2; i++) {
+		double d = line[i+2] - line[i];
+		if (!d) {
+			if (line[i] < lo[i] || line[i] > hi[i]) {
+				return false;
+			}
+			continue;
 		}
-		if (idx >= track.length) {
-			idx %= track.length;
+		double ta = (lo[i] - line[i]) / d;
+		double tb = (hi[i] - line[i]) / d;
+		if (ta > tb) {
+			double tmp = ta;
+			ta = tb;
+			tb = tmp;
 		}
-		if (segment_intersection(line, track.sections[idx].left, point)) {
-			return true;
-		} else if (segment_intersection(line, track.sections[idx].right, point)) {
-			return true;
+		*t0 = fmax(*t0, ta);
+		*t1 = fmin(*t1, tb);
+	}
+	return *t0 <= *t1;
+}
+
+struct Walk {
+	// the cells a segment crosses, in order from its start
+	int cx, cy;			// current cell
+	int ex, ey;			// cell of the end
+	int step_x, step_y;
+	double next_x, next_y;	// line parameter of the next column and row boundary
+	double delta_x, delta_y;
+	double t1;			// end of the segment within the grid
+	int cells;			// most cells left to visit
+};
+
+static bool walk_start(const struct Grid *g, const double *line, struct Walk *w) {
+	// false when the segment misses the grid
+	double t0;
+	if (!clip_to_grid(g, line, &t0, &w->t1)) {
+		return false;
+	}
+	double d[2] = {line[2] - line[0], line[3] - line[1]};
+	double start[2] = {line[0] + d[0] * t0, line[1] + d[1] * t0};
+	double end[2] = {line[0] + d[0] * w->t1, line[1] + d[1] * w->t1};
+	w->cx = grid_coord(start[0], g->origin[0], g->cell, g->cols);
+	w->cy = grid_coord(start[1], g->origin[1], g->cell, g->rows);
+	w->ex = grid_coord(end[0], g->origin[0], g->cell, g->cols);
+	w->ey = grid_coord(end[1], g->origin[1], g->cell, g->rows);
+	w->step_x = d[0] > 0 ? 1 : -1;
+	w->step_y = d[1] > 0 ? 1 : -1;
+	w->next_x = d[0] ? (g->origin[0] + (w->cx + (d[0] > 0)) * g->cell - line[0]) / d[0] : INFINITY;
+	w->next_y = d[1] ? (g->origin[1] + (w->cy + (d[1] > 0)) * g->cell - line[1]) / d[1] : INFINITY;
+	w->delta_x = d[0] ? g->cell / fabs(d[0]) : INFINITY;
+	w->delta_y = d[1] ? g->cell / fabs(d[1]) : INFINITY;
+	w->cells = abs(w->ex - w->cx) + abs(w->ey - w->cy) + 3;	// some slack for rounding
+	return true;
+}
+
+static inline int walk_cell(const struct Grid *g, const struct Walk *w) {
+	return w->cy * g->cols + w->cx;
+}
+
+static inline bool walk_next(const struct Grid *g, struct Walk *w) {
+	// moves on to the next cell, false after the last one
+	if (--w->cells <= 0 || (w->cx == w->ex && w->cy == w->ey) || fmin(w->next_x, w->next_y) > w->t1) {
+		return false;
+	}
+	if (w->next_x < w->next_y) {
+		w->cx += w->step_x;
+		w->next_x += w->delta_x;
+	} else {
+		w->cy += w->step_y;
+		w->next_y += w->delta_y;
+	}
+	return w->cx >= 0 && w->cx < g->cols && w->cy >= 0 && w->cy < g->rows;
+}
+
+static void build_grid(struct Track *t) {
+	/*
+	Uniform grid over the walls, cells about one wall long. Every cell
+	lists the walls crossing it, so a ray only has to test the walls of
+	the cells it crosses no matter how the track winds.
+	 */
+	struct Grid *g = &t->grid;
+	double min[2] = {INFINITY, INFINITY};
+	double max[2] = {-INFINITY, -INFINITY};
+	double total = 0;
+	int w, c, i;
+	for (w=0; w<t->walls; w++) {
+		double *l = t->wall[w];
+		for (i=0; i<2; i++) {
+			min[i] = fmin(min[i], fmin(l[i], l[i+2]));
+			max[i] = fmax(max[i], fmax(l[i], l[i+2]));
 		}
+		total += point_point_distance(l, &l[2]);
+	}
+	// no walls or ones at infinity or NaN (Track refuses those) get one empty cell
+	bool empty = !t->walls || !isfinite(max[0] - min[0]) || !isfinite(max[1] - min[1]) || !isfinite(total);
+	if (empty) {
+		min[0] = min[1] = max[0] = max[1] = total = 0;
+	}
+	g->origin[0] = min[0];
+	g->origin[1] = min[1];
+	g->cell = t->walls && total > 0 ? total / t->walls : 1;
+	g->cols = (int)((max[0] - min[0]) / g->cell) + 1;
+	g->rows = (int)((max[1] - min[1]) / g->cell) + 1;
+	// long thin or sparse tracks, keep the grid itself small
+	while ((double)g->cols * g->rows > 4.0 * t->walls + 64) {
+		g->cell *= 2;
+		g->cols = (int)((max[0] - min[0]) / g->cell) + 1;
+		g->rows = (int)((max[1] - min[1]) / g->cell) + 1;
+	}
 
-		if (prev != 1 && segments_intersect(line, track.sections[idx].front)) {
-			prev = 2;
-			idx++;
-		} else if (prev != 2 && segments_intersect(line, track.sections[idx].back)) {
-			prev = 1;
-			idx--;
-		} else {
+	int cells = g->cols * g->rows;
+	struct Walk walk;
+	g->starts = calloc(cells + 1, sizeof(int));
+	for (w=0; w<t->walls; w++) {
+		if (!empty && walk_start(g, t->wall[w], &walk)) {
+			do {
+				g->starts[walk_cell(g, &walk) + 1]++;
+			} while (walk_next(g, &walk));
+		}
+	}
+	for (c=0; c<cells; c++) {
+		g->starts[c+1] += g->starts[c];
+	}
+	int *fill = malloc(sizeof(int) * (cells + 1));
+	memcpy(fill, g->starts, sizeof(int) * (cells + 1));
+	g->items = malloc(sizeof(int) * (g->starts[cells] > 0 ? g->starts[cells] : 1));
+	for (w=0; w<t->walls; w++) {
+		if (!empty && walk_start(g, t->wall[w], &walk)) {
+			do {
+				g->items[fill[walk_cell(g, &walk)]++] = w;
+			} while (walk_next(g, &walk));
+		}
+	}
+	free(fill);
+
+	int items = g->starts[cells];
+	struct Segments *s = &g->cells;
+	s->count = items;
+	s->x1 = malloc(sizeof(coord) * 4 * (items > 0 ? items : 1));
+	s->y1 = s->x1 + items;
+	s->x2 = s->y1 + items;
+	s->y2 = s->x2 + items;
+	for (i=0; i<items; i++) {
+		double *l = t->wall[g->items[i]];
+		s->x1[i] = l[0];
+		s->y1[i] = l[1];
+		s->x2[i] = l[2];
+		s->y2[i] = l[3];
+	}
+}
+
+bool find_track_intersection(const struct Track *track, const double *line, double *point) {
+	/*
+	Walks the grid cells crossed by the segment and tests their walls.
+	With a point to fill in it returns the hit closest to the start of the
+	segment, without one it returns as soon as any wall is hit.
+	 */
+	const struct Grid *g = &track->grid;
+	struct Walk walk;
+	if (!track->walls || !walk_start(g, line, &walk)) {
+		return false;
+	}
+
+	double d[2] = {line[2] - line[0], line[3] - line[1]};
+	int axis = fabs(d[0]) >= fabs(d[1]) ? 0 : 1;	// to get the parameter of a hit
+	double best = INFINITY;
+	double hit[2];
+	do {
+		int cell = walk_cell(g, &walk);
+		int k;
+		for (k=g->starts[cell]; k<g->starts[cell+1]; k++) {
+			if (!point) {
+				if (segments_intersect(line, track->wall[g->items[k]])) {
+					return true;
+				}
+			} else if (segment_intersection(line, track->wall[g->items[k]], hit)) {
+				double t = (hit[axis] - line[axis]) / d[axis];
+				if (t < best) {
+					best = t;
+					point[0] = hit[0];
+					point[1] = hit[1];
+				}
+			}
+		}
+		// anything closer than the best hit so far would be in the cells already seen
+		if (best <= fmin(walk.next_x, walk.next_y)) {
 			break;
 		}
+	} while (walk_next(g, &walk));
+	return best < INFINITY;
+}
+
+static inline void test_walls(const struct Segments *s, int begin, int end, const double *start, int count,
+		const coord *restrict dx, const coord *restrict dy, coord *restrict t) {
+	// walls begin to end of s against all rays, see rays_intersections
+	int i, k;
+	for (k=begin; k<end; k++) {
+		// start + t * d = wall start + u * wall direction
+		coord ax = s->x1[k] - start[0];
+		coord ay = s->y1[k] - start[1];
+		coord ex = s->x2[k] - s->x1[k];
+		coord ey = s->y2[k] - s->y1[k];
+		coord tn = ax * ey - ay * ex;
+		for (i=0; i<count; i++) {
+			coord inv = 1 / (dx[i] * ey - dy[i] * ex);
+			coord ti = tn * inv;
+			coord ui = (ax * dy[i] - ay * dx[i]) * inv;
+			// parallel walls divide by 0 and fail every comparison
+			bool hit = (ti >= 0) & (ti < t[i]) & (ui >= 0) & (ui <= 1);
+			t[i] = hit ? ti : t[i];
+		}
+	}
+}
+
+// cells rays_intersections keeps on the stack, more go to the heap
+#define RAY_CELLS 1024
+
+void rays_intersections(const struct Track *track, const double *start, int count, const coord *restrict dx, const coord *restrict dy, coord *restrict t) {
+	/*
+	Casts count rays from start to start + (dx[i], dy[i]) at once, t[i] is
+	lowered to the fraction of the ray i up to the first wall it hits (so
+	start them at 1). The walls of the cells around the rays are tested
+	against all rays: they share the start, so each wall only needs its
+	offset and direction once and the loop over the rays has no branches.
+	The cells are those of the bounding box of the rays while that is
+	small, a fan of short rays covers most of it anyway, otherwise only
+	the cells the rays cross.
+	 */
+	const struct Grid *g = &track->grid;
+	if (!track->walls) {
+		return;
+	}
+	double lo[2] = {start[0], start[1]};
+	double hi[2] = {start[0], start[1]};
+	int sx = grid_coord(start[0], g->origin[0], g->cell, g->cols);
+	int sy = grid_coord(start[1], g->origin[1], g->cell, g->rows);
+	int i, c, crossed = 0;	// about the number of cells the rays cross
+	for (i=0; i<count; i++) {
+		double end[2] = {start[0] + dx[i], start[1] + dy[i]};
+		lo[0] = fmin(lo[0], end[0]);
+		hi[0] = fmax(hi[0], end[0]);
+		lo[1] = fmin(lo[1], end[1]);
+		hi[1] = fmax(hi[1], end[1]);
+		crossed += abs(grid_coord(end[0], g->origin[0], g->cell, g->cols) - sx) +
+			abs(grid_coord(end[1], g->origin[1], g->cell, g->rows) - sy) + 1;
+	}
+	if (hi[0] < g->origin[0] || hi[1] < g->origin[1] ||
+			lo[0] > g->origin[0] + g->cols * g->cell || lo[1] > g->origin[1] + g->rows * g->cell) {
+		return;
+	}
+	int x0 = grid_coord(lo[0], g->origin[0], g->cell, g->cols);
+	int x1 = grid_coord(hi[0], g->origin[0], g->cell, g->cols);
+	int y0 = grid_coord(lo[1], g->origin[1], g->cell, g->rows);
+	int y1 = grid_coord(hi[1], g->origin[1], g->cell, g->rows);
+
+	if ((x1 - x0 + 1) * (y1 - y0 + 1) <= crossed) {
+		for (c=y0; c<=y1; c++) {
+			// the cells of a row are next to each other in items
+			test_walls(&g->cells, g->starts[c * g->cols + x0], g->starts[c * g->cols + x1 + 1], start, count, dx, dy, t);
+		}
+		return;
+	}
+
+	struct Walk walks[count ? count : 1];
+	bool inside[count ? count : 1];
+	int size = 0;
+	for (i=0; i<count; i++) {
+		double line[4] = {start[0], start[1], start[0] + dx[i], start[1] + dy[i]};
+		inside[i] = walk_start(g, line, &walks[i]);
+		size += inside[i] ? walks[i].cells : 0;
+	}
+	// the cells of all rays without repeats, in an open addressing hash set
+	// at least twice their number with -1 for the free slots
+	int slots = 16;
+	while (slots < 2 * size) {
+		slots *= 2;
+	}
+	int stack[RAY_CELLS];
+	int *set = slots + size <= RAY_CELLS ? stack : malloc(sizeof(int) * (slots + size));
+	int *unique = set + slots;	// the cells in the order they were found
+	int found = 0;
+	memset(set, -1, sizeof(int) * slots);
+	for (i=0; i<count; i++) {
+		if (!inside[i]) {
+			continue;
+		}
+		do {
+			int cell = walk_cell(g, &walks[i]);
+			unsigned slot = (unsigned)cell * 2654435761u & (slots - 1);
+			while (set[slot] >= 0 && set[slot] != cell) {
+				slot = (slot + 1) & (slots - 1);
+			}
+			if (set[slot] < 0) {
+				set[slot] = cell;
+				unique[found++] = cell;
+			}
+		} while (walk_next(g, &walks[i]));
+	}
+	for (c=0; c<found; c++) {
+		test_walls(&g->cells, g->starts[unique[c]], g->starts[unique[c]+1], start, count, dx, dy, t);
+	}
+	if (set != stack) {
+		free(set);
 	}
-	return false;
 }
 
-int out_of_section(double *pos, int idx) {
+int out_of_section(const struct Track *track, const double *pos, int idx) {
 	/*
 	extends the side line of a section and checks if car-point
 	segment intersects the front/back edges of the section.
 	If it doesn't, the car must be outside.
 	 */
-	struct TrackSection *s = &(track.sections[idx]);
+	const struct TrackSection *s = &(track->sections[idx]);
 	double next_line[4] = {pos[0], pos[1], 
 		s->left[2] + (s->left[2] - s->left[0]),
 		s->left[3] + (s->left[3] - s->left[1])};
@@ -60,38 +349,66 @@ inline void set_line(PyObject *pytuple, double line[4]) {
 	}
 }
 
-void set_section(PyObject *section, int idx) {
-	set_line(PySequence_GetItem(section, 0), track.sections[idx].front);
-	set_line(PySequence_GetItem(section, 1), track.sections[idx].back);
-	set_line(PySequence_GetItem(section, 2), track.sections[idx].left);
-	set_line(PySequence_GetItem(section, 3), track.sections[idx].right);
-	set_line(PySequence_GetItem(section, 4), track.sections[idx].line);
-	track.sections[idx].angle = PyFloat_AsDouble(PySequence_GetItem(section, 5));
+void set_section(struct Track *track, PyObject *section, int idx) {
+	set_line(PySequence_GetItem(section, 0), track->sections[idx].front);
+	set_line(PySequence_GetItem(section, 1), track->sections[idx].back);
+	set_line(PySequence_GetItem(section, 2), track->sections[idx].left);
+	set_line(PySequence_GetItem(section, 3), track->sections[idx].right);
+	set_line(PySequence_GetItem(section, 4), track->sections[idx].line);
+	track->sections[idx].angle = PyFloat_AsDouble(PySequence_GetItem(section, 5));
 }
 
-struct Track* store_track(PyObject *sections) {
-	if (track.sections) {
-		free(track.sections);
-		track.sections = 0;
+static struct Track* finish_track(struct Track *track) {
+	int i;
+	track->walls = 2 * track->length;
+	track->wall = malloc(sizeof(double[4]) * track->walls);
+	for (i=0; i<track->length; i++) {
+		memcpy(track->wall[2*i], track->sections[i].left, sizeof(double[4]));
+		memcpy(track->wall[2*i+1], track->sections[i].right, sizeof(double[4]));
 	}
-	
-	track.length = PySequence_Length(sections);
-	track.sections = malloc(track.length * SECTION_SIZE);
+	build_grid(track);
+
+	return track;
+}
+
+struct Track* store_track(PyObject *sections) {
+	/*
+	Copies the sections into a new, independent track on the C heap.
+	The caller owns it and must free it with delete_track.
+	 */
+	struct Track *track = calloc(1, sizeof(struct Track));
+	track->length = PySequence_Length(sections);
+	track->sections = malloc(track->length * SECTION_SIZE);
 	int i;
-	for (i=0; i<track.length; i++) {
+	for (i=0; i<track->length; i++) {
 		PyObject *section = PySequence_GetItem(sections, i);
-		set_section(section, i);
+		set_section(track, section, i);
 		Py_DECREF(section);
 	}
 
-	return &track;
+	return finish_track(track);
+}
+
+struct Track* store_track_array(const double *sections, int length) {
+	/*
+	Same as store_track from a flat array of SECTION_DOUBLES per section
+	laid out like struct TrackSection (front, back, left, right, line, angle).
+	 */
+	struct Track *track = calloc(1, sizeof(struct Track));
+	track->length = length;
+	track->sections = malloc(track->length * SECTION_SIZE);
+	memcpy(track->sections, sections, track->length * SECTION_SIZE);
+
+	return finish_track(track);
 }
 
 void delete_track(struct Track *track) {
 	if (track) {
-		if (track->sections) {
-			free(track->sections);
-			track->sections = NULL;
-		}
+		free(track->sections);
+		free(track->wall);
+		free(track->grid.starts);
+		free(track->grid.items);
+		free(track->grid.cells.x1);
+		free(track);
 	}
 }
@@ -12,18 +12,50 @@ struct TrackSection {
 	double angle;
 };
 
+// coordinates of the structure-of-arrays walls, float when built with
+// TRACK_FLOAT32 (see setup.py) to fit twice as many in a vector register
+#ifdef TRACK_FLOAT32
+typedef float coord;
+#else
+typedef double coord;
+#endif
+
+struct Segments {
+	// segments (x1, y1) - (x2, y2) with one array per coordinate
+	int count;
+	coord *x1, *y1, *x2, *y2;
+};
+
+struct Grid {
+	double origin[2];
+	double cell;
+	int cols;
+	int rows;
+	int *starts;	// cols*rows+1 offsets into items, one run per cell
+	int *items;		// indices of the walls overlapping each cell
+	struct Segments cells;	// the walls of items, so every cell is a contiguous run
+};
+
+// doubles per section in flat section arrays
+#define SECTION_DOUBLES 21
+
 struct Track {
 	int length;
 	struct TrackSection *sections;
+	int walls;			// left and right borders of every section
+	double (*wall)[4];
+	struct Grid grid;
 };
 
 // for use by others
-bool find_section_intersection(double *line, int idx, double *point);
-int out_of_section(double *pos, int idx);
+bool find_track_intersection(const struct Track *track, const double *line, double *point);
+void rays_intersections(const struct Track *track, const double *start, int count, const coord *restrict dx, const coord *restrict dy, coord *restrict t);
+int out_of_section(const struct Track *track, const double *pos, int idx);
 
 // dumping important data from python to C heap
 struct Track* store_track(PyObject *sections);
+struct Track* store_track_array(const double *sections, int length);
 void delete_track(struct Track *track);
-void set_section(PyObject *section, int idx);
+void set_section(struct Track *track, PyObject *section, int idx);
 
 #endif
@@ -0,0 +1,67 @@
+import os
+import json
+import struct
+import numpy as np
+
+# File layout: magic, little-endian uint32 header length, JSON header,
+# zero padding up to ALIGN bytes and then the (size, ngenes) genomes as
+# raw little-endian float64, so they can be memory-mapped straight away.
+MAGIC = b'NCARPOP\x00'
+VERSION = 2
+ALIGN = 64
+
+def save(path, genomes, **meta):
+	# Writes genomes and a JSON-serialisable header, replacing the file
+	# only once everything has been written.
+	genomes = np.ascontiguousarray(genomes, dtype='<f8')
+	header = dict(meta, version=VERSION, size=genomes.shape[0], ngenes=genomes.shape[1])
+	data = json.dumps(header).encode()
+	offset = len(MAGIC) + 4 + len(data)
+	padding = -offset % ALIGN
+	tmp = path + '.tmp'
+	with open(tmp, 'wb') as f:
+		f.write(MAGIC)
+		f.write(struct.pack('<I', len(data)))
+		f.write(data)
+		f.write(b'\x00' * padding)
+		genomes.tofile(f)
+	os.replace(tmp, path)
+
+def _upgrade(header):
+	# Version 1 stored the states of the random generators instead of the
+	# seed. The genomes are laid out the same, only the seed is unknown:
+	# None, the loader keeps its own.
+	if header['version'] == 1:
+		header.pop('rng', None)
+		header.pop('global_rng', None)
+		header.setdefault('seed', None)
+		header.setdefault('generation', 0)
+		header['version'] = 2
+	return header
+
+def _read_header(f, path):
+	if f.read(len(MAGIC)) != MAGIC:
+		raise ValueError("%s is not a population checkpoint" % path)
+	length, = struct.unpack('<I', f.read(4))
+	header = _upgrade(json.loads(f.read(length).decode()))
+	if header['version'] != VERSION:
+		raise ValueError("Unsupported checkpoint version %d" % header['version'])
+	offset = len(MAGIC) + 4 + length
+	return header, offset + -offset % ALIGN
+
+def read_header(path):
+	with open(path, 'rb') as f:
+		return _read_header(f, path)[0]
+
+def load(path, mmap=True):
+	# Returns (genomes, header). With mmap the genomes are a copy-on-write
+	# memory map, pages are only read when used and writes stay in memory.
+	with open(path, 'rb') as f:
+		header, offset = _read_header(f, path)
+		shape = (header['size'], header['ngenes'])
+		if mmap:
+			genomes = np.memmap(f, dtype='<f8', mode='c', offset=offset, shape=shape)
+		else:
+			f.seek(offset)
+			genomes = np.fromfile(f, dtype='<f8', count=shape[0] * shape[1]).reshape(shape)
+	return genomes, header
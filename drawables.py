@@ -1,6 +1,10 @@
 import math
 import operator
 import pyglet
+# Everything drawn is made after its window (which brings its own context)
+# and the engine runs without any, so loading GL must not open a window.
+# Modules using GL import this one first.
+pyglet.options['shadow_window'] = False
 from pyglet.gl import *
 
 from geometry import Point, Line, Box, Quad, PI, TAU, DEG_TO_RAD, RAD_TO_DEG
@@ -0,0 +1,137 @@
+import time
+import numpy as np
+
+import rng
+import checkpoint
+from timing import timings, now
+from track import Track
+from population import PopulationState
+from parallel import ParallelEvaluator
+from evolution import Evolution
+
+class TrainingEngine(object):
+	# Owns the track, the population and the evolution step. Knows nothing
+	# about windows or GL, so it can be stepped from the pyglet clock or
+	# just as fast as the CPU allows on a machine without a display. The
+	# seed keys all random numbers of a run, a new one is drawn when not given.
+	# A generation ends when every car crashed or stalled (see PopulationState)
+	# or after max_time simulated seconds. threads is for the C population
+	# step of this process, the parallel workers use one each.
+	def __init__(self, carnum=10, sensors=0, speed=None, dt=1/60, track=None, workers=0, evolution=None, seed=None,
+			max_time=60, stall_time=PopulationState.stall_time, min_speed=PopulationState.min_speed, threads=1):
+		self.carnum = carnum
+		self.seed = rng.new_seed() if seed is None else seed
+		self.sensors = sensors
+		self.init_speed = speed if type(speed) == int else 25
+		self.dt = dt
+		self.max_time = max_time
+		self.stall_time = stall_time
+		self.min_speed = min_speed
+		self.threads = threads
+		self.track = track or Track()
+		self.population = None
+		self.cars = [] # per-car views into the population
+		self.leader = None
+		self.generation = 0
+		self.time = 0 # simulated time of the current generation
+		self.evolution = evolution or Evolution(seed=self.seed)
+		self.evaluator = None
+		if workers > 1:
+			self.evaluator = ParallelEvaluator(self.track, workers, self.init_speed, dt, max_time, stall_time, min_speed)
+
+	def start(self, makecars=False):
+		if makecars:
+			self.population = PopulationState(self.carnum, self.sensors, seed=self.seed)
+			self.cars = self.population.views()
+		self.population.stall_time = self.stall_time
+		self.population.min_speed = self.min_speed
+		self.population.threads = self.threads
+		self.time = 0
+		self.population.put_on_track(self.track, self.init_speed, self.generation)
+		self.leader = self.cars[0] if self.cars else None
+
+	def save_population(self, path):
+		# Genomes, network topology, sensor rig, generation and seed,
+		# see checkpoint.py for the file layout.
+		population = self.population
+		network = population.network
+		checkpoint.save(path, network.genomes,
+			generation=self.generation,
+			inputs=network.inputs,
+			layers=[neurons for neurons, inputs in network.shapes[1:]],
+			activation=network.activation,
+			bias=network.bias,
+			sensors=self.sensors,
+			angles=population.rig.angles.tolist(),
+			distances=list(population.rig.max_distances),
+			seed=self.seed)
+
+	def load_population(self, path, mmap=True):
+		# Replaces the population with the one saved at path, the genomes
+		# stay memory-mapped (copy-on-write) unless mmap is False.
+		genomes, header = checkpoint.load(path, mmap)
+		if header['seed'] is not None: # None from version 1 checkpoints
+			self.seed = self.evolution.seed = header['seed']
+		self.population = PopulationState(header['size'], rig=(header['angles'], header['distances']),
+			layers=header['layers'], activation=header['activation'], bias=header['bias'], genomes=genomes, seed=self.seed)
+		self.cars = self.population.views()
+		self.carnum = header['size']
+		self.sensors = header['sensors']
+		self.generation = header['generation']
+
+	def evolve(self):
+		start = now()
+		self.evolution.next_generation(self.population.network.genomes, self.population.fitness, self.generation)
+		self.generation += 1
+		timings.add('evolve', start)
+
+	def step(self, dt=None):
+		# Advances the population by one timestep (fixed self.dt unless given).
+		# Returns True when the generation ended and a new one was started.
+		dt = dt or self.dt
+		self.time += dt
+		population = self.population
+		start = now()
+		population.step(dt)
+		timings.add('step', start)
+		active = population.active
+		if not len(active) or (self.max_time and self.time >= self.max_time):
+			self.evolve()
+			self.start()
+			return True
+		self.leader = self.cars[active[np.argmax(population.fitness[active])]]
+		return False
+
+	def run_generation(self):
+		if self.evaluator:
+			start = now()
+			self.population.fitness[:], steps = self.evaluator.evaluate(self.population.network.genomes, self.seed, self.generation,
+				self.population.config())
+			timings.add('evaluate', start)
+			self.evolve()
+			self.start()
+			return steps
+		# one call for the whole generation, see PopulationState.run
+		steps = self.population.run(self.dt, int(self.max_time / self.dt) if self.max_time else None)
+		self.time = steps * self.dt
+		self.evolve()
+		self.start()
+		return steps
+
+	def run(self, generations=0, report=None):
+		# Runs the given number of generations (forever if 0), calling
+		# report(engine, steps, seconds) after each one.
+		done = 0
+		while not generations or done < generations:
+			t1 = time.perf_counter()
+			steps = self.run_generation()
+			t2 = time.perf_counter()
+			done += 1
+			if report:
+				report(self, steps, t2 - t1)
+		return done
+
+	def close(self):
+		if self.evaluator:
+			self.evaluator.close()
+			self.evaluator = None
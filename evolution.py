@@ -0,0 +1,67 @@
+import numpy as np
+
+import rng
+
+class Evolution(object):
+	# Genetic algorithm over a whole (ncars, ngenes) genome matrix at once:
+	# fitness-ranked or tournament selection, elitism, uniform or blend
+	# crossover and gaussian mutation. Random draws of every generation come
+	# from a generator keyed by (seed, generation), so runs can be repeated.
+	def __init__(self, elite=2, selection='rank', tournament=3, crossover='uniform', alpha=0.5,
+			mutation_rate=0.1, mutation_scale=0.2, seed=None):
+		if selection not in ('rank', 'tournament'):
+			raise ValueError("Selection must be either 'rank' or 'tournament'")
+		if crossover not in ('uniform', 'blend'):
+			raise ValueError("Crossover must be either 'uniform' or 'blend'")
+		self.elite = elite
+		self.selection = selection
+		self.tournament = tournament
+		self.crossover = crossover
+		self.alpha = alpha
+		self.mutation_rate = mutation_rate
+		self.mutation_scale = mutation_scale
+		self.seed = rng.new_seed() if seed is None else seed
+		self.rng = rng.generator(self.seed)
+
+	def ranks(self, fitness):
+		# 0 for the worst, len-1 for the best, ties broken randomly
+		order = np.lexsort((self.rng.random(len(fitness)), fitness))
+		ranks = np.empty(len(fitness), dtype=int)
+		ranks[order] = np.arange(len(fitness))
+		return ranks
+
+	def select(self, fitness, n, ranks=None):
+		# indices of n parents
+		ranks = self.ranks(fitness) if ranks is None else ranks
+		if self.selection == 'tournament':
+			entrants = self.rng.integers(0, len(fitness), (n, self.tournament))
+			return entrants[np.arange(n), np.argmax(ranks[entrants], axis=1)]
+		weights = (ranks + 1) / (ranks + 1).sum()
+		return self.rng.choice(len(fitness), n, p=weights)
+
+	def cross(self, mothers, fathers):
+		if self.crossover == 'blend':
+			u = self.rng.uniform(-self.alpha, 1 + self.alpha, mothers.shape)
+			return mothers + u * (fathers - mothers)
+		return np.where(self.rng.random(mothers.shape) < 0.5, mothers, fathers)
+
+	def mutate(self, genomes):
+		mask = self.rng.random(genomes.shape) < self.mutation_rate
+		genomes[mask] += self.rng.normal(0, self.mutation_scale, np.count_nonzero(mask))
+		return genomes
+
+	def next_generation(self, genomes, fitness, generation=0):
+		# Replaces genomes in place with the next generation bred from them,
+		# the elite come first and are copied unchanged.
+		self.rng = rng.generator(self.seed, generation)
+		n = len(genomes)
+		ranks = self.ranks(np.asarray(fitness))
+		elite = min(self.elite, n)
+		best = np.argsort(ranks)[::-1][:elite]
+		children = n - elite
+		mothers = genomes[self.select(fitness, children, ranks)]
+		fathers = genomes[self.select(fitness, children, ranks)]
+		offspring = self.mutate(self.cross(mothers, fathers))
+		genomes[:elite] = genomes[best]
+		genomes[elite:] = offspring
+		return genomes
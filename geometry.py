@@ -218,6 +218,189 @@ def intersection(line1, line2, point=True, itype=0):
 	else:
 		return True
 
+def intersections(lines1, lines2, itype=0):
+	# intersection() over (n, 4) arrays of line pairs at once.
+	# Returns (n, 2) intersection points and a mask of pairs that intersect,
+	# points of the pairs that don't are undefined.
+	x1, y1, x2, y2 = np.moveaxis(np.asarray(lines1, dtype=float), -1, 0)
+	x3, y3, x4, y4 = np.moveaxis(np.asarray(lines2, dtype=float), -1, 0)
+	dx1 = x1 - x2
+	dx2 = x3 - x4
+	dy1 = y1 - y2
+	dy2 = y3 - y4
+
+	denom = dx1*dy2 - dy1*dx2
+	hit = denom != 0
+
+	a = (x3*y4 - y3*x4)
+	if itype < 2:
+		hit &= (dy2*x1 - dx2*y1 + a) * (dy2*x2 - dx2*y2 + a) <= 0
+
+	b = (x1*y2 - y1*x2)
+	if itype < 1:
+		hit &= (dy1*x3 - dx1*y3 + b) * (dy1*x4 - dx1*y4 + b) <= 0
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		x = (b * dx2 - dx1 * a) / denom
+		y = (b * dy2 - dy1 * a) / denom
+	return np.stack((x, y), axis=-1), hit
+
+def intersection_parameters(lines1, lines2, itype=0):
+	# intersections() plus where the points are along both lines, 0 at the
+	# start and 1 at the end. Returns (points, t, u, hit), the arrays
+	# broadcast so one line can be tested against many.
+	lines1 = np.asarray(lines1, dtype=float)
+	lines2 = np.asarray(lines2, dtype=float)
+	points, hit = intersections(lines1, lines2, itype)
+	x1, y1, x2, y2 = np.moveaxis(lines1, -1, 0)
+	x3, y3, x4, y4 = np.moveaxis(lines2, -1, 0)
+	denom = (x1 - x2)*(y3 - y4) - (y1 - y2)*(x3 - x4)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = ((x1 - x3)*(y3 - y4) - (y1 - y3)*(x3 - x4)) / denom
+		u = ((x1 - x3)*(y1 - y2) - (y1 - y3)*(x1 - x2)) / denom
+	return points, t, u, hit
+
+def expand_ranges(starts, counts):
+	# (owners, positions) of every element of the ranges [start, start + count)
+	owners = np.repeat(np.arange(len(counts)), counts)
+	offsets = np.arange(owners.size) - np.repeat(np.cumsum(counts) - counts, counts)
+	return owners, np.repeat(starts, counts) + offsets
+
+class SegmentGrid(object):
+	# Uniform grid over a set of segments with cells about one segment long.
+	# Every cell lists the segments that pass through it, so a line is only
+	# tested against the segments in the cells it crosses.
+	def __init__(self, segments, cell=None):
+		self.segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+		xs = self.segments[:, 0::2]
+		ys = self.segments[:, 1::2]
+		self.origin = np.array((xs.min(), ys.min())) if len(xs) else np.zeros(2)
+		lengths = np.hypot(xs[:, 1] - xs[:, 0], ys[:, 1] - ys[:, 0])
+		self.cell = cell or (lengths.mean() if len(lengths) and lengths.mean() > 0 else 1)
+		size = (np.array((xs.max(), ys.max())) - self.origin) if len(xs) else np.zeros(2)
+		self.cols, self.rows = (size // self.cell).astype(int) + 1
+		# long thin or sparse sets, keep the grid itself small
+		while self.cols * self.rows > 4 * len(self.segments) + 64:
+			self.cell *= 2
+			self.cols, self.rows = (size // self.cell).astype(int) + 1
+
+		owners, cells = self.cells_crossed(self.segments)
+		order = np.argsort(cells, kind='stable')
+		self.items = owners[order]
+		self.starts = np.searchsorted(cells[order], np.arange(self.cols * self.rows + 1))
+
+	def coords(self, values, axis):
+		size = (self.cols, self.rows)[axis]
+		return np.clip(np.floor((values - self.origin[axis]) / self.cell), 0, size - 1).astype(int)
+
+	def cells_crossed(self, lines):
+		# (line index, cell index) pairs of the cells the lines pass through:
+		# every line is clipped to the grid and cut where it crosses a grid
+		# line, the middle of each piece is in one of its cells
+		lines = np.asarray(lines, dtype=float).reshape(-1, 4)
+		starts = lines[:, :2]
+		deltas = lines[:, 2:] - starts
+		low = self.origin
+		high = self.origin + np.array((self.cols, self.rows)) * self.cell
+		t0 = np.zeros(len(lines))
+		t1 = np.ones(len(lines))
+		with np.errstate(divide='ignore', invalid='ignore'):
+			for axis in (0, 1):
+				d = deltas[:, axis]
+				enter = (low[axis] - starts[:, axis]) / d
+				leave = (high[axis] - starts[:, axis]) / d
+				# lines parallel to the axis are either all inside or all outside
+				within = (starts[:, axis] >= low[axis]) & (starts[:, axis] <= high[axis])
+				t0 = np.maximum(t0, np.where(d != 0, np.minimum(enter, leave), np.where(within, -np.inf, np.inf)))
+				t1 = np.minimum(t1, np.where(d != 0, np.maximum(enter, leave), np.where(within, np.inf, -np.inf)))
+		inside = np.flatnonzero(t0 <= t1)
+		owners = [inside, inside]
+		ts = [t0[inside], t1[inside]]
+		for axis in (0, 1):
+			c0 = self.coords(starts[inside, axis] + t0[inside] * deltas[inside, axis], axis)
+			c1 = self.coords(starts[inside, axis] + t1[inside] * deltas[inside, axis], axis)
+			crossing, boundaries = expand_ranges(np.minimum(c0, c1) + 1, np.abs(c1 - c0))
+			crossing = inside[crossing]
+			owners.append(crossing)
+			ts.append((low[axis] + boundaries * self.cell - starts[crossing, axis]) / deltas[crossing, axis])
+		owners = np.concatenate(owners)
+		ts = np.concatenate(ts)
+		order = np.lexsort((ts, owners))
+		owners = owners[order]
+		ts = ts[order]
+		piece = owners[1:] == owners[:-1]
+		owners = owners[1:][piece]
+		middles = starts[owners] + ((ts[:-1][piece] + ts[1:][piece]) / 2)[:, None] * deltas[owners]
+		cells = self.coords(middles[:, 1], 1) * self.cols + self.coords(middles[:, 0], 0)
+		# pieces through a corner can repeat the cell before them
+		new = np.ones(len(cells), dtype=bool)
+		new[1:] = (owners[1:] != owners[:-1]) | (cells[1:] != cells[:-1])
+		return owners[new], cells[new]
+
+	def candidates(self, lines):
+		# (line index, segment index) pairs worth testing, may contain duplicates
+		owners, cells = self.cells_crossed(lines)
+		cell_owners, positions = expand_ranges(self.starts[cells], self.starts[cells + 1] - self.starts[cells])
+		return owners[cell_owners], self.items[positions]
+
+	def intersections(self, lines):
+		# (n, 2) array of the hits closest to the start of every line, NaN where there is none
+		lines = np.asarray(lines, dtype=float).reshape(-1, 4)
+		points = np.full((len(lines), 2), np.nan)
+		owners, segments = self.candidates(lines)
+		hits, along, _, hit = intersection_parameters(lines[owners], self.segments[segments])
+		owners = owners[hit]
+		hits = hits[hit]
+		order = np.lexsort((along[hit], owners))
+		first = np.unique(owners[order], return_index=True)[1]
+		points[owners[order[first]]] = hits[order[first]]
+		return points
+
+	def intersection(self, line):
+		point = self.intersections((line,))[0]
+		if not np.isnan(point[0]):
+			return tuple(point)
+
+	def crossed(self, lines):
+		# mask of the lines that cross any segment, cheaper than intersections
+		lines = np.asarray(lines, dtype=float).reshape(-1, 4)
+		owners, segments = self.candidates(lines)
+		_, hit = intersections(lines[owners], self.segments[segments])
+		return np.bincount(owners[hit], minlength=len(lines)) > 0
+
+class TrackGeometry(object):
+	# All segments of a track in one (nsections, 5, 4) array, the front,
+	# back, left and right borders and the centre line of every section
+	# (the first 20 columns of Track.section_array()), with a SegmentGrid
+	# over the walls. Every query takes whole arrays of cars.
+	FRONT, BACK, LEFT, RIGHT, LINE = range(5)
+
+	def __init__(self, sections):
+		sections = np.asarray(sections, dtype=float)
+		self.length = len(sections)
+		self.segments = sections[:, :20].reshape(-1, 5, 4)
+		self.angles = sections[:, 20]
+		self.grid = SegmentGrid(self.segments[:, self.LEFT:self.RIGHT+1])
+
+	def find_intersections(self, lines):
+		# (n, 2) closest wall hit of every line, NaN for the ones that miss
+		return self.grid.intersections(lines)
+
+	def collisions(self, lines):
+		# mask of the lines that cross a wall
+		return self.grid.crossed(lines)
+
+	def section_changes(self, positions, idxs):
+		# track.section_change of (n, 2) positions in the sections idxs: 1
+		# past the front border, -1 behind the back one and 0 in between
+		positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+		front, back, left = (self.segments[idxs, i] for i in (self.FRONT, self.BACK, self.LEFT))
+		next_lines = np.concatenate((positions, 2 * left[:, 2:] - left[:, :2]), axis=1)
+		prev_lines = np.concatenate((positions, 2 * left[:, :2] - left[:, 2:]), axis=1)
+		_, ahead = intersections(next_lines, front, itype=1)
+		_, behind = intersections(prev_lines, back, itype=1)
+		return np.where(~ahead, 1, np.where(~behind, -1, 0))
+
 def segment_intersection(segment1, segment2, point=True):
 	return intersection(segment1, segment2, point, 0)
 
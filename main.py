@@ -1,22 +1,26 @@
 import sys
+import signal
 import argparse
-import operator
 import time
 import math
 from collections import defaultdict
 import pyglet
+from drawables import Vec
 from pyglet.gl import *
 from pyglet.window import key
 from pyglet.graphics.vertexbuffer import VertexBufferObject
 import numpy as np
 
-from car import Car
+from car import Car, LINE_COLOURS
 from track import Track
-from drawables import Vec
-
-from cext import cmodule
+from engine import TrainingEngine
+from timing import timings, now
+import checkpoint
 
 class Simulator(pyglet.window.Window):
+	render_interval = 0.25 # seconds of simulation between frames when uncapped
+	max_speedup = 1024
+
 	def __init__(self, *args, settings=None, carnum=10, width=960, height=540, vsync=True, **kwargs):
 		config = pyglet.gl.Config(sample_buffers=1, samples=1, depth_size=16, double_buffer=True)
 		super().__init__(width=width, height=height, config=config, resizable=True, vsync=vsync)
@@ -27,21 +31,24 @@ class Simulator(pyglet.window.Window):
 		if type(settings) == dict:
 			self.settings.update(settings)
 
-		self.init_speed = self.settings['speed'] if type(self.settings['speed']) == int else 25
-		self.carnum = (carnum+1) // 2 * 2 # need even number
 		self.carnum = carnum
-		self.cars = []
+		self.engine = TrainingEngine(carnum=carnum, sensors=self.settings['sensors'], speed=self.settings['speed'],
+			dt=self.settings['dt'] or 1/60, track=Track(self.settings['track']), seed=self.settings['seed'],
+			max_time=self.settings['max_time'], stall_time=self.settings['stall_time'], min_speed=self.settings['min_speed'],
+			threads=self.settings.get('threads', 1))
 		self.car = Car(sensors=self.settings['sensors'], human=True) # will be deleted later if simulation starts
 		self.carline_colours = tuple()
-		self.track = Track()
-		self.car.put_on_track(self.track)
-		self.generation = 0
+		self.track = self.engine.track
+		self.car.put_on_track(self.track, self.engine.seed)
 		self.cars_pos_vbo = VertexBufferObject(self.carnum * 64, GL_ARRAY_BUFFER, GL_DYNAMIC_DRAW)
 		self.cars_col_vbo = VertexBufferObject(self.carnum * 96, GL_ARRAY_BUFFER, GL_STATIC_DRAW)
+		self.coords = np.zeros((self.carnum, 16), dtype=np.float32) # vertices of the car sides
+		self.drawn = None # cars that were active when coords were last written, None for all
 
 		self.time = 0
+		self.speedup = max(1, self.settings['speedup'] or 1) # fixed dt training steps per frame
+		self.uncapped = self.settings['uncapped'] # step flat out, draw every render_interval
 		self.fps = pyglet.clock.ClockDisplay()
-		self.times = defaultdict(list)
 		self.counter = 0
 
 		self.setup_labels()
@@ -57,103 +64,70 @@ class Simulator(pyglet.window.Window):
 		self.maintimes_label = pyglet.text.Label(text="", x=10, y=self.height-40, font_name="Lucida Console", font_size=10)
 		self.cartimes_label = pyglet.text.Label(text="", x=10, y=self.height-60, font_name="Lucida Console", font_size=10)
 
-	def start(self, makecars=False):
+	@property
+	def cars(self):
+		return self.engine.cars
+
+	@property
+	def generation(self):
+		return self.engine.generation
+
+	def start(self, makecars=False, resume=None):
+		# resume is the path of a checkpoint to take the population from
+		if resume:
+			self.engine.load_population(resume)
+		self.engine.start(makecars and not resume)
+		self.drawn = None
 		if makecars:
-			self.cars = [Car(sensors=self.settings['sensors']) for i in range(self.carnum)]
-			self.carline_colours = sum((car.line_colours for car in self.cars),())
+			self.carline_colours = LINE_COLOURS * self.carnum
 			self.cars_col_vbo.set_data(Vec(*self.carline_colours))
 		self.car = self.cars[0]
-		for car in self.cars:
-			car.put_on_track(self.track)
-			car.accelerate(self.init_speed)
-
-	def evolve(self):
-		self.generation += 1
-		for car in self.cars[1:]:
-			car.driver.learn_from(self.cars[0].driver)
-			car.driver.randomize()
-		return
-		#self.maintimes_label.text = "Generation: %d" % self.generation
-		cars = sorted(self.cars, key=operator.attrgetter('section_idx', 'time'), reverse=True)
-		if cars[1:2] and cars[1].section_idx < 1:
-			#print("Don't have at least two good specimen, randomizing")
-			[car.driver.randomize() for car in self.cars]
-			return
-			pass
-		best = cars[0].driver
-		runnerup = cars[1].driver
-		to_mutate = (self.carnum - 2) // 2
-		#print("best section: %d, runnerup section: %d" % (best.section_idx, runnerup.section_idx))
-		# something's wrong here, need to rethink
-		for i, pair in enumerate(zip(self.cars[2::2], self.cars[3::2])):
-			severity = 0.25 * i/to_mutate
-			chance = 1 - i/to_mutate
-			pair[0].driver.learn_from(best, mutate=i, chance=chance, severity=severity)
-			pair[1].driver.learn_from(runnerup, mutate=i, chance=chance, severity=severity)
-		#print("cars[0] == best: %s" % (self.cars[0].driver.network.layers[1].neurons[0].weights == best.driver.network.layers[1].neurons[0].weights))
-		#print("cars[0] %d, best: %d" % (id(self.cars[0].driver.network.layers[1].neurons[0].weights), id(best.driver.network.layers[1].neurons[0].weights)))
-		#print("copied and mutated!")
-
-	def set_avg_time(self, cat, time, limit=10):
-		self.times[cat].append(time)
-		if len(self.times[cat]) > limit:
-			self.times[cat].pop(0)
-
-	def get_avg_time(self, cat):
-		if len(self.times[cat]):
-			return sum(self.times[cat]) / len(self.times[cat])
-		else:
-			return 0
-
-	def set_and_get_avg_time(self, cat, time, limit=10):
-		self.set_avg_time(cat, time, limit)
-		return self.get_avg_time(cat)
 
 	def update(self, dt):
 		dt = min(dt, 1/30) # slow down time instead of "dropping" frames and having quick jumps in space
-		#dt = 1/40
-		self.time += dt
-		self.main_label.text = "Time: %.3f. Generation: %d" % (self.time, self.generation)
 		for key in self.keystate:
 			if self.keystate[key]:
 				self.dispatch_event('on_key_press', key, False)
-		t1 = time.time()
+		start = now()
 		if len(self.cars):
-			for car in self.cars:
-				car.update(dt)
-			if all(car.collided for car in self.cars):
-				self.evolve()
-				self.start()
-				return
-			s = [car for car in self.cars if not car.collided]
-			leader = sorted(s, key=operator.attrgetter('section_idx'))[-1]
-			#leader = sorted(self.cars, key=operator.attrgetter('section_idx'))[-1]
-			if self.car.section_idx < leader.section_idx:
-				self.car = leader
+			self.simulate()
 		else:
+			self.time += dt
 			self.car.update(dt)
-		t2 = time.time()
+		self.main_label.text = "Time: %.3f. Generation: %d. Speed: %s" % (self.time, self.generation,
+			"uncapped" if self.uncapped else "x%d" % self.speedup)
+		start = timings.add('update', start)
 		if not self.settings['nofollow']:
 			self.x = self.car.x
 			self.y = self.car.y
 		self.draw()
-		t3 = time.time()
+		timings.add('draw', start)
 		if self.settings['timings'] or self.settings['manual']:
-			drawtime = 1000 * self.set_and_get_avg_time('draw', t3 - t2)
-			cardraw = 1000 * self.get_avg_time('cardraw')
-			coords = 1000 * self.get_avg_time('lines')
-			drawcall = 1000 * self.get_avg_time('drawcall')
-			updatetime = 1000 * self.set_and_get_avg_time('update', t2 - t1)
-			sensors = 1000 * self.get_avg_time('sensors')
-			extra = 1000 * self.get_avg_time('extra')
-			percar = 1000 * updatetime 
-			if not self.settings['manual']:
-				#percar /= sum(not car.collided for car in self.cars)
-				percar /= len(self.cars)
-				cardrawdetail = "(cars=%.2fms:coords:%.2fms,draw=%.2fms)" % (cardraw, coords, drawcall)
-			else:
-				cardrawdetail = ""
-			self.maintimes_label.text = "dt=%2dms,draw=%2dms%s,upd=%04.1fms(%.2fus/car)" % (1000*dt, drawtime, cardrawdetail, updatetime, percar)
+			update = timings.stage('update').summary()
+			draw = timings.stage('draw').summary()
+			step = timings.stage('step').summary()
+			percar = step.get('p50_ns', 0) / 1000 / max(1, len(self.cars))
+			self.maintimes_label.text = "dt=%2dms,draw=%.2fms(p99 %.2fms),upd=%.2fms(p99 %.2fms, %.2fus/car/step)" % (
+				1000*dt, draw['p50_ns'] / 1e6, draw['p99_ns'] / 1e6, update['p50_ns'] / 1e6, update['p99_ns'] / 1e6, percar)
+
+	def simulate(self):
+		# Training runs in steps of the engine's fixed dt, independent of the
+		# frame rate: speedup steps per frame, or as many as fit in
+		# render_interval seconds when uncapped.
+		engine = self.engine
+		deadline = time.perf_counter() + self.render_interval
+		steps = 0
+		while (time.perf_counter() < deadline) if self.uncapped else (steps < self.speedup):
+			steps += 1
+			self.time += engine.dt
+			if engine.step():
+				self.car = self.cars[0]
+				self.drawn = None
+				if self.settings['checkpoint']:
+					engine.save_population(self.settings['checkpoint'])
+		leader = engine.leader
+		if self.car.section_idx < leader.section_idx:
+			self.car = leader
 
 	def setup2d_init(self):
 		glClear(GL_COLOR_BUFFER_BIT)
@@ -183,29 +157,21 @@ class Simulator(pyglet.window.Window):
 
 		self.setup2d_camera()
 		self.track.draw()
-		t1 = time.time()
 		self.draw_cars()
-		t2 = time.time()
-		self.set_avg_time('cardraw', t2-t1)
 
 	def draw_cars(self):
 		glLoadIdentity()
-		t1 = time.time()
+		start = now()
 		if len(self.cars):
-			if cmodule:
-				pos = ((car.x, car.y, car.rot) for car in self.cars)
-				self.coords = cmodule.car_lines(pos, self.carnum)
-			else:
-				coords = sum((car.linecoords for car in self.cars), ())
-				self._coords = np.array(coords, dtype=GLfloat) # must keep the array ref in python
-				self.coords = self._coords.ctypes.data
-				#self.coords = Vec(*coords)
-
-			t2 = time.time()
+			population = self.engine.population
+			# only cars that were still moving at the last draw changed since
+			population.lines(self.coords, self.drawn)
+			self.drawn = population.active
+			start = timings.add('car_lines', start)
 
 			self.cars_col_vbo.bind()
 			glColorPointer(3, GL_FLOAT, 0, self.cars_col_vbo.ptr)
-			self.cars_pos_vbo.set_data(self.coords)
+			self.cars_pos_vbo.set_data(self.coords.ctypes.data)
 			self.cars_pos_vbo.bind()
 			glVertexPointer(2, GL_FLOAT, 0, self.cars_pos_vbo.ptr)
 			glEnableClientState(GL_VERTEX_ARRAY)
@@ -215,21 +181,14 @@ class Simulator(pyglet.window.Window):
 			glDisableClientState(GL_VERTEX_ARRAY)
 			self.cars_col_vbo.unbind()
 			self.cars_pos_vbo.unbind()
+			timings.add('draw_cars', start)
 		else:
-			t2 = time.time()
 			self.car.draw()
-		t3 = time.time()
 		if self.settings['manual']:
 			self.car.draw_section()
 			self.car.draw_points()
-		t4 = time.time()
 		if self.settings['cameras']:
 			self.car.draw_sensors()
-		t5 = time.time()
-		self.set_avg_time('lines', t2 - t1)
-		self.set_avg_time('drawcall', t3 - t2)
-		self.set_avg_time('extra', t4 - t3)
-		self.set_avg_time('sensors', t5 - t4)
 
 	def draw_labels(self):
 		self.main_label.draw()
@@ -266,13 +225,26 @@ class Simulator(pyglet.window.Window):
 			if self.scale < 3:
 				self.scale += 0.1
 		elif symbol == key.C:
-			self.car.check_collision()
+			if not len(self.cars):
+				self.car.check_collision()
 			self.keystate[symbol] = False
 		elif symbol == key.R:
 			if len(self.cars):
 				self.start()
 				return
-			self.car.put_on_track(self.track)
+			self.car.put_on_track(self.track, self.engine.seed)
+		elif symbol in (key.EQUAL, key.NUM_ADD):
+			self.speedup = min(self.max_speedup, self.speedup * 2)
+			self.keystate[symbol] = False
+		elif symbol in (key.MINUS, key.NUM_SUBTRACT):
+			self.speedup = max(1, self.speedup // 2)
+			self.keystate[symbol] = False
+		elif symbol == key.U:
+			self.uncapped = not self.uncapped
+			self.keystate[symbol] = False
+		elif symbol == key.T:
+			timings.dump(self.settings['timings_file'] or 'timings.json')
+			self.keystate[symbol] = False
 		elif symbol == key.N:
 			self.car.change_section(self.car.section_idx + 1)
 			self.keystate[symbol] = False
@@ -284,6 +256,39 @@ class Simulator(pyglet.window.Window):
 		if symbol in [key.LEFT, key.RIGHT]:
 			self.car.steering = 0
 
+def run_headless(args):
+	engine = TrainingEngine(carnum=args.cars, sensors=args.sensors, speed=args.speed, dt=args.dt,
+		track=Track(args.track), workers=args.workers, seed=args.seed,
+		max_time=args.max_time, stall_time=args.stall_time, min_speed=args.min_speed, threads=args.threads)
+	if args.resume:
+		engine.load_population(args.resume)
+	engine.start(not args.resume)
+	print("Seed: %d" % engine.seed)
+	if args.still:
+		engine.population.speed[:] = 0
+		engine.population.autopilot = False
+	started = time.perf_counter()
+	first = engine.generation
+
+	def report(engine, steps, seconds):
+		total = time.perf_counter() - started
+		generations = engine.generation - first
+		print("Generation %d: %d steps (%.1fs simulated) in %.3fs, %.2f generations/s" % (
+			engine.generation, steps, steps * engine.dt, seconds, generations / total))
+		if args.checkpoint:
+			engine.save_population(args.checkpoint)
+		if args.timings and engine.generation % args.timings == 0:
+			print(timings.table())
+
+	try:
+		engine.run(args.generations, report)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		engine.close()
+		if args.timings_file:
+			timings.dump(args.timings_file)
+
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 	parser.add_argument('-n', '--cars', action="store", type=int, default=10,
@@ -301,20 +306,66 @@ if __name__ == "__main__":
 	parser.add_argument('--still', action="store_true", default=False,
 		help="Disable neural network and don't move the cars")
 	parser.add_argument('-t', '--timings', action="store", type=int, default=0,
-		help="Show various timings")
+		help="Show various timings, in headless mode print stage timings every this many generations")
+	parser.add_argument('--stage-timings', action="store_true", default=False,
+		help="Time physics, sensors and inference separately, slower than the combined C step")
+	parser.add_argument('--timings-file', action="store", default=None, metavar='PATH',
+		help="Dump stage timings to this JSON (or .csv) file on exit, on SIGUSR1 and on T in the window")
+	parser.add_argument('--headless', action="store_true", default=False,
+		help="Train without a window, stepping with a fixed dt as fast as possible")
+	parser.add_argument('--dt', action="store", type=float, default=1/60,
+		help="Fixed simulation timestep of the training")
+	parser.add_argument('--speedup', action="store", type=int, default=1,
+		help="Training steps per rendered frame, changed with +/- in the window")
+	parser.add_argument('--uncapped', action="store_true", default=False,
+		help="Train as fast as possible and only draw every %.2fs, toggled with U" % Simulator.render_interval)
+	parser.add_argument('-g', '--generations', action="store", type=int, default=0,
+		help="Stop headless training after this many generations (0 runs forever)")
+	parser.add_argument('-w', '--workers', action="store", type=int, default=0,
+		help="Evaluate generations on this many worker processes in headless mode")
+	parser.add_argument('--threads', action="store", type=int, default=1,
+		help="Threads stepping the population in C, 0 for one per core")
+	parser.add_argument('--track', action="store", default=None, metavar='PATH',
+		help="Load the track from a track file instead of the built-in one")
+	parser.add_argument('--max-time', action="store", type=float, default=60,
+		help="End a generation after this many simulated seconds (0 for no limit)")
+	parser.add_argument('--stall-time', action="store", type=float, default=10,
+		help="Retire cars that got no further on the track for this many seconds (0 never does)")
+	parser.add_argument('--min-speed', action="store", type=float, default=0,
+		help="Retire cars slower than this on average once they have driven for --stall-time seconds")
+	parser.add_argument('--seed', action="store", type=int, default=None,
+		help="Seed of all random numbers of the run, a new one is drawn by default")
+	parser.add_argument('--resume', action="store", default=None, metavar='PATH',
+		help="Continue training from a population checkpoint")
+	parser.add_argument('--checkpoint', action="store", default=None, metavar='PATH',
+		help="Save the population to this checkpoint after every generation")
 	parser.add_argument('--window-size', action="store", nargs=2, dest='wsize', metavar=('WIDTH', 'HEIGHT'), default=(960, 540))
 	parser.add_argument('--width', action="store", type=int, default=None)
 	parser.add_argument('--height', action="store", type=int, default=None)
 	args = parser.parse_args()
+	if args.resume:
+		# the checkpoint decides the population size and the sensors
+		header = checkpoint.read_header(args.resume)
+		args.cars = header['size']
+		args.sensors = header['sensors']
+	timings.per_stage = args.stage_timings
+	if args.timings_file and hasattr(signal, 'SIGUSR1'):
+		signal.signal(signal.SIGUSR1, lambda signum, frame: timings.dump(args.timings_file))
+
+	if args.headless:
+		run_headless(args)
+		sys.exit(0)
 
-	settings = {k:getattr(args, k) for k in ['manual', 'cameras', 'timings', 'sensors','speed', 'nofollow']}
+	settings = {k:getattr(args, k) for k in ['manual', 'cameras', 'timings', 'sensors','speed', 'nofollow', 'checkpoint', 'track', 'timings_file', 'seed',
+		'dt', 'speedup', 'uncapped', 'max_time', 'stall_time', 'min_speed', 'threads']}
 	simulator = Simulator(settings=settings, carnum=args.cars, width=args.width or args.wsize[0], height=args.height or args.wsize[1])
 	if not args.manual:
-		simulator.start(True)
-	if args.still:
-		for car in simulator.cars:
-			car.speed = 0
-			car.human = True
+		simulator.start(True, args.resume)
+	if args.still and simulator.cars:
+		simulator.engine.population.speed[:] = 0
+		simulator.engine.population.autopilot = False
 		
 	pyglet.app.run()
+	if args.timings_file:
+		timings.dump(args.timings_file)
 	#print()
@@ -1,35 +1,52 @@
-import math
 import random
 import numpy as np
 from cext import cmodule
 
+import rng
+
+LAYERS = (5, 3, 1) # neurons in each layer after the input one
+
+def layer_shapes(inputs, *layers):
+	# (neurons, inputs+1) of every layer, the first one being as wide as the input
+	shapes = []
+	for neurons in (inputs,) + layers:
+		shapes.append((neurons, inputs + 1))
+		inputs = neurons
+	return shapes
+
 class CDriver:
-	def __init__(self, inputs):
-		self.cnetaddr = cmodule.create_network(inputs, (5,3,1))
+	# weights are keyed by (seed, generation, idx), see rng.py, a new seed
+	# is drawn when none is given. genome is a view of the C network's
+	# weights, writing to it changes the network.
+	def __init__(self, inputs, seed=None, generation=0, idx=0):
+		self.inputs = inputs
+		seed = rng.new_seed() if seed is None else seed
+		self.network = cmodule.Network(inputs, LAYERS, seed & rng.MASK64, generation, idx)
+		self.genome = np.asarray(self.network)
 
-	def __del__(self):
-		if cmodule:
-			cmodule.delete_network(self.cnetaddr)
+	def __getstate__(self):
+		# the network is a C object, pickle its weights instead
+		return {'inputs': self.inputs, 'genome': self.get_genome()}
 
-	def randomize(self):
-		cmodule.randomize_network(self.cnetaddr)
+	def __setstate__(self, state):
+		self.__init__(state['inputs'])
+		self.set_genome(state['genome'])
+
+	def randomize(self, seed=None, generation=0, idx=0):
+		seed = rng.new_seed() if seed is None else seed
+		cmodule.randomize_network(self.network, seed & rng.MASK64, generation, idx)
 
 	def compute(self, speed, *sensors):
-		return cmodule.activate_network(self.cnetaddr, (speed,) + sensors)[0]
+		return cmodule.activate_network(self.network, (speed,) + sensors)[0]
 
-	def mutate(self, severity, chance):
-		return
-		for layer in self.network.layers:
-			if random.random() < chance:
-				for neuron in layer.neurons:
-					neuron.weights = tuple(neuron.weights * np.random.uniform(-severity/2, severity/2, neuron.inputs+1) + neuron.weights)
-
-	def learn_from(self, driver, mutate=False, chance=0, severity=0):
-		if self == driver:
-			print("Trying to learn from yourself has not effect! (Other than a segfault, of course)")
-			return
-		cmodule.delete_network(self.cnetaddr)
-		self.cnetaddr = cmodule.copy_network(driver.cnetaddr)
+	def get_genome(self, out=None):
+		if out is None:
+			return self.genome.copy()
+		out[:] = self.genome
+		return out
+
+	def set_genome(self, genome):
+		self.genome[:] = genome
 
 class PybrainDriver(object):
 	def __init__(self, inputs):
@@ -59,109 +76,150 @@ class PybrainDriver(object):
 					self.network.params[i] -= self.network.params[i] * severity
 
 class Driver(object):
-	def __init__(self, inputs):
-		self.network = Network(inputs, 5, 3, 1)
-		self.randomize()
+	# Pure Python CDriver, the same weights for the same key
+	def __init__(self, inputs, seed=None, generation=0, idx=0):
+		self.inputs = inputs
+		self.network = Network(inputs, *LAYERS)
+		self.randomize(seed, generation, idx)
 
-	def randomize(self):
-		self.network.randomize()
+	def randomize(self, seed=None, generation=0, idx=0):
+		self.network.randomize(seed, generation, idx)
 
 	def compute(self, speed, *sensors):
 		outputs = self.network.predict([speed, *sensors])
 		return outputs[0]
 
-	def mutate(self, severity, chance):
-		for layer in self.network.layers:
-			if random.random() < chance:
-				for neuron in layer.neurons:
-					neuron.weights = tuple(neuron.weights * np.random.uniform(-severity/2, severity/2, neuron.inputs+1) + neuron.weights)
-
-	def learn_from(self, driver, mutate=False, chance=0, severity=0):
-		self.network = driver.network.copy()
-		if mutate:
-			self.mutate(severity, chance)
-
-		# minimalist tanh network
-
-class Neuron(object):
-	__slots__ = ['activation', 'weights', 'bias_weight', 'inputs']
-
-	def __init__(self, activation, inputs):
-		self.activation = activation
-		self.inputs = inputs
-		self.weights = np.random.uniform(size=inputs+1) * 2 - 1
-		self.weights = np.ones(inputs+1)
-		self.weights = tuple(np.ones(inputs+1))
-
-	def activate(self, inputs, bias):
-		return self.activation(sum(p[0]*p[1] for p in zip(self.weights, inputs + (bias,))))
-
-	def randomize(self):
-		self.weights = tuple(np.random.uniform(size=self.inputs+1) * 2 - 1)
+	def get_genome(self, out=None):
+		if out is None:
+			return self.network.genome.copy()
+		out[:] = self.network.genome
+		return out
 
-	def __repr__(self):
-		return "Neuron weights: %s" % str(self.weights)
+	def set_genome(self, genome):
+		self.network.genome[:] = genome
 
 def sigmoid(x):
 	return 1/(1 + np.exp(-x))
 
+def identity(x):
+	return x
+
+ACTIVATIONS = {'tanh': np.tanh, 'sigmoid': sigmoid, 'unit': identity}
+
 class Layer(object):
-	def __init__(self, inputs, neurons, activation='tanh', bias=0):
+	# matrix is (neurons, inputs+1), the weights of every neuron with the
+	# bias weight last, weights and bias_weights are views of it
+	def __init__(self, inputs, neurons, activation='tanh', bias=0, matrix=None):
 		self.activation = activation
-		if activation == "tanh":
-			func = math.tanh
-		elif activation == 'sigmoid':
-			func = sigmoid
-		elif activation == 'unit':
-			func = lambda x: x
-		else:
-			func = lambda x: x
-
-		self.neurons = tuple(Neuron(func, inputs) for i in range(neurons))
+		self.func = ACTIVATIONS.get(activation, identity)
+		self.inputs = inputs
+		self.neurons = neurons
 		self.bias = bias
+		self.matrix = np.zeros((neurons, inputs + 1)) if matrix is None else matrix
+		self.weights = self.matrix[:, :-1]
+		self.bias_weights = self.matrix[:, -1]
 
 	def activate(self, inputs):
-		return tuple(neuron.activate(inputs, self.bias) for neuron in self.neurons)
-
-	def randomize(self):
-		for neuron in self.neurons:
-			neuron.randomize()
-
-	def copy(self):
-		layer = self.__class__(self.neurons[0].inputs, len(self.neurons), self.activation)
-		for i in range(len(self.neurons)):
-			layer.neurons[i].weights = tuple(self.neurons[i].weights)
-		return layer
+		# inputs is (inputs,) or (batch, inputs)
+		sums = inputs @ self.weights.T
+		if self.bias:
+			sums += self.bias_weights * self.bias
+		return self.func(sums)
 
 	def __repr__(self):
-		return "%s layer with %d neurons:\n%s" % (self.activation, len(self.neurons), "\n".join(str(neuron) for neuron in self.neurons))
+		return "%s layer with %d neurons:\n%s" % (self.activation, self.neurons, self.matrix)
 
 class Network(object):
-	def __init__(self, inputs, *layers, activation='tanh'):
+	# Every layer is a view into one genome array laid out like the C
+	# networks, so randomizing, mutating and copying work on whole arrays
+	def __init__(self, inputs, *layers, activation='tanh', genome=None):
 		self.inputs = inputs
 		self.outputs = layers[-1]
+		self.hidden = layers
 		self.activation = activation
-		self.layers = [Layer(inputs, inputs, activation)]
-		for neurons in layers:
-			self.layers.append(Layer(inputs, neurons, activation))
-			inputs = len(self.layers[-1].neurons)
+		self.shapes = layer_shapes(inputs, *layers)
+		size = sum(neurons * inputs for neurons, inputs in self.shapes)
+		self.genome = np.zeros(size) if genome is None else genome
+		self.layers = []
+		offset = 0
+		for neurons, width in self.shapes:
+			matrix = self.genome[offset:offset+neurons*width].reshape(neurons, width)
+			self.layers.append(Layer(width - 1, neurons, activation, matrix=matrix))
+			offset += neurons * width
 
 	def predict(self, inputs):
-		outputs = tuple(inputs)
+		# inputs is (inputs,) or a batch (n, inputs), returns (outputs,) or (n, outputs)
+		outputs = np.asarray(inputs, dtype=float)
 		for layer in self.layers:
 			outputs = layer.activate(outputs)
 		return outputs
 
-	def randomize(self):
-		for layer in self.layers:
-			layer.randomize()
+	def randomize(self, seed=None, generation=0, idx=0):
+		# uniform weights in [-1, 1) keyed like CDriver, see rng.py
+		seed = rng.new_seed() if seed is None else seed
+		rng.uniform(seed, generation, idx, 1, len(self.genome), rng.STREAM_WEIGHTS, self.genome.reshape(1, -1))
+		self.genome *= 2
+		self.genome -= 1
 
 	def copy(self):
-		network = self.__class__(self.inputs, self.outputs, activation=self.activation)
-		network.layers = [layer.copy() for layer in self.layers]
-		return network
+		return self.__class__(self.inputs, *self.hidden, activation=self.activation, genome=self.genome.copy())
 
 	def __repr__(self):
 		inout = "Input layer has %d inputs and %d output%s." % (self.inputs, self.outputs, "s" if self.outputs > 1 else "")
 		hidden = "\n".join(str(layer) for layer in self.layers[1:])
 		return "Feedforward network with %d hidden layers. \n%s\nHidden:\n%s" % (len(self.layers)-2, inout, hidden)
+
+class PopulationNetwork(object):
+	# Networks of a whole population evaluated at once. Every layer is an
+	# (ncars, neurons, inputs+1) array with the bias weight in the last
+	# column, all of them views into one (ncars, ngenes) genome matrix
+	# laid out the same way as the C networks and Driver.get_genome().
+	# Given genomes (e.g. a memory-mapped checkpoint) are used as they are,
+	# otherwise every row gets the weights a CDriver keyed by (seed, 0, row) has.
+	def __init__(self, size, inputs, *layers, activation='tanh', bias=0, genomes=None, seed=0):
+		self.size = size
+		self.inputs = inputs
+		self.outputs = layers[-1]
+		self.activation = activation
+		self.bias = bias
+		self.seed = seed
+		self.shapes = layer_shapes(inputs, *layers)
+		self.ngenes = sum(neurons * inputs for neurons, inputs in self.shapes)
+		if genomes is not None and genomes.shape != (size, self.ngenes):
+			raise ValueError("Genomes must be of shape (%d, %d)" % (size, self.ngenes))
+		self.genomes = np.empty((size, self.ngenes)) if genomes is None else genomes
+		self.weights = []
+		offset = 0
+		for shape in self.shapes:
+			end = offset + shape[0] * shape[1]
+			self.weights.append(self.genomes[:, offset:end].reshape((size,) + shape))
+			offset = end
+		if genomes is None:
+			self.randomize()
+
+	def randomize(self, generation=0, first=0):
+		# first is the index of the first car, for parts of a population
+		rng.uniform(self.seed, generation, first, self.size, self.ngenes, rng.STREAM_WEIGHTS, self.genomes)
+		self.genomes *= 2
+		self.genomes -= 1
+
+	def activate(self, inputs, idx=None):
+		# inputs is (ncars, inputs), returns (ncars, outputs), with the
+		# networks of the cars idx (int indices) when given
+		outputs = np.asarray(inputs, dtype=float)
+		for weights in self.weights:
+			if idx is not None:
+				weights = weights[idx]
+			sums = np.einsum('noi,ni->no', weights[..., :-1], outputs)
+			if self.bias:
+				sums += weights[..., -1] * self.bias
+			outputs = ACTIVATIONS.get(self.activation, identity)(sums)
+		return outputs
+
+	def read_drivers(self, drivers):
+		for genome, driver in zip(self.genomes, drivers):
+			driver.get_genome(genome)
+
+	def write_drivers(self, drivers):
+		for genome, driver in zip(self.genomes, drivers):
+			driver.set_genome(genome)
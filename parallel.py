@@ -0,0 +1,99 @@
+import os
+import numpy as np
+from multiprocessing import Pool, shared_memory
+
+import geometry
+from track import section_change
+from population import PopulationState
+from cext import cmodule
+
+class SharedTrack(object):
+	# Read-only track made from the (length, 21) section array of a Track,
+	# see Track.section_array(). Workers build it on top of shared memory
+	# instead of constructing the Python geometry of the track again.
+	def __init__(self, sections, circular=True):
+		self.array = sections
+		self.length = len(sections)
+		self.circular = circular
+		self.geometry = geometry.TrackGeometry(sections)
+		if cmodule:
+			self.ctrack = cmodule.Track(sections)
+
+	@property
+	def start(self):
+		line = self.array[0, 16:20]
+		return (line[0] + line[2]) / 2, (line[1] + line[3]) / 2, self.array[0, 20]
+
+	def find_intersections(self, lines, idxs=None):
+		return self.geometry.find_intersections(lines)
+
+	def find_intersection(self, line, idx=None):
+		return self.geometry.grid.intersection(line)
+
+	def changed_section(self, pos, idx):
+		return section_change(self.array, pos, idx)
+
+	def changed_sections(self, positions, idxs):
+		return self.geometry.section_changes(positions, idxs)
+
+_worker = {}
+
+def init_worker(name, shape, circular, speed, dt, max_steps, stall_time, min_speed):
+	shm = shared_memory.SharedMemory(name=name)
+	sections = np.ndarray(shape, dtype=float, buffer=shm.buf)
+	_worker.update(shm=shm, track=SharedTrack(sections, circular), population=None, config=None,
+		speed=speed, dt=dt, max_steps=max_steps, stall_time=stall_time, min_speed=min_speed)
+
+def evaluate_genomes(job):
+	# Runs one generation of the given flat genomes in this worker, first
+	# being the index of their first car in the population and config the
+	# PopulationState.config() of it. Returns their fitness and the number
+	# of steps it took.
+	genomes, seed, generation, first, config = job
+	population = _worker['population']
+	if population is None or population.size != len(genomes) or population.seed != seed or _worker['config'] != config:
+		population = _worker['population'] = PopulationState(len(genomes), seed=seed, **config)
+		_worker['config'] = config
+		population.stall_time = _worker['stall_time']
+		population.min_speed = _worker['min_speed']
+	population.network.genomes[:] = genomes
+	population.put_on_track(_worker['track'], _worker['speed'], generation, first)
+	steps = population.run(_worker['dt'], _worker['max_steps'])
+	return population.fitness.copy(), steps
+
+class ParallelEvaluator(object):
+	# Splits a population's genomes across a pool of worker processes that
+	# share the track sections through shared memory. Genomes go out and
+	# fitness comes back as flat arrays with the rig and network settings,
+	# nothing else crosses processes.
+	def __init__(self, track, workers=None, speed=25, dt=1/60, max_time=60,
+			stall_time=PopulationState.stall_time, min_speed=PopulationState.min_speed):
+		self.workers = workers or os.cpu_count()
+		sections = track.section_array()
+		self.shm = shared_memory.SharedMemory(create=True, size=sections.nbytes)
+		np.ndarray(sections.shape, dtype=float, buffer=self.shm.buf)[:] = sections
+		self.pool = Pool(self.workers, initializer=init_worker,
+			initargs=(self.shm.name, sections.shape, track.circular, speed, dt,
+				int(max_time / dt) if max_time else None, stall_time, min_speed))
+
+	def evaluate(self, genomes, seed=0, generation=0, config=None):
+		# cars are keyed by their index in the whole population, so the
+		# results don't depend on the number of workers. config is the
+		# PopulationState.config() of the genomes, the defaults when None.
+		config = config or {}
+		chunks = [chunk for chunk in np.array_split(genomes, self.workers) if len(chunk)]
+		firsts = np.cumsum([0] + [len(chunk) for chunk in chunks[:-1]])
+		results = self.pool.map(evaluate_genomes, [(chunk, seed, generation, int(first), config) for chunk, first in zip(chunks, firsts)])
+		return np.concatenate([fitness for fitness, steps in results]), max(steps for fitness, steps in results)
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+		self.shm.close()
+		self.shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,258 @@
+import numpy as np
+import pyglet
+
+import rng
+import neural
+from timing import timings, now
+from car import SensorRig, rig_config, update_population, finish_open_track, find_population_distances, population_linecoords, population_lines, MAX_STEERING
+from cext import cmodule
+
+def column(name, cast=float):
+	def get(self):
+		return cast(getattr(self.population, name)[self.idx])
+
+	def set(self, value):
+		getattr(self.population, name)[self.idx] = value
+
+	return property(get, set)
+
+class CarView(object):
+	# Stands in for a Car where code needs one object per car,
+	# all the data lives in the PopulationState columns.
+	__slots__ = ('population', 'idx')
+
+	def __init__(self, population, idx):
+		self.population = population
+		self.idx = idx
+
+	x = column('x')
+	y = column('y')
+	rot = column('rot')
+	speed = column('speed')
+	steering = column('steering')
+	section_idx = column('section_idx', int)
+	laps = column('laps', int)
+	collided = column('collided', bool)
+	fitness = column('fitness')
+	time = column('time')
+
+	@property
+	def position(self):
+		return (self.x, self.y)
+
+	@property
+	def distances(self):
+		return self.population.distances[self.idx]
+
+	def accelerate(self, diff):
+		self.population.accelerate(diff, self.idx)
+
+	def change_section(self, idx):
+		self.section_idx = idx % self.population.track.length
+
+	def draw_sensors(self):
+		rig = self.population.rig
+		angles = rig.angles + self.rot
+		points = np.stack((self.x + np.sin(angles) * self.distances, self.y + np.cos(angles) * self.distances), axis=-1)
+		pyglet.gl.glLoadIdentity()
+		pyglet.gl.glPointSize(5)
+		pyglet.graphics.draw(rig.size, pyglet.gl.GL_POINTS,
+			('v2f', tuple(points.ravel())))
+
+	def __repr__(self):
+		return "Car %d at (%.1f, %.1f), section %d" % (self.idx, self.x, self.y, self.section_idx)
+
+class PopulationState(object):
+	# The whole population as contiguous columns, one element per car.
+	# All cars share one sensor rig and their networks are a single
+	# PopulationNetwork, so a step is a handful of batched calls.
+	max_speed = 150
+	stall_time = 10 # retire cars that got no further for this many seconds, 0 never does
+	min_speed = 0 # and the ones slower than this on average after stall_time
+	threads = 1 # for the C step, 0 uses one per core
+
+	def __init__(self, size, sensors=0, rig=None, layers=neural.LAYERS, activation='tanh', bias=0, genomes=None, seed=0):
+		# rig is an (angles, distances) pair overriding the sensors setting,
+		# seed keys the random weights and starting positions, see rng.py
+		self.size = size
+		self.seed = seed
+		self.track = None
+		self.autopilot = True # steer with the networks
+
+		self.x = np.zeros(size)
+		self.y = np.zeros(size)
+		self.rot = np.zeros(size)
+		self.speed = np.zeros(size)
+		self.steering = np.zeros(size)
+		self.section_idx = np.zeros(size, dtype=np.int32)
+		self.laps = np.zeros(size, dtype=np.int32)
+		self.collided = np.zeros(size, dtype=bool) # or retired, done for this generation
+		self.stalled = np.zeros(size, dtype=bool) # retired for not getting anywhere
+		self.fitness = np.zeros(size)
+		self.best = np.zeros(size) # best fitness so far
+		self.progress_time = np.zeros(size) # time the best fitness was reached
+		self.distance = np.zeros(size) # distance driven
+		self.time = np.zeros(size) # time alive in the current generation
+		self.changes = np.zeros(size, dtype=np.int32)
+		self.positions = np.zeros((size, 2))
+		self.active = np.arange(size, dtype=np.int32) # cars still driving, see compact()
+
+		self.rig = SensorRig(None, *(rig or rig_config(sensors)))
+		self.distances = np.empty((size, self.rig.size))
+		self.network = neural.PopulationNetwork(size, 1 + self.rig.size, *layers, activation=activation, bias=bias,
+			genomes=genomes, seed=seed)
+
+	def __len__(self):
+		return self.size
+
+	def config(self):
+		# the rig and network settings, PopulationState(size, seed=seed, **config)
+		# makes cars that drive like these given the same genomes
+		network = self.network
+		return dict(rig=(tuple(map(float, self.rig.angles)), tuple(map(float, self.rig.max_distances))),
+			layers=tuple(neurons for neurons, inputs in network.shapes[1:]),
+			activation=network.activation, bias=network.bias)
+
+	def view(self, idx):
+		return CarView(self, idx)
+
+	def views(self):
+		return [CarView(self, i) for i in range(self.size)]
+
+	def put_on_track(self, track, speed=0, generation=0, first=0):
+		# first is the index of the first car when this is part of a population
+		self.track = track
+		x, y, rot = track.start
+		offsets = rng.uniform(self.seed, generation, first, self.size, 1, rng.STREAM_START)[:, 0]
+		self.x[:] = x + offsets * 30 - 15
+		self.y[:] = y
+		self.rot[:] = rot
+		self.speed[:] = 0
+		self.steering[:] = 0
+		self.section_idx[:] = 0
+		self.laps[:] = 0
+		self.collided[:] = False
+		self.stalled[:] = False
+		self.fitness[:] = 0
+		self.best[:] = 0
+		self.progress_time[:] = 0
+		self.distance[:] = 0
+		self.time[:] = 0
+		self.distances[:] = self.rig.max_distances
+		self.active = np.arange(self.size, dtype=np.int32) # cars still driving
+		if speed:
+			self.accelerate(speed)
+
+	def accelerate(self, diff, idx=slice(None)):
+		# same as Car.accelerate, for every car or the given ones
+		new_speed = self.speed[idx] + diff
+		self.speed[idx] = np.copysign(np.minimum(self.max_speed, np.abs(new_speed)), new_speed)
+
+	def compact(self):
+		# drops the cars that collided or retired since the last call from active
+		self.active = self.active[~self.collided[self.active]]
+
+	def step(self, dt):
+		# Only the active cars are looked at, so a step costs O(alive) and
+		# dead cars cost nothing. Whole slices are used while all are alive.
+		if not len(self.active):
+			return
+		full = len(self.active) == self.size
+		active = None if full else self.active
+		idx = slice(None) if full else self.active
+		self.time[idx] += dt
+		sensed = self.kernel_step(dt, active)
+		if not sensed:
+			update_population(self.track, self.x, self.y, self.rot, self.speed, self.steering,
+				self.section_idx, self.collided, self.changes, dt, active)
+		changes, sections = self.changes[idx], self.section_idx[idx]
+		laps = self.laps[idx] + ((changes > 0) & (sections == 0)) - ((changes < 0) & (sections == self.track.length - 1))
+		self.laps[idx] = laps
+		self.fitness[idx] = laps * self.track.length + sections
+		if self.stall_time:
+			self.retire_stalled(idx, dt)
+		self.compact()
+		if sensed or not len(self.active):
+			return
+
+		start = now()
+		full = len(self.active) == self.size
+		active = None if full else self.active
+		idx = slice(None) if full else self.active
+		self.positions[idx, 0] = self.x[idx]
+		self.positions[idx, 1] = self.y[idx]
+		find_population_distances(self.track, self.rig, self.positions, self.rot, self.section_idx, self.distances, active)
+		start = timings.add('sensors', start)
+		if self.autopilot:
+			inputs = np.concatenate((self.speed[idx, None], self.distances[idx]), axis=1)
+			self.steering[idx] = MAX_STEERING * self.network.activate(inputs, active)[:, 0]
+			timings.add('inference', start)
+
+	def in_c(self):
+		# whether the C kernels can step this population, they only know tanh
+		# networks and don't time the stages on their own, see Timings
+		network = self.network
+		return bool(cmodule) and not timings.per_stage and (not self.autopilot or
+			(network.activation == 'tanh' and network.genomes.dtype == float))
+
+	def kernel_step(self, dt, active):
+		# Physics, sensors and inference of the active cars in a single C
+		# call that runs on self.threads threads without the GIL, timed as
+		# kernel. Returns False where that is not possible (pure Python or
+		# networks the C code can't evaluate) and nothing was done.
+		if not self.in_c():
+			return False
+		start = now()
+		network = self.network
+		cmodule.step_population(self.track.ctrack, self.rig.crig, self.x, self.y, self.rot, self.speed, self.steering,
+			self.section_idx, self.collided, self.changes, self.distances, dt,
+			network.genomes if self.autopilot else None, [neurons for neurons, inputs in network.shapes],
+			network.bias, MAX_STEERING, active, self.threads)
+		if not self.track.circular:
+			finish_open_track(self.track, self.section_idx, self.collided, self.changes, active)
+		timings.add('kernel', start)
+		return True
+
+	def retire_stalled(self, idx, dt):
+		# Cars going in circles or standing still would keep the generation
+		# going forever, they are done with the fitness they have.
+		fitness, time = self.fitness[idx], self.time[idx]
+		improved = fitness > self.best[idx]
+		self.best[idx] = np.where(improved, fitness, self.best[idx])
+		progress_time = self.progress_time[idx] = np.where(improved, time, self.progress_time[idx])
+		stalled = time - progress_time > self.stall_time
+		if self.min_speed:
+			distance = self.distance[idx] = self.distance[idx] + np.abs(self.speed[idx]) * dt
+			stalled |= (time > self.stall_time) & (distance < self.min_speed * time)
+		stalled &= ~self.collided[idx]
+		self.stalled[idx] |= stalled
+		self.collided[idx] |= stalled
+		self.speed[idx] = np.where(stalled, 0, self.speed[idx])
+
+	def run(self, dt, max_steps=None):
+		# steps until every car has collided or max_steps, returns the number of steps
+		if self.in_c():
+			return self.rollout(dt, max_steps)
+		steps = 0
+		while len(self.active) and steps != max_steps:
+			self.step(dt)
+			steps += 1
+		return steps
+
+	def rollout(self, dt, max_steps=None):
+		# run() in a single C call, every car is driven to its end on its own
+		start = now()
+		network = self.network
+		steps = cmodule.rollout(self.track.ctrack, self.rig.crig, self, dt, -1 if max_steps is None else max_steps,
+			network.genomes if self.autopilot else None, [neurons for neurons, inputs in network.shapes],
+			network.bias, MAX_STEERING, self.track.circular, self.stall_time, self.min_speed, self.active, self.threads)
+		self.compact()
+		timings.add('rollout', start)
+		return steps
+
+	def linecoords(self):
+		return population_linecoords(self.x, self.y, self.rot)
+
+	def lines(self, out, active=None):
+		# writes the sides of all cars, or the given ones, into out, see population_lines
+		return population_lines(self.x, self.y, self.rot, out, active)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from cext import cmodule
+
+# Counter-based random numbers keyed by (seed, generation, car index), the
+# same numbers as cext/rng.h: every key is hashed into the state of its own
+# splitmix64 stream and the n-th number is computed from n directly. Cars
+# get the same numbers whatever process or thread they are simulated in.
+
+STREAM_WEIGHTS = 0 # initial network weights
+STREAM_START = 1 # offsets of the starting positions
+
+MASK64 = (1 << 64) - 1
+GOLDEN_GAMMA = np.uint64(0x9e3779b97f4a7c15)
+
+def new_seed():
+	return int(np.random.SeedSequence().entropy) & MASK64
+
+def mix64(z):
+	with np.errstate(over='ignore'):
+		z = (z ^ (z >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+		z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+	return z ^ (z >> np.uint64(31))
+
+def keys(seed, generation, idxs):
+	idxs = np.asarray(idxs, dtype=np.uint64)
+	with np.errstate(over='ignore'):
+		z = mix64(np.array(seed & MASK64, dtype=np.uint64) + GOLDEN_GAMMA)
+		z = mix64(z + np.uint64(generation & MASK64) + GOLDEN_GAMMA)
+		return mix64(z + idxs + GOLDEN_GAMMA)
+
+def uniform(seed, generation, first, count, n, stream, out=None):
+	# (count, n) numbers in [0, 1), row i from the stream of the key
+	# (seed, generation, first + i)
+	out = np.empty((count, n)) if out is None else out
+	if cmodule:
+		cmodule.random_uniform(seed & MASK64, generation, first, stream, count, n, out)
+		return out
+	counters = (np.uint64(stream) << np.uint64(32)) | np.arange(n, dtype=np.uint64)
+	with np.errstate(over='ignore'):
+		bits = mix64(keys(seed, generation, np.arange(first, first + count))[:, None] + (counters + np.uint64(1)) * GOLDEN_GAMMA)
+	out[:] = (bits >> np.uint64(11)) * 2.0 ** -53
+	return out
+
+def generator(seed, generation=0):
+	# numpy Generator for whole-population draws of one generation
+	return np.random.Generator(np.random.Philox(key=(seed & MASK64) | (generation & MASK64) << 64))
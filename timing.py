@@ -0,0 +1,115 @@
+import csv
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+
+now = time.perf_counter_ns
+
+class StageTimer(object):
+	# Last `size` durations of one stage in ns, in a ring buffer
+	__slots__ = ('name', 'samples', 'count', 'total')
+
+	def __init__(self, name, size=1024):
+		self.name = name
+		self.samples = np.zeros(size, dtype=np.int64)
+		self.count = 0 # samples ever added
+		self.total = 0
+
+	def add(self, ns):
+		self.samples[self.count % len(self.samples)] = ns
+		self.count += 1
+		self.total += ns
+
+	def values(self):
+		return self.samples[:min(self.count, len(self.samples))]
+
+	def histogram(self):
+		# counts of samples in power of two buckets, [edges[i], edges[i+1]) ns
+		values = np.maximum(self.values(), 1)
+		buckets = np.floor(np.log2(values)).astype(int)
+		low, high = buckets.min(), buckets.max()
+		counts = np.bincount(buckets - low, minlength=high - low + 1)
+		return [int(2 ** b) for b in range(low, high + 2)], counts.tolist()
+
+	def summary(self):
+		values = self.values()
+		if not len(values):
+			return {'count': 0}
+		p50, p95, p99 = np.percentile(values, (50, 95, 99))
+		edges, counts = self.histogram()
+		return {
+			'count': self.count,
+			'window': len(values),
+			'mean_ns': float(values.mean()),
+			'p50_ns': float(p50),
+			'p95_ns': float(p95),
+			'p99_ns': float(p99),
+			'min_ns': int(values.min()),
+			'max_ns': int(values.max()),
+			'total_ns': self.total,
+			'histogram': {'edges_ns': edges, 'counts': counts},
+		}
+
+class Timings(object):
+	# Named stage timers. Code takes start = now() and calls
+	# add(name, start) when the stage is done, or uses measure(name).
+	# The C kernels step a population in one call (step_population per
+	# frame, rollout per generation) and are only timed as 'kernel' and
+	# 'rollout'. With per_stage set, populations take the slower path of one
+	# call per stage instead, so 'physics' (move and collide in C, 'collision'
+	# on its own in Python), 'sensors' and 'inference' get their own timers.
+	def __init__(self, size=1024):
+		self.size = size
+		self.enabled = True
+		self.per_stage = False
+		self.stages = {}
+
+	def stage(self, name):
+		if name not in self.stages:
+			self.stages[name] = StageTimer(name, self.size)
+		return self.stages[name]
+
+	def add(self, name, start):
+		# records now() - start, returns now() to chain stages
+		end = now()
+		if self.enabled:
+			self.stage(name).add(end - start)
+		return end
+
+	@contextmanager
+	def measure(self, name):
+		start = now()
+		yield
+		self.add(name, start)
+
+	def reset(self):
+		self.stages.clear()
+
+	def summary(self):
+		return {name: stage.summary() for name, stage in self.stages.items()}
+
+	def table(self, names=None):
+		lines = []
+		for name in names or self.stages:
+			if name in self.stages and self.stages[name].count:
+				s = self.stages[name].summary()
+				lines.append("%-10s p50=%8.1fus p95=%8.1fus p99=%8.1fus max=%8.1fus (%d)" % (
+					name, s['p50_ns'] / 1000, s['p95_ns'] / 1000, s['p99_ns'] / 1000, s['max_ns'] / 1000, s['count']))
+		return "\n".join(lines)
+
+	def dump(self, path):
+		# JSON or, for .csv paths, one row per stage without the histograms
+		summary = self.summary()
+		if path.endswith('.csv'):
+			fields = ['stage', 'count', 'window', 'mean_ns', 'p50_ns', 'p95_ns', 'p99_ns', 'min_ns', 'max_ns', 'total_ns']
+			with open(path, 'w', newline='') as f:
+				writer = csv.DictWriter(f, fields, extrasaction='ignore')
+				writer.writeheader()
+				for name, stage in summary.items():
+					writer.writerow(dict(stage, stage=name))
+		else:
+			with open(path, 'w') as f:
+				json.dump(summary, f, indent='\t')
+
+timings = Timings() # the registry the simulation records into
@@ -1,11 +1,120 @@
+import os
 import math
+import json
+import struct
+import hashlib
+import numpy as np
 import pyglet
-from pyglet.graphics.vertexbuffer import VertexBufferObject
 import geometry
 from geometry import Point, Line, Box, Quad
 from drawables import *
+from pyglet.graphics.vertexbuffer import VertexBufferObject
 from cext import cmodule
 
+# Track files are JSON: the default section width, whether the last point
+# connects back to the first section, the first section as the (x, y) of
+# its top left corner and its length, and the points along the left border
+# of the track, each an [x, y] pair or [x, y, width] for a section of its
+# own width. Instead of start and points a file can give 'centreline', the
+# points along the middle of the track in the same form, see border_layout.
+DEFAULT_LAYOUT = {
+	'width': 75,
+	'circular': True,
+	'start': [0, 50, 50],
+	'points': [[0, 100], [20, 150], [50, 250], [100, 260], [160, 230],
+		[180, 180], [180, 120], [200, 50], [200, 20],
+		[100, -120], [20, -90], [0, -40]],
+}
+
+# The section array built from a track file is cached next to it as
+# <path>.sections: magic, sha1 of the track file, number of sections,
+# zero padding up to CACHE_ALIGN bytes and the (length, 21) float64 array.
+SECTION_DOUBLES = 21
+SECTION_COLOUR = (200/255, 200/255, 200/255)
+CACHE_MAGIC = b'NCTRACK\x00'
+CACHE_ALIGN = 64
+
+def border_layout(layout):
+	# The start and left border points of a layout given by its centreline.
+	# Every centre point moves half its width to the left along the bisector
+	# of its neighbouring sections, and the track is turned and moved so the
+	# first section is an upright box with its bottom left corner at (0, 0).
+	if 'centreline' not in layout:
+		return layout
+	centreline = layout['centreline']
+	if len(centreline) < 3:
+		raise ValueError("A centreline needs at least 3 points")
+	circular = layout['circular']
+	points = np.array([point[:2] for point in centreline], dtype=float)
+	widths = np.array([point[2] if len(point) > 2 else layout['width'] for point in centreline], dtype=float)
+	ends = np.roll(points, -1, axis=0)
+	if not circular:
+		ends[-1] = 2 * points[-1] - points[-2] # the last point goes on straight
+	directions = ends - points
+	directions /= np.hypot(directions[:, 0], directions[:, 1])[:, None]
+	normals = directions + np.roll(directions, 1, axis=0)
+	if not circular:
+		normals[0] = directions[0]
+	normals = np.stack((-normals[:, 1], normals[:, 0]), axis=-1)
+	normals /= np.hypot(normals[:, 0], normals[:, 1])[:, None]
+	left = points + normals * widths[:, None] / 2
+
+	dx, dy = left[1] - left[0]
+	angle = np.arctan2(dx, dy)
+	rotation = np.array(((np.cos(angle), -np.sin(angle)), (np.sin(angle), np.cos(angle))))
+	left = (left - left[0]) @ rotation.T
+	length = float(left[1, 1])
+	points = [[float(x), float(y)] + list(point[2:]) for (x, y), point in zip(left[2:], centreline[2:])]
+	layout = {key: value for key, value in layout.items() if key != 'centreline'}
+	layout.update(start=[0.0, length, length], points=points)
+	return layout
+
+def load_layout(path):
+	with open(path, 'rb') as f:
+		data = f.read()
+	return json.loads(data.decode()), hashlib.sha1(data).digest()
+
+def cache_offset():
+	offset = len(CACHE_MAGIC) + 20 + 4
+	return offset + -offset % CACHE_ALIGN
+
+def read_cache(path, digest):
+	# memory-mapped section array, None if missing or made from another file
+	try:
+		with open(path, 'rb') as f:
+			if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC or f.read(20) != digest:
+				return None
+			length, = struct.unpack('<I', f.read(4))
+			return np.memmap(f, dtype='<f8', mode='r', offset=cache_offset(), shape=(length, SECTION_DOUBLES))
+	except (OSError, ValueError, struct.error):
+		return None
+
+def write_cache(path, digest, sections):
+	# a read-only directory only means there is no cache next time
+	offset = len(CACHE_MAGIC) + 20 + 4
+	tmp = path + '.tmp'
+	try:
+		with open(tmp, 'wb') as f:
+			f.write(CACHE_MAGIC)
+			f.write(digest)
+			f.write(struct.pack('<I', len(sections)))
+			f.write(b'\x00' * (cache_offset() - offset))
+			np.ascontiguousarray(sections, dtype='<f8').tofile(f)
+		os.replace(tmp, path)
+	except OSError:
+		pass
+
+def section_change(sections, pos, idx):
+	# TrackSection.changed_section on a row of a section array
+	front, back, left = (tuple(sections[idx, i:i+4]) for i in (0, 4, 8))
+	next_line = (pos[0], pos[1], left[2] + left[2] - left[0], left[3] + left[3] - left[1])
+	prev_line = (pos[0], pos[1], left[0] - left[2] + left[0], left[1] - left[3] + left[1])
+	if not geometry.segment_line_intersection(next_line, front):
+		return 1
+	elif not geometry.segment_line_intersection(prev_line, back):
+		return -1
+	return 0
+
 class TrackSection(Entity):
 	def __init__(self, quad=None, line=None, width=50, section=None, point=None):
 		super().__init__()
@@ -42,7 +151,7 @@ class TrackSection(Entity):
 			raise ValueError("Either quad or line with width must be provided to built a Track Section")
 
 		self.colour = (100,100,100)
-		self.colour = (200/255,200/255,200/255)
+		self.colour = SECTION_COLOUR
 		self.length = self.line.length
 		self.rotated_corners()
 		self.make_box()
@@ -124,45 +233,74 @@ class TrackSection(Entity):
 		return False
 
 class Track(Entity):
-	def __init__(self):
+	# Everything the simulation needs comes from the section array, the
+	# Python sections are only built when something asks for them. A
+	# track loaded from a file gets its array from the sidecar cache.
+	def __init__(self, path=None, cache=True, layout=None):
 		super().__init__()
-		self.sections = []
-		self.width = 75
-		self.circular = False
-
-		self.make_track_new()
-		self.length = len(self.sections)
+		self.path = path
+		digest = None
+		if path:
+			self.layout, digest = load_layout(path)
+		else:
+			self.layout = layout or DEFAULT_LAYOUT
+		self.layout = border_layout(self.layout)
+		self.width = self.layout['width']
+		self.circular = self.layout['circular']
+		self._sections = None
+		self._array = None
+		if path and cache:
+			self._array = read_cache(path + '.sections', digest)
+			if self._array is None:
+				write_cache(path + '.sections', digest, self.section_array())
+		self.length = len(self.section_array())
 		if cmodule:
-			self.caddr = self.set_ctrack()
-
-		self.init_vbo()
+			self.ctrack = self.set_ctrack()
 
-	def __del__(self):
-		if cmodule:
-			cmodule.delete_track(self.caddr)
+		self.vert_vbo = None # created on first draw, headless runs have no GL context
+		self._geometry = None
 
 	def set_ctrack(self):
+		return cmodule.Track(self.section_array())
+
+	@property
+	def sections(self):
+		if self._sections is None:
+			self._sections = []
+			self.make_track_new()
+		return self._sections
+
+	def section_array(self):
+		# (length, 21) array of front, back, left, right and line coords and
+		# the line angle of every section, the layout of C track sections
 		def section_to_array(section):
-			out = []
-			out.append(section.quad.front.coords)
-			out.append(section.quad.back.coords)
-			out.append(section.quad.left.coords)
-			out.append(section.quad.right.coords)
-			out.append(section.quad.line.coords)
-			out.append(section.quad.line.angle)
-			return out
-		sections = [section_to_array(sec) for sec in self.sections]
-		return cmodule.store_track(sections)
+			quad = section.quad
+			return quad.front.coords + quad.back.coords + quad.left.coords + quad.right.coords + quad.line.coords + (quad.line.angle,)
+		if self._array is None:
+			self._array = np.array([section_to_array(sec) for sec in self.sections], dtype=float)
+		return self._array
+
+	def save(self, path):
+		with open(path, 'w') as f:
+			json.dump(self.layout, f, indent='\t')
+
+	@property
+	def start(self):
+		# position and rotation cars start from, the centre of the first section
+		line = self.section_array()[0, 16:20]
+		return (line[0] + line[2]) / 2, (line[1] + line[3]) / 2, self.section_array()[0, 20]
 
 	def init_vbo(self):
 		self.vert_vbo = VertexBufferObject(self.length * 32, GL_ARRAY_BUFFER, GL_DYNAMIC_DRAW)
 		self.col_vbo = VertexBufferObject(self.length * 48, GL_ARRAY_BUFFER, GL_DYNAMIC_DRAW)
-		self.coords = Vec(*sum((s.get_vertices() for s in self.sections), ()))
-		self.colours = Vec(*sum((s.get_colours() for s in self.sections), ()))
+		self.coords = Vec(*self.section_array()[:, 8:16].ravel()) # left and right borders
+		self.colours = Vec(*(SECTION_COLOUR * 4 * self.length))
 		self.vert_vbo.set_data(self.coords)
 		self.col_vbo.set_data(self.colours)
 
 	def draw(self):
+		if not self.vert_vbo:
+			self.init_vbo()
 		glMatrixMode(GL_MODELVIEW)
 		glPushMatrix()
 
@@ -196,20 +334,19 @@ class Track(Entity):
 		self.add_section(section=self.sections[-1], point=(105, 420))
 
 	def make_track_new(self):
-		#points = [(0, 100), (20, 150), (50, 250), (100, 280), (150, 300)]
-		points = [(0, 100), (20, 150), (50, 250), (100, 260), (160, 230),
-				(180,180), (180, 120), (200, 50), (200, 20), 
-				(100, -120), (20, -90), (0, -40)]
-		prev_quad = Quad(box=Box(0, 50, self.width, 50))
+		# sections of self.layout
+		x, y, length = self.layout['start']
+		prev_quad = Quad(box=Box(x, y, self.width, length))
 		#prev_quad = Quad(coords=((0,0),(0,self.width),(0,50),(self.width,50)))
-		for point in points:
-			prev_quad, new_quad = self.make_section_quad(point, prev_quad)
+		for point in self.layout['points']:
+			width = point[2] if len(point) > 2 else None
+			prev_quad, new_quad = self.make_section_quad(point[:2], prev_quad, width)
 			self.add_section(quad=prev_quad)
 			prev_quad = new_quad
 		self.add_section(quad=prev_quad)
-		quad = Quad(coords=(prev_quad.top_left, prev_quad.top_right, self.sections[0].quad.bottom_left, self.sections[0].quad.bottom_right))
-		self.add_section(quad)
-		self.circular = True
+		if self.circular:
+			quad = Quad(coords=(prev_quad.top_left, prev_quad.top_right, self.sections[0].quad.bottom_left, self.sections[0].quad.bottom_right))
+			self.add_section(quad)
 
 	def make_section_quad(self, point, previous, width=None):
 		width = width or self.width
@@ -249,36 +386,39 @@ class Track(Entity):
 
 	def check_car_collision(self, car):
 		if cmodule:
-			return cmodule.check_car_collision(car.x, car.y, car.rot, car.section_idx)
-		box = car.lines[1:4:2] # left and right sides only
-		#box = car.lines
-		for line in box:
-			if self.find_intersection(line, car.section_idx):
-				return True
-
-	def find_intersection(self, line, idx):
-		prev_border = None
-		while True:
-			if idx < 0:
-				idx += self.length
-			elif idx >= self.length:
-				idx -= self.length
-
-			quad = self.sections[idx].quad
-			point = geometry.segment_intersection(line, quad.leftt)
-			if point:
-				return point
-			point = geometry.segment_intersection(line, quad.rightt)
-			if point:
-				return point
-
-			if prev_border != "back" and geometry.segment_intersection(line, quad.frontt, False):
-				prev_border = "front"
-				idx += 1
-			elif prev_border != "front" and geometry.segment_intersection(line, quad.backt, False):
-				prev_border = "back"
-				idx -= 1
-			else:
-				break
-
-
+			return cmodule.check_car_collision(self.ctrack, car.x, car.y, car.rot, car.section_idx)
+		if self.geometry.collisions(car.lines).any():
+			return True
+
+	@property
+	def geometry(self):
+		# the sections as arrays for the vectorised fallbacks, see geometry.TrackGeometry
+		if self._geometry is None:
+			self._geometry = geometry.TrackGeometry(self.section_array())
+		return self._geometry
+
+	@property
+	def borders(self):
+		# (length, 4, 4) array of front, back, left and right borders of every section
+		return self.geometry.segments[:, :4]
+
+	@property
+	def grid(self):
+		# spatial index over the walls, left and right borders of every section
+		return self.geometry.grid
+
+	def find_intersections(self, lines, idxs=None):
+		# Closest wall hit of every line as an (n, 2) array of points, NaN
+		# for the lines that don't hit any. Sections don't matter any more
+		# with the grid, idxs is kept for existing callers.
+		return self.geometry.find_intersections(lines)
+
+	def find_intersection(self, line, idx=None):
+		return self.grid.intersection(line)
+
+	def changed_section(self, pos, idx):
+		return section_change(self.section_array(), pos, idx)
+
+	def changed_sections(self, positions, idxs):
+		# changed_section of many (n, 2) positions at once
+		return self.geometry.section_changes(positions, idxs)
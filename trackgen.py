@@ -0,0 +1,82 @@
+import argparse
+import numpy as np
+
+import geometry
+from track import Track
+
+def generate_layout(sections=100, width=75, section_length=50, curviness=0.5, bend=20, seed=0):
+	# Centreline layout of a closed anticlockwise circuit of the given number
+	# of sections (see track.DEFAULT_LAYOUT and track.border_layout). The heading turns once around
+	# plus smooth random noise with wiggles about `bend` sections long,
+	# curviness scales the noise from 0 (an oval) to 1 (up to +-90 degrees).
+	if sections < 4:
+		raise ValueError("A circuit needs at least 4 sections")
+	rng = np.random.default_rng(seed)
+	t = np.arange(sections) / sections
+	freqs = np.arange(1, min(max(2, sections // bend), sections // 2) + 1)
+	amplitudes = rng.normal(size=len(freqs)) / freqs
+	phases = rng.uniform(0, 2 * np.pi, len(freqs))
+	spectrum = np.zeros(sections // 2 + 1, dtype=complex)
+	spectrum[freqs] = amplitudes * np.exp(1j * phases)
+	noise = np.fft.irfft(spectrum, sections)
+	noise -= noise[0]
+	noise /= max(np.abs(noise).max(), 1e-9)
+	heading = 2 * np.pi * t + curviness * np.pi / 2 * noise # anticlockwise from +y
+
+	steps = section_length * np.stack((-np.sin(heading), np.cos(heading)), axis=-1)
+	steps -= steps.mean(axis=0) # close the loop
+	centre = np.concatenate((np.zeros((1, 2)), np.cumsum(steps[:-1], axis=0)))
+	return {
+		'width': width,
+		'circular': True,
+		'centreline': np.round(centre, 6).tolist(),
+	}
+
+def find_overlaps(track, chunk=10000):
+	# (section, section) pairs of walls that cross, walls of the same and of
+	# neighbouring sections share corners and are not counted
+	walls = track.borders[:, 2:].reshape(-1, 4)
+	pairs = [np.empty((0, 2), dtype=int)]
+	for offset in range(0, len(walls), chunk): # bounded memory on huge tracks
+		owners, segments = track.grid.candidates(walls[offset:offset+chunk])
+		owners += offset
+		keep = owners < segments
+		owners, segments = owners[keep], segments[keep]
+		_, hit = geometry.intersections(walls[owners], walls[segments])
+		first, second = owners[hit] // 2, segments[hit] // 2
+		apart = np.abs(first - second)
+		apart = np.minimum(apart, track.length - apart)
+		pairs.append(np.stack((first, second), axis=-1)[apart > 1])
+	return np.unique(np.concatenate(pairs), axis=0)
+
+def generate_track(sections=100, width=75, section_length=50, curviness=0.5, bend=20, seed=0, attempts=10):
+	# Track from generate_layout without overlapping walls, later attempts
+	# use the seeds after the given one and halve the curviness
+	for attempt in range(attempts):
+		layout = generate_layout(sections, width, section_length, curviness, bend, seed + attempt)
+		track = Track(layout=layout)
+		if not len(find_overlaps(track)):
+			return track
+		curviness /= 2
+	raise ValueError("No circuit without overlaps in %d attempts" % attempts)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+		description="Generate a track file to use with main.py --track")
+	parser.add_argument('path', help="Track file to write")
+	parser.add_argument('-n', '--sections', action="store", type=int, default=100,
+		help="Number of sections")
+	parser.add_argument('--width', action="store", type=float, default=75,
+		help="Track width")
+	parser.add_argument('--length', action="store", type=float, default=50,
+		help="Length of a section")
+	parser.add_argument('--curviness', action="store", type=float, default=0.5,
+		help="How much the heading wanders off a plain oval, 0 to 1")
+	parser.add_argument('--bend', action="store", type=int, default=20,
+		help="Typical number of sections in a bend")
+	parser.add_argument('--seed', action="store", type=int, default=0)
+	args = parser.parse_args()
+
+	track = generate_track(args.sections, args.width, args.length, args.curviness, args.bend, args.seed)
+	track.save(args.path)
+	print("%d sections written to %s" % (track.length, args.path))